@@ -14,7 +14,7 @@ class NotificationLogAdmin(admin.ModelAdmin):
             'fields': ('user', 'reminder', 'notification_type', 'method')
         }),
         ('Status', {
-            'fields': ('status', 'sent_at', 'error_message')
+            'fields': ('status', 'sent_at', 'error_message', 'attempts', 'deferrals', 'next_retry_at', 'claimed_at')
         }),
         ('Timestamp', {
             'fields': ('created_at',)
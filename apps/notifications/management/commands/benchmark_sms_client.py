@@ -0,0 +1,110 @@
+# apps/notifications/management/commands/benchmark_sms_client.py
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+
+TEST_ACCOUNT_SID = 'AC' + '0' * 32
+
+
+class TwilioStandInHandler(BaseHTTPRequestHandler):
+    """Answers message creates like the Twilio API, with keep-alive"""
+    
+    protocol_version = 'HTTP/1.1'
+    # Write each response in one segment so keep-alive is not held up by Nagle
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+    
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = json.dumps({
+            'sid': 'SM' + '0' * 32,
+            'account_sid': TEST_ACCOUNT_SID,
+            'status': 'queued',
+        }).encode()
+        
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare SMS throughput of a new Twilio client per message against one '
+        'cached, pooled client, using a local stand-in for the Twilio API'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=500, help='Messages sent per run (default 500)')
+        parser.add_argument('--output', help='Also write the results to this JSON file')
+    
+    def handle(self, *args, **options):
+        from twilio.http.http_client import TwilioHttpClient
+        from twilio.rest import Client
+        
+        server = ThreadingHTTPServer(('127.0.0.1', 0), TwilioStandInHandler)
+        server.daemon_threads = True
+        server.connections = 0
+        base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        
+        def point_at_stand_in(client):
+            client.api.base_url = base_url
+            return client
+        
+        def new_client():
+            # What SMSService did before: a client and connection per message
+            return point_at_stand_in(Client(TEST_ACCOUNT_SID, 'token'))
+        
+        cached_client = point_at_stand_in(
+            Client(TEST_ACCOUNT_SID, 'token', http_client=TwilioHttpClient(pool_connections=True))
+        )
+        
+        try:
+            results = {
+                'messages': options['messages'],
+                'client_per_message': self._run(server, new_client, options['messages']),
+                'cached_client': self._run(server, lambda: cached_client, options['messages']),
+            }
+        finally:
+            server.shutdown()
+            server.server_close()
+        
+        speedup = results['cached_client']['messages_per_second'] / results['client_per_message']['messages_per_second']
+        results['speedup'] = round(speedup, 2)
+        
+        for name in ('client_per_message', 'cached_client'):
+            result = results[name]
+            self.stdout.write(
+                f"{name}: {result['messages_per_second']} messages/s, "
+                f"{result['connections']} connections"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Cached client is {results['speedup']}x faster"))
+        
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+    
+    def _run(self, server, get_client, messages):
+        connections_before = server.connections
+        started = time.monotonic()
+        
+        for _ in range(messages):
+            get_client().messages.create(body='Benchmark', from_='+15005550006', to='+15005550006')
+        
+        elapsed = time.monotonic() - started
+        return {
+            'seconds': round(elapsed, 3),
+            'messages_per_second': round(messages / elapsed, 1),
+            'connections': server.connections - connections_before,
+        }
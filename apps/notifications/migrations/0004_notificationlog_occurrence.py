@@ -0,0 +1,20 @@
+# Generated by Django 5.2.9 on 2026-10-16 22:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0003_initial'),
+        ('reminders', '0004_doseoccurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationlog',
+            name='occurrence',
+            field=models.ForeignKey(blank=True, help_text='Dose occurrence this notification was sent for', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='notification_logs', to='reminders.doseoccurrence'),
+        ),
+    ]
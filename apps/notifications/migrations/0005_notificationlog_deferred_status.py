@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_notificationlog_occurrence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notificationlog',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed'), ('deferred', 'Deferred')], db_index=True, default='pending', max_length=10),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_notificationlog_deferred_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationlog',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Delivery attempts so far'),
+        ),
+        migrations.AddField(
+            model_name='notificationlog',
+            name='next_retry_at',
+            field=models.DateTimeField(blank=True, help_text='When a transient failure is retried next, if it is', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0006_notificationlog_retries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationlog',
+            name='deferrals',
+            field=models.PositiveSmallIntegerField(default=0, help_text='Times delivery was put off without trying because the provider was down'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0008_notificationlog_claimed_at'),
+        ('reminders', '0009_doseoccurrence_undispatched_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notificationlog',
+            index=models.Index(fields=['status', 'next_retry_at'], name='notificatio_status_64d90d_idx'),
+        ),
+    ]
@@ -1,7 +1,7 @@
 # apps/notifications/models.py
 from django.db import models
 from apps.users.models import CustomUser
-from apps.reminders.models import Reminder
+from apps.reminders.models import Reminder, DoseOccurrence
 
 
 class NotificationLog(models.Model):
@@ -20,8 +20,10 @@ class NotificationLog(models.Model):
     
     STATUS_CHOICES = [
         ('pending', 'Pending'),
+        ('sending', 'Sending'),
         ('sent', 'Sent'),
         ('failed', 'Failed'),
+        ('deferred', 'Deferred'),
     ]
     
     user = models.ForeignKey(
@@ -37,6 +39,14 @@ class NotificationLog(models.Model):
         blank=True,
         related_name='notification_logs'
     )
+    occurrence = models.ForeignKey(
+        DoseOccurrence,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='notification_logs',
+        help_text='Dose occurrence this notification was sent for'
+    )
     notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPE_CHOICES)
     method = models.CharField(max_length=20, choices=METHOD_CHOICES)
     status = models.CharField(
@@ -47,6 +57,21 @@ class NotificationLog(models.Model):
     )
     sent_at = models.DateTimeField(null=True, blank=True)
     error_message = models.TextField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0, help_text='Delivery attempts so far')
+    deferrals = models.PositiveSmallIntegerField(
+        default=0,
+        help_text='Times delivery was put off without trying because the provider was down'
+    )
+    next_retry_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='When a transient failure is retried next, if it is'
+    )
+    claimed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='When a sender claimed this notification, while it is being sent'
+    )
     
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     
@@ -59,6 +84,7 @@ class NotificationLog(models.Model):
             models.Index(fields=['user', 'created_at']),
             models.Index(fields=['status', 'created_at']),
             models.Index(fields=['notification_type', 'method']),
+            models.Index(fields=['status', 'next_retry_at']),
         ]
     
     def __str__(self):
@@ -12,9 +12,10 @@ class NotificationLogSerializer(serializers.ModelSerializer):
         model = NotificationLog
         fields = [
             'id', 'user_email', 'reminder_name', 'notification_type',
-            'method', 'status', 'sent_at', 'error_message', 'created_at'
+            'method', 'status', 'sent_at', 'error_message', 'attempts',
+            'deferrals', 'next_retry_at', 'claimed_at', 'created_at'
         ]
-        read_only_fields = ['id', 'created_at']
+        read_only_fields = ['id', 'attempts', 'deferrals', 'next_retry_at', 'claimed_at', 'created_at']
     
     def get_reminder_name(self, obj):
         if obj.reminder:
@@ -1,285 +1,1022 @@
 # apps/notifications/services.py
 import logging
+import math
+import random
+import smtplib
+import threading
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import partial
+import redis
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
+from datetime import timedelta
+from apps.notifications.models import NotificationLog
+from utils.redis_client import RedisCircuitBreaker, RedisTokenBucket
 
 logger = logging.getLogger(__name__)
 
+# Refusals the server will repeat on a fresh connection
+PERMANENT_SMTP_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+# Firebase error codes worth retrying
+TRANSIENT_FCM_CODES = {'UNAVAILABLE', 'INTERNAL', 'RESOURCE_EXHAUSTED', 'DEADLINE_EXCEEDED', 'UNKNOWN'}
+
+# Outcome of one send. success is None if it was skipped because the provider's
+# circuit is open; transient failures are worth retrying.
+SendResult = namedtuple('SendResult', ['success', 'error_message', 'transient'], defaults=[None, False])
+
+
+def is_transient_error(error):
+    """
+    Whether a provider error is worth retrying: dropped connections,
+    timeouts, throttling and server errors are, rejected messages are not.
+    """
+    # SMTP replies: 4xx is temporary, 5xx permanent
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    smtp_code = getattr(error, 'smtp_code', None)
+    if smtp_code is not None:
+        return 400 <= smtp_code < 500
+    
+    # TwilioRestException carries the HTTP status
+    status = getattr(error, 'status', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    
+    # FirebaseError carries a canonical error code
+    code = getattr(error, 'code', None)
+    if isinstance(code, str):
+        return code in TRANSIENT_FCM_CODES
+    
+    return isinstance(error, (OSError, TimeoutError))
+
 
 class EmailService:
-    """Service for sending email notifications"""
+    """
+    Service for sending email notifications.
+    
+    Each worker process keeps one SMTP connection open and sends every
+    message over it, instead of logging in again for each email. The
+    connection is closed once it has been idle for
+    EMAIL_CONNECTION_IDLE_SECONDS, before the server drops it, and is
+    reopened once if a send finds it broken. 5xx replies, including a
+    rejected login, are permanent failures and are not retried.
+    """
+    
+    _connection = None
+    _last_used = None
+    _lock = threading.Lock()
     
     @staticmethod
-    def send_dose_reminder(user, reminder, dose_schedule):
-        """Send dose reminder email"""
-        try:
-            subject = f"Medicine Reminder: {reminder.medicine_name}"
-            message = f"""
-                Hello {user.name or user.email},
+    def build_dose_message(user, reminder, dose_schedule):
+        """Build the dose reminder email"""
+        subject = f"Medicine Reminder: {reminder.medicine_name}"
+        message = f"""
+            Hello {user.name or user.email},
 
-                This is a reminder to take your medicine:
+            This is a reminder to take your medicine:
 
-                Medicine: {reminder.medicine_name}
-                Type: {reminder.get_medicine_type_display()}
-                Amount: {dose_schedule.amount}
-                Time: {dose_schedule.time.strftime('%I:%M %p')}
+            Medicine: {reminder.medicine_name}
+            Type: {reminder.get_medicine_type_display()}
+            Amount: {dose_schedule.amount}
+            Time: {dose_schedule.time.strftime('%I:%M %p')}
 
-                Remaining Quantity: {reminder.quantity}
+            Remaining Quantity: {reminder.quantity}
 
-                Best regards,
-                Medicine Reminder Team
-            """
-            
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                fail_silently=False,
-            )
-            
-            logger.info(f"Dose reminder email sent to {user.email} for {reminder.medicine_name}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to send dose reminder email to {user.email}: {str(e)}")
-            return False
+            Best regards,
+            Medicine Reminder Team
+        """
+        return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
     
     @staticmethod
-    def send_refill_reminder(user, reminder):
-        """Send refill reminder email"""
-        try:
-            subject = f"Refill Reminder: {reminder.medicine_name}"
-            message = f"""
-                Hello {user.name or user.email},
+    def build_refill_message(user, reminder):
+        """Build the refill reminder email"""
+        subject = f"Refill Reminder: {reminder.medicine_name}"
+        message = f"""
+            Hello {user.name or user.email},
 
-                Your medicine stock is running low!
+            Your medicine stock is running low!
 
-                Medicine: {reminder.medicine_name}
-                Current Quantity: {reminder.quantity}
-                Refill Threshold: {reminder.refill_threshold}
+            Medicine: {reminder.medicine_name}
+            Current Quantity: {reminder.quantity}
+            Refill Threshold: {reminder.refill_threshold}
 
-                Please refill your medicine soon to avoid running out.
+            Please refill your medicine soon to avoid running out.
 
-                Best regards,
-                Medicine Reminder Team
-            """
-            
-            send_mail(
-                subject=subject,
-                message=message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                fail_silently=False,
-            )
-            
-            logger.info(f"Refill reminder email sent to {user.email} for {reminder.medicine_name}")
-            return True
-            
+            Best regards,
+            Medicine Reminder Team
+        """
+        return EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
+    
+    @classmethod
+    def send_messages(cls, messages):
+        """
+        Send EmailMessages over this process's connection and return a
+        SendResult for each, in order. Once the SMTP circuit opens the
+        remaining messages are not tried.
+        """
+        results = []
+        with cls._lock:
+            for message in messages:
+                if ProviderCircuitBreaker.is_open('email'):
+                    results.append(SendResult(None, ProviderCircuitBreaker.unavailable_message('email'), True))
+                else:
+                    results.append(cls._send(message))
+        return results
+    
+    @classmethod
+    def get_connection(cls):
+        """Return this process's open SMTP connection, reopening it if idle too long"""
+        now = time.monotonic()
+        if cls._connection is not None and now - cls._last_used > settings.EMAIL_CONNECTION_IDLE_SECONDS:
+            cls.reset_connection()
+        
+        if cls._connection is None:
+            connection = get_connection(fail_silently=False)
+            try:
+                connection.open()
+            except Exception:
+                # A failed login leaves the socket open
+                cls._close(connection)
+                raise
+            cls._connection = connection
+        
+        cls._last_used = now
+        return cls._connection
+    
+    @classmethod
+    def reset_connection(cls):
+        """Close the cached connection; the next send opens a new one"""
+        connection, cls._connection = cls._connection, None
+        if connection is not None:
+            cls._close(connection)
+    
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
         except Exception as e:
-            logger.error(f"Failed to send refill reminder email to {user.email}: {str(e)}")
-            return False
+            logger.debug(f"Error closing SMTP connection: {str(e)}")
+    
+    @classmethod
+    def _send(cls, message):
+        for attempt in range(2):
+            try:
+                # One message per call so each gets its own result
+                cls.get_connection().send_messages([message])
+                ProviderCircuitBreaker.record('email', True)
+                return SendResult(True)
+            except PERMANENT_SMTP_ERRORS as e:
+                ProviderCircuitBreaker.record('email', True)
+                return SendResult(False, str(e), is_transient_error(e))
+            except smtplib.SMTPResponseException as e:
+                # A 5xx reply, like a rejected login, would be repeated on a new connection
+                if e.smtp_code >= 500:
+                    ProviderCircuitBreaker.record('email', True)
+                    return SendResult(False, str(e))
+                cls.reset_connection()
+                error = e
+            except OSError as e:
+                # The server dropped the connection or it went bad; reconnect once
+                cls.reset_connection()
+                error = e
+            except Exception as e:
+                return SendResult(False, str(e))
+        
+        ProviderCircuitBreaker.record('email', False)
+        return SendResult(False, str(error), True)
 
 
 class SMSService:
     """Service for sending SMS notifications via Twilio"""
     
-    @staticmethod
-    def send_dose_reminder(user, reminder, dose_schedule):
-        """Send dose reminder SMS"""
-        try:
-            from twilio.rest import Client
-            
+    _client = None
+    
+    @classmethod
+    def get_client(cls):
+        """
+        Return this worker's Twilio client, or None if Twilio is not configured.
+        The client is shared by all sends so they reuse one keep-alive
+        connection pool instead of paying a new TLS handshake each time.
+        """
+        if cls._client is None:
             if not settings.TWILIO_ACCOUNT_SID or not settings.TWILIO_AUTH_TOKEN:
-                logger.warning("Twilio credentials not configured")
-                return False
-            
-            client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-            
-            # Get user phone number
-            phone_number = user.phone_number
-            
-            if not phone_number:
-                logger.warning(f"User {user.email} does not have a phone number")
-                return False
+                return None
             
-            message = f"Medicine Reminder: Take {dose_schedule.amount} {reminder.medicine_name} at {dose_schedule.time.strftime('%I:%M %p')}"
+            from twilio.http.http_client import TwilioHttpClient
+            from twilio.rest import Client
             
-            client.messages.create(
-                body=message,
-                from_=settings.TWILIO_PHONE_NUMBER,
-                to=phone_number
+            http_client = TwilioHttpClient(
+                pool_connections=True,
+                timeout=settings.NOTIFICATION_CHANNEL_TIMEOUTS['sms']
             )
-            
-            logger.info(f"Dose reminder SMS sent to {phone_number} for {reminder.medicine_name}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to send dose reminder SMS to {user.email}: {str(e)}")
-            return False
+            cls._client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN, http_client=http_client)
+        return cls._client
+    
+    @classmethod
+    def reset_client(cls):
+        """Drop the cached client, e.g. in a freshly forked worker process"""
+        cls._client = None
+    
+    @staticmethod
+    def is_provider_error(error):
+        """Whether an error means Twilio is down rather than the message was rejected"""
+        # TwilioRestException carries the HTTP status; anything else is a connection problem
+        status = getattr(error, 'status', None)
+        return status is None or status >= 500
+    
+    @staticmethod
+    def build_dose_message(user, reminder, dose_schedule):
+        """Build the dose reminder SMS as (phone number, body)"""
+        return (
+            user.phone_number,
+            f"Medicine Reminder: Take {dose_schedule.amount} {reminder.medicine_name} at {dose_schedule.time.strftime('%I:%M %p')}"
+        )
     
     @staticmethod
-    def send_refill_reminder(user, reminder):
-        """Send refill reminder SMS"""
+    def build_refill_message(user, reminder):
+        """Build the refill reminder SMS as (phone number, body)"""
+        return (
+            user.phone_number,
+            f"Refill Alert: Your {reminder.medicine_name} stock is low ({reminder.quantity} remaining). Please refill soon."
+        )
+    
+    @classmethod
+    def send_messages(cls, messages):
+        """
+        Send (phone number, body) messages concurrently on the dispatch
+        thread pool and return a SendResult for each, in order
+        """
+        return NotificationDispatcher.map('sms', cls.send_message, messages)
+    
+    @classmethod
+    def send_message(cls, message):
+        """Send one SMS; not tried while Twilio's circuit is open"""
+        if ProviderCircuitBreaker.is_open('sms'):
+            return SendResult(None, ProviderCircuitBreaker.unavailable_message('sms'), True)
+        
+        phone_number, body = message
         try:
-            from twilio.rest import Client
+            client = cls.get_client()
             
-            if not settings.TWILIO_ACCOUNT_SID or not settings.TWILIO_AUTH_TOKEN:
+            if client is None:
                 logger.warning("Twilio credentials not configured")
-                return False
-            
-            client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
-            
-            phone_number = user.phone_number
-            
-            if not phone_number:
-                logger.warning(f"User {user.email} does not have a phone number")
-                return False
-            
-            message = f"Refill Alert: Your {reminder.medicine_name} stock is low ({reminder.quantity} remaining). Please refill soon."
+                return SendResult(False, 'Twilio credentials not configured')
             
             client.messages.create(
-                body=message,
+                body=body,
                 from_=settings.TWILIO_PHONE_NUMBER,
                 to=phone_number
             )
             
-            logger.info(f"Refill reminder SMS sent to {phone_number} for {reminder.medicine_name}")
-            return True
+            ProviderCircuitBreaker.record('sms', True)
+            logger.info(f"SMS sent to {phone_number}")
+            return SendResult(True)
             
         except Exception as e:
-            logger.error(f"Failed to send refill reminder SMS to {user.email}: {str(e)}")
-            return False
+            logger.error(f"Failed to send SMS to {phone_number}: {str(e)}")
+            ProviderCircuitBreaker.record('sms', not cls.is_provider_error(e))
+            return SendResult(False, str(e), is_transient_error(e))
 
 
 class PushNotificationService:
     """Service for sending push notifications via Firebase FCM"""
     
-    @staticmethod
-    def send_dose_reminder(user, reminder, dose_schedule):
-        """Send dose reminder push notification"""
-        try:
+    # FCM accepts at most this many messages per send_each call
+    BATCH_SIZE = 500
+    
+    _initialized = False
+    
+    @classmethod
+    def initialize(cls):
+        """Initialize the Firebase Admin SDK once per process; returns False if not configured"""
+        if not cls._initialized:
             import firebase_admin
-            from firebase_admin import credentials, messaging
+            from firebase_admin import credentials
             
-            # Initialize Firebase Admin SDK if not already initialized
             if not firebase_admin._apps:
-                if settings.FIREBASE_CREDENTIALS_PATH:
-                    cred = credentials.Certificate(settings.FIREBASE_CREDENTIALS_PATH)
-                    firebase_admin.initialize_app(cred)
-                else:
+                if not settings.FIREBASE_CREDENTIALS_PATH:
                     logger.warning("Firebase credentials not configured")
                     return False
+                cred = credentials.Certificate(settings.FIREBASE_CREDENTIALS_PATH)
+                # Bound each FCM request so a hung call cannot hold a dispatch thread
+                firebase_admin.initialize_app(
+                    cred, {'httpTimeout': settings.NOTIFICATION_CHANNEL_TIMEOUTS['push_notification']}
+                )
+            cls._initialized = True
+        return True
+    
+    @staticmethod
+    def build_dose_message(user, reminder, dose_schedule):
+        """Build the FCM message for a dose reminder"""
+        from firebase_admin import messaging
+        
+        return messaging.Message(
+            notification=messaging.Notification(
+                title=f"Medicine Reminder: {reminder.medicine_name}",
+                body=f"Take {dose_schedule.amount} {reminder.get_medicine_type_display()} at {dose_schedule.time.strftime('%I:%M %p')}"
+            ),
+            data={
+                'reminder_id': str(reminder.id),
+                'medicine_name': reminder.medicine_name,
+                'dose_amount': str(dose_schedule.amount),
+                'dose_time': dose_schedule.time.strftime('%H:%M:%S'),
+                'type': 'dose_reminder'
+            },
+            token=user.device_token,
+        )
+    
+    @staticmethod
+    def build_refill_message(user, reminder):
+        """Build the FCM message for a refill reminder"""
+        from firebase_admin import messaging
+        
+        return messaging.Message(
+            notification=messaging.Notification(
+                title=f"Refill Alert: {reminder.medicine_name}",
+                body=f"Your medicine stock is low ({reminder.quantity} remaining). Please refill soon."
+            ),
+            data={
+                'reminder_id': str(reminder.id),
+                'medicine_name': reminder.medicine_name,
+                'current_quantity': str(reminder.quantity),
+                'threshold': str(reminder.refill_threshold),
+                'type': 'refill_reminder'
+            },
+            token=user.device_token,
+        )
+    
+    @classmethod
+    def send_each(cls, messages):
+        """
+        Send many messages with one FCM request per BATCH_SIZE messages.
+        Returns a SendResult for each message, in order; messages are not
+        tried while FCM's circuit is open.
+        """
+        if not messages:
+            return []
+        
+        try:
+            from firebase_admin import messaging
             
-            # Check if user has device token
-            if not user.device_token:
-                logger.warning(f"User {user.email} does not have a device token")
-                return False
-            
-            # Create notification message
-            message = messaging.Message(
-                notification=messaging.Notification(
-                    title=f"Medicine Reminder: {reminder.medicine_name}",
-                    body=f"Take {dose_schedule.amount} {reminder.get_medicine_type_display()} at {dose_schedule.time.strftime('%I:%M %p')}"
-                ),
-                data={
-                    'reminder_id': str(reminder.id),
-                    'medicine_name': reminder.medicine_name,
-                    'dose_amount': str(dose_schedule.amount),
-                    'dose_time': dose_schedule.time.strftime('%H:%M:%S'),
-                    'type': 'dose_reminder'
-                },
-                token=user.device_token,
-            )
-            
-            # Send message
-            response = messaging.send(message)
-            logger.info(f"Dose reminder push notification sent to {user.email}: {response}")
-            return True
-            
+            if not cls.initialize():
+                return [SendResult(False, 'Firebase credentials not configured')] * len(messages)
         except Exception as e:
-            logger.error(f"Failed to send dose reminder push notification to {user.email}: {str(e)}")
-            return False
+            logger.error(f"Failed to initialize Firebase: {str(e)}")
+            return [SendResult(False, str(e))] * len(messages)
+        
+        results = []
+        for i in range(0, len(messages), cls.BATCH_SIZE):
+            chunk = messages[i:i + cls.BATCH_SIZE]
+            if ProviderCircuitBreaker.is_open('push_notification'):
+                results.extend(
+                    [SendResult(None, ProviderCircuitBreaker.unavailable_message('push_notification'), True)] * len(chunk)
+                )
+                continue
+            
+            try:
+                response = messaging.send_each(chunk)
+                results.extend(
+                    SendResult(True) if result.success
+                    else SendResult(False, str(result.exception), is_transient_error(result.exception))
+                    for result in response.responses
+                )
+                ProviderCircuitBreaker.record('push_notification', True)
+                logger.info(f"Push notification batch sent: {response.success_count} of {len(chunk)} succeeded")
+            except Exception as e:
+                logger.error(f"Failed to send push notification batch of {len(chunk)}: {str(e)}")
+                ProviderCircuitBreaker.record('push_notification', False)
+                results.extend([SendResult(False, str(e), is_transient_error(e))] * len(chunk))
+        
+        return results
+
+
+class ProviderCircuitBreaker:
+    """
+    One Redis circuit breaker per notification provider, shared by all
+    workers and configured by the NOTIFICATION_CIRCUIT_* settings.
+    
+    Services record whether the provider answered: connection errors,
+    timeouts and 5xx responses count as failures, while a refused
+    recipient or an invalid token means the provider is up. If Redis is
+    unavailable the circuit stays closed.
+    """
+    
+    _breakers = {}
+    
+    @classmethod
+    def get_breaker(cls, method):
+        """Return the circuit breaker of a channel's provider"""
+        provider = settings.NOTIFICATION_PROVIDERS[method]
+        if provider not in cls._breakers:
+            cls._breakers[provider] = RedisCircuitBreaker(
+                provider,
+                failure_threshold=settings.NOTIFICATION_CIRCUIT_FAILURE_THRESHOLD,
+                failure_window=settings.NOTIFICATION_CIRCUIT_FAILURE_WINDOW,
+                reset_timeout=settings.NOTIFICATION_CIRCUIT_RESET_TIMEOUT,
+            )
+        return cls._breakers[provider]
+    
+    @classmethod
+    def allow(cls, method):
+        """Return CLOSED, HALF_OPEN (send as the probe) or OPEN (do not send)"""
+        try:
+            return cls.get_breaker(method).allow()
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker unavailable: {str(e)}")
+            return RedisCircuitBreaker.CLOSED
+    
+    @classmethod
+    def is_open(cls, method):
+        return cls.get_breaker(method).is_open()
+    
+    @classmethod
+    def record(cls, method, provider_up):
+        """Record whether the provider answered a send"""
+        breaker = cls.get_breaker(method)
+        try:
+            if provider_up:
+                breaker.record_success()
+            else:
+                breaker.record_failure()
+        except redis.RedisError as e:
+            logger.warning(f"Circuit breaker unavailable: {str(e)}")
     
     @staticmethod
-    def send_refill_reminder(user, reminder):
-        """Send refill reminder push notification"""
+    def unavailable_message(method):
+        return f"{settings.NOTIFICATION_PROVIDERS[method]} is unavailable (circuit open)"
+
+
+class RateLimited(Exception):
+    """Raised when providers cannot take a batch within the allowed wait"""
+    
+    def __init__(self, retry_after):
+        super().__init__(f"Notification rate limit reached, retry in {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class NotificationRateLimiter:
+    """
+    Per-provider rate limits shared by all workers, one Redis token bucket
+    per provider and channel as configured in NOTIFICATION_RATE_LIMITS.
+    
+    Senders reserve tokens for a batch before sending it, so a peak
+    minute is spread out at the provider's ceiling instead of being
+    answered with 429s. A batch larger than the limits allow within
+    NOTIFICATION_RATE_LIMIT_MAX_WAIT is sent in part; the rest waits for
+    the next batch.
+    """
+    
+    _buckets = {}
+    
+    @classmethod
+    def get_bucket(cls, method):
+        """Return the token bucket of a channel, or None if it is not limited"""
+        if method not in cls._buckets:
+            limit = settings.NOTIFICATION_RATE_LIMITS.get(method)
+            if not limit or not limit['rate']:
+                cls._buckets[method] = None
+            else:
+                provider = settings.NOTIFICATION_PROVIDERS[method]
+                cls._buckets[method] = RedisTokenBucket(f'{provider}:{method}', limit['rate'], limit['burst'])
+        return cls._buckets[method]
+    
+    @classmethod
+    def reserve(cls, counts, max_wait=None):
+        """
+        Reserve tokens for {method: notification count}, per channel as
+        many as are available within max_wait. Returns ({method: count
+        reserved}, seconds to wait before sending). Raises RateLimited if
+        no channel could reserve anything.
+        """
+        if max_wait is None:
+            max_wait = settings.NOTIFICATION_RATE_LIMIT_MAX_WAIT
+        
+        reserved = {}
+        wait = 0
+        retry_after = None
         try:
-            import firebase_admin
-            from firebase_admin import credentials, messaging
-            
-            # Initialize Firebase Admin SDK if not already initialized
-            if not firebase_admin._apps:
-                if settings.FIREBASE_CREDENTIALS_PATH:
-                    cred = credentials.Certificate(settings.FIREBASE_CREDENTIALS_PATH)
-                    firebase_admin.initialize_app(cred)
+            for method, count in counts.items():
+                bucket = cls.get_bucket(method)
+                if bucket is None or not count:
+                    reserved[method] = count
+                    continue
+                
+                reserved[method], bucket_wait = bucket.reserve(count, max_wait)
+                if reserved[method]:
+                    wait = max(wait, bucket_wait)
                 else:
-                    logger.warning("Firebase credentials not configured")
-                    return False
-            
-            # Check if user has device token
-            if not user.device_token:
-                logger.warning(f"User {user.email} does not have a device token")
-                return False
-            
-            # Create notification message
-            message = messaging.Message(
-                notification=messaging.Notification(
-                    title=f"Refill Alert: {reminder.medicine_name}",
-                    body=f"Your medicine stock is low ({reminder.quantity} remaining). Please refill soon."
-                ),
-                data={
-                    'reminder_id': str(reminder.id),
-                    'medicine_name': reminder.medicine_name,
-                    'current_quantity': str(reminder.quantity),
-                    'threshold': str(reminder.refill_threshold),
-                    'type': 'refill_reminder'
-                },
-                token=user.device_token,
+                    retry_after = min(retry_after or bucket_wait, bucket_wait)
+        except redis.RedisError as e:
+            # Sending unthrottled beats not sending at all
+            logger.warning(f"Notification rate limiter unavailable: {str(e)}")
+            return dict(counts), 0
+        
+        if retry_after is not None and not any(reserved.values()):
+            raise RateLimited(max(retry_after - max_wait, 1))
+        return reserved, wait
+    
+    @classmethod
+    def throttle(cls, counts):
+        """
+        Wait until the reserved part of a batch may be sent and return
+        {method: count reserved}; raises RateLimited if nothing can be sent soon.
+        """
+        reserved, wait = cls.reserve(counts)
+        if wait:
+            logger.info(f"Waiting {wait:.2f}s for notification rate limits")
+            time.sleep(wait)
+        return reserved
+
+
+class NotificationOutbox:
+    """
+    Transactional outbox of notifications.
+    
+    Whoever decides to notify writes 'pending' NotificationLogs in the
+    same transaction as the rest of its work, such as the dose decrement,
+    so a notification is neither lost in a crash nor sent for work that
+    was rolled back. Sender workers then drain pending logs in batches:
+    a batch is claimed by marking it 'sending' in a short transaction
+    (SELECT ... FOR UPDATE SKIP LOCKED, so any number of senders can run
+    side by side), sent with no transaction open, and its results saved
+    in a second short transaction. Dose and refill notifications are
+    drained by separate senders on separate queues, so refills never
+    hold up doses.
+    """
+    
+    @staticmethod
+    def build_logs(user, reminder, notification_type, methods, occurrence=None):
+        """Return unsaved pending logs, one per notification method"""
+        return [
+            NotificationLog(
+                user=user,
+                reminder=reminder,
+                occurrence=occurrence,
+                notification_type=notification_type,
+                method=method,
+                status='pending'
             )
-            
-            # Send message
-            response = messaging.send(message)
-            logger.info(f"Refill reminder push notification sent to {user.email}: {response}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to send refill reminder push notification to {user.email}: {str(e)}")
-            return False
+            for method in methods
+        ]
+    
+    @classmethod
+    def enqueue(cls, logs):
+        """Save pending logs and start senders once the transaction commits"""
+        if not logs:
+            return
+        NotificationLog.objects.bulk_create(logs)
+        for notification_type in {log.notification_type for log in logs}:
+            count = sum(1 for log in logs if log.notification_type == notification_type)
+            transaction.on_commit(partial(cls.start_senders, notification_type, count))
+    
+    @staticmethod
+    def sender_queue(notification_type):
+        """Queue of the senders for a notification type"""
+        if notification_type == 'refill_reminder':
+            return settings.REFILL_QUEUE
+        return settings.NOTIFICATION_OUTBOX_QUEUE
+    
+    @classmethod
+    def start_senders(cls, notification_type, count=1, countdown=None):
+        """Start one sender task per outbox batch of `count` new logs"""
+        from apps.notifications.tasks import send_pending_notifications
+        
+        for _ in range(math.ceil(count / settings.NOTIFICATION_OUTBOX_BATCH_SIZE)):
+            send_pending_notifications.apply_async(
+                args=[notification_type], countdown=countdown, queue=cls.sender_queue(notification_type)
+            )
+    
+    @classmethod
+    def claim(cls, notification_type, batch_size):
+        """
+        Claim up to batch_size pending logs, and logs whose sender has held
+        them for longer than NOTIFICATION_OUTBOX_CLAIM_TIMEOUT
+        """
+        stale_before = timezone.now() - timedelta(seconds=settings.NOTIFICATION_OUTBOX_CLAIM_TIMEOUT)
+        return cls._mark_sending(
+            NotificationLog.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(
+                Q(status='pending') | Q(status='sending', claimed_at__lt=stale_before),
+                notification_type=notification_type
+            )
+            .select_related('user', 'reminder', 'occurrence__dose_schedule')
+            .order_by('created_at', 'id')[:batch_size]
+        )
+    
+    @classmethod
+    def claim_retries(cls, log_ids):
+        """Claim the given logs that are still waiting for a retry"""
+        return cls._mark_sending(
+            NotificationLog.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(id__in=log_ids, status__in=['failed', 'deferred'], next_retry_at__isnull=False)
+            .select_related('user', 'reminder', 'occurrence__dose_schedule')
+            .order_by('id')
+        )
+    
+    @classmethod
+    def claim_due_retries(cls, batch_size):
+        """
+        Claim up to batch_size failed or deferred logs with tries left
+        whose retry is due, whether or not their retry task still runs
+        """
+        return cls._mark_sending(
+            NotificationLog.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(
+                Q(status='failed', attempts__lt=settings.NOTIFICATION_RETRY_MAX_ATTEMPTS)
+                | Q(status='deferred', deferrals__lt=settings.NOTIFICATION_RETRY_MAX_DEFERRALS),
+                next_retry_at__lte=timezone.now()
+            )
+            .select_related('user', 'reminder', 'occurrence__dose_schedule')
+            .order_by('next_retry_at', 'id')[:batch_size]
+        )
+    
+    @classmethod
+    def send(cls, logs):
+        """
+        Send claimed logs within provider rate limits and save their
+        results. Returns (number sent, logs held back): logs beyond what
+        the rate limits take soon enough are released for a later batch.
+        Raises RateLimited, after releasing the batch, if the limits
+        cannot take any of it soon enough.
+        
+        Runs outside any transaction, so neither the wait for the rate
+        limits nor the sends hold row locks. A sender that dies between
+        sending and saving the results leaves its logs claimed; they are
+        sent again once the claim goes stale, so delivery is at least once.
+        """
+        counts = defaultdict(int)
+        for log in logs:
+            counts[log.method] += 1
+        try:
+            reserved = NotificationRateLimiter.throttle(counts)
+        except RateLimited:
+            cls.release(logs)
+            raise
+        
+        held = []
+        for log in logs:
+            if reserved[log.method]:
+                reserved[log.method] -= 1
+            else:
+                held.append(log)
+        if held:
+            logger.info(f"Rate limits hold back {len(held)} of {len(logs)} notifications")
+            cls.release(held)
+            held_ids = {log.id for log in held}
+            logs = [log for log in logs if log.id not in held_ids]
+        
+        notification_batch = NotificationBatch()
+        for log in logs:
+            notification_batch.add_log(log)
+        notification_batch.send()
+        
+        with transaction.atomic():
+            for log in logs:
+                log.next_retry_at = None
+                log.claimed_at = None
+            NotificationRetryPolicy.schedule(notification_batch.retryable)
+            
+            NotificationLog.objects.bulk_update(
+                logs, ['status', 'sent_at', 'error_message', 'attempts', 'deferrals', 'next_retry_at', 'claimed_at']
+            )
+        return notification_batch.sent_count, held
+    
+    @staticmethod
+    def release(logs):
+        """Hand claimed logs back unsent, in the status they were claimed from"""
+        by_status = defaultdict(list)
+        for log in logs:
+            # A stale claim goes back to the outbox
+            by_status['pending' if log.status == 'sending' else log.status].append(log.id)
+        for status, log_ids in by_status.items():
+            NotificationLog.objects.filter(id__in=log_ids, status='sending').update(status=status, claimed_at=None)
+    
+    @staticmethod
+    def _mark_sending(logs):
+        """
+        Lock a queryset's logs, mark them 'sending' and commit, so no other
+        sender takes them while they are sent. The returned logs keep the
+        status they were claimed from.
+        """
+        with transaction.atomic():
+            logs = list(logs)
+            if logs:
+                NotificationLog.objects.filter(id__in=[log.id for log in logs]).update(
+                    status='sending', claimed_at=timezone.now()
+                )
+        return logs
+
+
+class NotificationRetryPolicy:
+    """
+    Retries of transient send failures, as Celery tasks on
+    NOTIFICATION_RETRY_QUEUE so they never hold up on-time delivery.
+    
+    A log is retried up to NOTIFICATION_RETRY_MAX_ATTEMPTS attempts in
+    total, with exponential backoff from NOTIFICATION_RETRY_BASE_DELAY
+    capped at NOTIFICATION_RETRY_MAX_DELAY, and jitter so retries of a
+    failure storm do not all land at once. Rejected messages, like an
+    invalid phone number, are not retried. Deferrals by an open circuit
+    are not attempts; they back off the same way up to
+    NOTIFICATION_RETRY_MAX_DEFERRALS times.
+    
+    Each retry is started by a countdown task; a periodic sweep retries
+    any that are due but whose task was lost, such as with a worker
+    restart or a broker outage.
+    """
+    
+    @staticmethod
+    def backoff(tries):
+        """Seconds to wait after the given number of tries, between half and all of the backoff"""
+        delay = min(
+            settings.NOTIFICATION_RETRY_BASE_DELAY * 2 ** (tries - 1),
+            settings.NOTIFICATION_RETRY_MAX_DELAY
+        )
+        return random.uniform(delay / 2, delay)
+    
+    @classmethod
+    def schedule(cls, logs):
+        """
+        Set next_retry_at on retryable logs with tries left and start
+        their retry tasks once the transaction commits. Deferred logs out
+        of deferrals are marked failed.
+        """
+        by_tries = defaultdict(list)
+        for log in logs:
+            if log.status == 'deferred':
+                tries, max_tries = log.deferrals, settings.NOTIFICATION_RETRY_MAX_DEFERRALS
+            else:
+                tries, max_tries = log.attempts, settings.NOTIFICATION_RETRY_MAX_ATTEMPTS
+            
+            if tries < max_tries:
+                by_tries[tries].append(log)
+            elif log.status == 'deferred':
+                log.status = 'failed'
+        
+        now = timezone.now()
+        for tries, retry_logs in by_tries.items():
+            countdown = cls.backoff(tries)
+            for log in retry_logs:
+                log.next_retry_at = now + timedelta(seconds=countdown)
+            transaction.on_commit(partial(cls.start_retry, [log.id for log in retry_logs], countdown))
+    
+    @staticmethod
+    def start_retry(log_ids, countdown):
+        from apps.notifications.tasks import retry_notifications
+        
+        retry_notifications.apply_async(
+            args=[log_ids], countdown=countdown, queue=settings.NOTIFICATION_RETRY_QUEUE
+        )
 
 
 class NotificationDispatcher:
-    """Dispatcher to send notifications via multiple methods"""
+    """
+    Shared, bounded thread pool for sending notifications concurrently.
+    
+    A batch's channels are sent side by side, so it costs the slowest
+    channel rather than the sum of all of them, and the SMS of a batch
+    are sent in parallel. A send that does not finish within its
+    channel's NOTIFICATION_CHANNEL_TIMEOUTS entry counts as a transient
+    failure and is retried; the send may still complete in the
+    background, so a retry can deliver the notification twice.
+    """
+    
+    _executor = None
+    
+    @classmethod
+    def get_executor(cls):
+        """Return this process's dispatch thread pool, creating it on first use"""
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(
+                max_workers=settings.NOTIFICATION_DISPATCH_MAX_WORKERS,
+                thread_name_prefix='notification-dispatch'
+            )
+        return cls._executor
+    
+    @staticmethod
+    def deadline(method, started, calls):
+        """
+        Monotonic time by which `calls` back-to-back sends of a method
+        started at `started` must be done, or None if it has no timeout.
+        One spare call is allowed for waiting on a pool thread.
+        """
+        timeout = settings.NOTIFICATION_CHANNEL_TIMEOUTS.get(method)
+        if timeout is None:
+            return None
+        return started + timeout * (calls + 1)
+    
+    @staticmethod
+    def wait(method, future, deadline):
+        """Return the result of a send future, or None if it is not done by the deadline"""
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            return future.result(timeout=remaining)
+        except FutureTimeoutError:
+            timeout = settings.NOTIFICATION_CHANNEL_TIMEOUTS[method]
+            logger.error(f"Sending {method} notification timed out after {timeout}s")
+            return None
     
     @staticmethod
-    def send_dose_reminder(user, reminder, dose_schedule, methods):
-        """Send dose reminder via specified methods"""
-        results = {}
+    def timed_out(method):
+        """SendResult of a send that missed its deadline"""
+        return SendResult(False, f"Timed out after {settings.NOTIFICATION_CHANNEL_TIMEOUTS[method]}s", True)
+    
+    @classmethod
+    def map(cls, method, send, messages):
+        """Run send(message) for each message of a channel concurrently and return their SendResults in order"""
+        if not messages:
+            return []
         
-        if 'email' in methods:
-            results['email'] = EmailService.send_dose_reminder(user, reminder, dose_schedule)
+        started = time.monotonic()
+        executor = cls.get_executor()
+        futures = [executor.submit(send, message) for message in messages]
         
-        if 'sms' in methods:
-            results['sms'] = SMSService.send_dose_reminder(user, reminder, dose_schedule)
+        # Sends run in waves of the pool size
+        deadline = cls.deadline(
+            method, started, math.ceil(len(messages) / settings.NOTIFICATION_DISPATCH_MAX_WORKERS)
+        )
         
-        if 'push_notification' in methods:
-            results['push_notification'] = PushNotificationService.send_dose_reminder(user, reminder, dose_schedule)
+        results = []
+        for future in futures:
+            result = cls.wait(method, future, deadline)
+            results.append(cls.timed_out(method) if result is None else result)
         
         return results
+
+
+class NotificationBatch:
+    """
+    Sends a batch of pending NotificationLogs and records each result on
+    its log.
     
-    @staticmethod
-    def send_refill_reminder(user, reminder, methods):
-        """Send refill reminder via specified methods"""
-        results = {}
+    Messages are collected as logs are added and sent together by send(),
+    all three channels side by side: email over one pooled SMTP
+    connection, push with one FCM request per 500 messages and SMS in
+    parallel on the dispatch thread pool. The logs are left unsaved so
+    the caller can write them in one bulk update.
+    
+    Each provider's circuit breaker is checked once per batch. While it is
+    open nothing is sent to that provider and the logs are 'deferred';
+    when it is half-open the batch's first message is the probe.
+    """
+    
+    def __init__(self):
+        self.logs = []
+        self._email_messages = []
+        self._email_logs = []
+        self._sms_messages = []
+        self._sms_logs = []
+        self._push_messages = []
+        self._push_logs = []
+        self._circuits = {}
+        # Logs that failed or were deferred for a reason worth retrying
+        self.retryable = []
+    
+    def add_log(self, log):
+        """
+        Add the notification of a log loaded with its user, reminder and
+        occurrence's dose schedule; it is sent by send()
+        """
+        self.logs.append(log)
+        user = log.user
+        
+        if log.notification_type == 'dose_reminder':
+            if log.occurrence is None:
+                self._record(log, False, 'Dose occurrence no longer exists')
+                return
+            args = (log.reminder, log.occurrence.dose_schedule)
+            email_builder = EmailService.build_dose_message
+            sms_builder = SMSService.build_dose_message
+            push_builder = PushNotificationService.build_dose_message
+        else:
+            args = (log.reminder,)
+            email_builder = EmailService.build_refill_message
+            sms_builder = SMSService.build_refill_message
+            push_builder = PushNotificationService.build_refill_message
+        
+        if log.method == 'email':
+            self._add_email(user, log, email_builder, *args)
+        elif log.method == 'sms':
+            self._add_sms(user, log, sms_builder, *args)
+        else:
+            self._add_push(user, log, push_builder, *args)
+    
+    def send(self):
+        """Send the collected messages of all channels and return all logs"""
+        # Email and push each hold one pool thread; SMS fans out over the rest from here
+        started = time.monotonic()
+        executor = NotificationDispatcher.get_executor()
+        email_results = executor.submit(
+            self._send_guarded, 'email', EmailService.send_messages, self._email_messages
+        )
+        push_results = executor.submit(
+            self._send_guarded, 'push_notification', PushNotificationService.send_each, self._push_messages
+        )
+        sms_results = self._send_guarded('sms', SMSService.send_messages, self._sms_messages)
         
-        if 'email' in methods:
-            results['email'] = EmailService.send_refill_reminder(user, reminder)
+        # Emails go one after another over one connection, push in one request per FCM batch
+        channels = [
+            ('push_notification', push_results, self._push_logs,
+             math.ceil(len(self._push_messages) / PushNotificationService.BATCH_SIZE)),
+            ('email', email_results, self._email_logs, len(self._email_messages)),
+        ]
         
-        if 'sms' in methods:
-            results['sms'] = SMSService.send_refill_reminder(user, reminder)
+        for log, result in zip(self._sms_logs, sms_results):
+            self._record(log, *result)
+        for method, future, logs, calls in channels:
+            results = NotificationDispatcher.wait(
+                method, future, NotificationDispatcher.deadline(method, started, calls)
+            )
+            if results is None:
+                results = [NotificationDispatcher.timed_out(method)] * len(logs)
+            for log, result in zip(logs, results):
+                self._record(log, *result)
+        
+        self._email_messages = []
+        self._email_logs = []
+        self._sms_messages = []
+        self._sms_logs = []
+        self._push_messages = []
+        self._push_logs = []
+        return self.logs
+    
+    @property
+    def sent_count(self):
+        return sum(1 for log in self.logs if log.status == 'sent')
+    
+    def _circuit(self, method):
+        """Circuit state of a method's provider, looked up once per batch"""
+        if method not in self._circuits:
+            self._circuits[method] = ProviderCircuitBreaker.allow(method)
+        return self._circuits[method]
+    
+    def _send_guarded(self, method, send_messages, messages):
+        """Send messages through `send_messages` unless the provider's circuit is open"""
+        results = []
+        if messages and self._circuit(method) == RedisCircuitBreaker.HALF_OPEN:
+            results = send_messages(messages[:1])
+            messages = messages[1:]
+            del self._circuits[method]
         
-        if 'push_notification' in methods:
-            results['push_notification'] = PushNotificationService.send_refill_reminder(user, reminder)
+        if messages and self._circuit(method) == RedisCircuitBreaker.OPEN:
+            return results + [SendResult(None, ProviderCircuitBreaker.unavailable_message(method), True)] * len(messages)
+        return results + send_messages(messages)
+    
+    def _add_email(self, user, log, build_message, *args):
+        try:
+            message = build_message(user, *args)
+        except Exception as e:
+            logger.error(f"Failed to build email for {user.email}: {str(e)}")
+            self._record(log, False, str(e))
+            return
+        
+        self._email_messages.append(message)
+        self._email_logs.append(log)
+    
+    def _add_sms(self, user, log, build_message, *args):
+        if not user.phone_number:
+            logger.warning(f"User {user.email} does not have a phone number")
+            self._record(log, False, 'User does not have a phone number')
+            return
+        
+        self._sms_messages.append(build_message(user, *args))
+        self._sms_logs.append(log)
+    
+    def _add_push(self, user, log, build_message, *args):
+        if not user.device_token:
+            logger.warning(f"User {user.email} does not have a device token")
+            self._record(log, False, 'User does not have a device token')
+            return
+        
+        try:
+            message = build_message(user, *args)
+        except Exception as e:
+            logger.error(f"Failed to build push notification for {user.email}: {str(e)}")
+            self._record(log, False, str(e))
+            return
+        
+        self._push_messages.append(message)
+        self._push_logs.append(log)
+    
+    def _record(self, log, success, error_message=None, transient=False):
+        """Record a send result; a success of None means it was deferred by an open circuit"""
+        if success is None:
+            log.deferrals += 1
+            log.status = 'deferred'
+            log.sent_at = None
+            log.error_message = error_message or ProviderCircuitBreaker.unavailable_message(log.method)
+            self.retryable.append(log)
+            return
         
-        return results
\ No newline at end of file
+        log.attempts += 1
+        log.status = 'sent' if success else 'failed'
+        log.sent_at = timezone.now() if success else None
+        log.error_message = None if success else error_message or 'Failed to send notification'
+        if not success and transient:
+            self.retryable.append(log)
@@ -0,0 +1,130 @@
+# apps/notifications/tasks.py
+import logging
+from celery import shared_task
+from django.conf import settings
+from apps.notifications.services import NotificationOutbox, RateLimited
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task(name='apps.notifications.tasks.send_pending_notifications')
+def send_pending_notifications(notification_type='dose_reminder', max_batches=None):
+    """
+    Celery task that drains the notification outbox of one notification type.
+    
+    Claims batches of pending NotificationLogs and marks them sent, failed
+    or deferred. A batch is claimed and its results saved in two short
+    transactions, with the sends in between, so no locks are held while
+    providers are waited on. The logs of a sender that dies are claimed
+    again once NOTIFICATION_OUTBOX_CLAIM_TIMEOUT passes, so a notification
+    is sent at least once and, rarely, twice. Logs held back by rate
+    limits go back to pending and are claimed by the next batch, which
+    waits for the limits.
+    """
+    if max_batches is None:
+        max_batches = settings.NOTIFICATION_OUTBOX_MAX_BATCHES
+    
+    try:
+        sent = 0
+        batches = 0
+        
+        while batches < max_batches:
+            logs = NotificationOutbox.claim(notification_type, settings.NOTIFICATION_OUTBOX_BATCH_SIZE)
+            if not logs:
+                break
+            batch_sent, _ = NotificationOutbox.send(logs)
+            sent += batch_sent
+            batches += 1
+        else:
+            # There may be more; carry on in a new task so other work gets a turn
+            NotificationOutbox.start_senders(notification_type)
+        
+        logger.info(f"Notification outbox ({notification_type}): {batches} batches, {sent} notifications sent")
+        return f"Sent {sent} notifications"
+        
+    except RateLimited as e:
+        # The batch was released, so it is simply tried again later
+        logger.warning(f"Notification outbox sender ({notification_type}) requeued: {str(e)}")
+        NotificationOutbox.start_senders(notification_type, countdown=e.retry_after)
+        return "Requeued for rate limits"
+        
+    except Exception as e:
+        logger.error(f"Error in send_pending_notifications task: {str(e)}", exc_info=True)
+        raise
+
+
+@shared_task(name='apps.notifications.tasks.retry_notifications')
+def retry_notifications(log_ids):
+    """
+    Celery task that sends failed or deferred notifications again.
+    Runs on the retry queue; logs already sent or being retried are
+    skipped. Logs are claimed and sent like outbox batches.
+    """
+    try:
+        logs = NotificationOutbox.claim_retries(log_ids)
+        if not logs:
+            return "Nothing to retry"
+        sent, held = NotificationOutbox.send(logs)
+        
+        if held:
+            # Held back by rate limits; try them again once the limits free up
+            retry_notifications.apply_async(
+                args=[[log.id for log in held]], queue=settings.NOTIFICATION_RETRY_QUEUE
+            )
+        
+        logger.info(f"Notification retry: {sent} of {len(logs)} notifications sent")
+        return f"Sent {sent} of {len(logs)} notifications"
+        
+    except RateLimited as e:
+        logger.warning(f"Notification retry requeued: {str(e)}")
+        retry_notifications.apply_async(
+            args=[log_ids], countdown=e.retry_after, queue=settings.NOTIFICATION_RETRY_QUEUE
+        )
+        return "Requeued for rate limits"
+        
+    except Exception as e:
+        logger.error(f"Error in retry_notifications task: {str(e)}", exc_info=True)
+        raise
+
+
+@shared_task(name='apps.notifications.tasks.retry_due_notifications')
+def retry_due_notifications(max_batches=None):
+    """
+    Celery task that retries failed or deferred notifications whose retry
+    is due and that have tries left. Runs every minute via Celery Beat on
+    the retry queue.
+    
+    Retries are started by countdown tasks when they are scheduled; this
+    sweep sends those whose task never ran. Logs a retry task or another
+    sweep has claimed are skipped.
+    """
+    if max_batches is None:
+        max_batches = settings.NOTIFICATION_OUTBOX_MAX_BATCHES
+    
+    try:
+        sent = 0
+        retried = 0
+        
+        for _ in range(max_batches):
+            logs = NotificationOutbox.claim_due_retries(settings.NOTIFICATION_OUTBOX_BATCH_SIZE)
+            if not logs:
+                break
+            batch_sent, held = NotificationOutbox.send(logs)
+            sent += batch_sent
+            retried += len(logs) - len(held)
+            if held:
+                # Held back by rate limits; the next sweep takes them
+                break
+        
+        if retried:
+            logger.info(f"Notification retry sweep: {sent} of {retried} overdue notifications sent")
+        return f"Sent {sent} of {retried} notifications"
+        
+    except RateLimited as e:
+        # The batch was released and is still due, so the next sweep takes it
+        logger.warning(f"Notification retry sweep stopped: {str(e)}")
+        return "Stopped for rate limits"
+        
+    except Exception as e:
+        logger.error(f"Error in retry_due_notifications task: {str(e)}", exc_info=True)
+        raise
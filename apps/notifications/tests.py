@@ -1,3 +1,713 @@
-from django.test import TestCase
+import smtplib
+import threading
+from datetime import date, timedelta
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+from django.core.mail import EmailMessage
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from firebase_admin import messaging
+
+from apps.reminders.models import Reminder
+from apps.users.models import CustomUser
+from utils.redis_client import RedisCircuitBreaker, RedisTokenBucket
+
+from . import services
+from .models import NotificationLog
+from .services import (
+    EmailService,
+    NotificationBatch,
+    NotificationDispatcher,
+    NotificationOutbox,
+    NotificationRateLimiter,
+    NotificationRetryPolicy,
+    ProviderCircuitBreaker,
+    PushNotificationService,
+    RateLimited,
+    SendResult,
+    SMSService,
+)
+from .tasks import retry_due_notifications, send_pending_notifications
+
+
+class NotificationTestMixin:
+    
+    def create_user(self, email='user@example.com'):
+        return CustomUser.objects.create_user(
+            email, 'password123', phone_number='+15555550100', device_token='device-token'
+        )
+    
+    def create_reminder(self, user):
+        return Reminder.objects.create(
+            user=user,
+            medicine_name='Aspirin',
+            medicine_type='tablet',
+            dose_count_daily=1,
+            quantity=3,
+            notification_methods=['email', 'sms', 'push_notification'],
+            start_date=date(2026, 1, 1)
+        )
+    
+    def close_circuits(self):
+        patcher = mock.patch.object(ProviderCircuitBreaker, 'allow', return_value=RedisCircuitBreaker.CLOSED)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def patch_channels(self, email=None, sms=None, push=None):
+        """Patch each channel's sender with a function of its messages"""
+        succeed = lambda messages: [SendResult(True)] * len(messages)
+        for target, name, send in [
+            (EmailService, 'send_messages', email),
+            (SMSService, 'send_messages', sms),
+            (PushNotificationService, 'send_each', push),
+        ]:
+            patcher = mock.patch.object(target, name, side_effect=send or succeed)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+    
+    def hang_until_cleanup(self):
+        """Return an event that blocks sends waiting on it until the test ends"""
+        release = threading.Event()
+        self.addCleanup(release.set)
+        return release
+
+
+class FakeClockMixin:
+    """Drive the _now_ms() of Redis primitives from a fake clock"""
+    
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.now_ms = 1_700_000_000_000
+    
+    def make_client(self):
+        return fakeredis.FakeRedis(server=self.server)
+    
+    def freeze(self, primitive):
+        patcher = mock.patch.object(primitive, '_now_ms', side_effect=lambda: self.now_ms)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return primitive
+    
+    def advance(self, seconds):
+        self.now_ms += int(seconds * 1000)
+
+
+class OutboxTestMixin(NotificationTestMixin):
+    
+    def setUp(self):
+        self.user = self.create_user()
+        self.reminder = self.create_reminder(self.user)
+        self.close_circuits()
+        self.patch_channels()
+        patcher = mock.patch.object(NotificationRateLimiter, 'throttle', side_effect=dict)
+        self.throttle = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def create_logs(self, count, notification_type='refill_reminder', **fields):
+        return NotificationLog.objects.bulk_create([
+            NotificationLog(
+                user=self.user, reminder=self.reminder, notification_type=notification_type, method='email', **fields
+            )
+            for _ in range(count)
+        ])
+    
+    def statuses(self):
+        return list(NotificationLog.objects.order_by('id').values_list('status', flat=True))
+
+
+class NotificationOutboxTests(OutboxTestMixin, TestCase):
+    """Claiming outbox batches, sending them and saving the results"""
+    
+    def test_claim_marks_batch_sending(self):
+        self.create_logs(3)
+        self.create_logs(1, notification_type='dose_reminder')
+        
+        logs = NotificationOutbox.claim('refill_reminder', 2)
+        
+        self.assertEqual(len(logs), 2)
+        self.assertEqual(self.statuses(), ['sending', 'sending', 'pending', 'pending'])
+        self.assertTrue(all(NotificationLog.objects.filter(status='sending').values_list('claimed_at', flat=True)))
+        self.assertEqual(len(NotificationOutbox.claim('refill_reminder', 2)), 1)
+        self.assertEqual(NotificationOutbox.claim('refill_reminder', 2), [])
+    
+    @override_settings(NOTIFICATION_OUTBOX_CLAIM_TIMEOUT=600)
+    def test_stale_claim_is_claimed_again(self):
+        now = timezone.now()
+        self.create_logs(1, status='sending', claimed_at=now - timedelta(seconds=601))
+        self.create_logs(1, status='sending', claimed_at=now - timedelta(seconds=60))
+        
+        logs = NotificationOutbox.claim('refill_reminder', 10)
+        
+        self.assertEqual([log.id for log in logs], [NotificationLog.objects.order_by('id').first().id])
+    
+    def test_send_saves_results_and_clears_claim(self):
+        self.create_logs(2)
+        
+        sent, held = NotificationOutbox.send(NotificationOutbox.claim('refill_reminder', 10))
+        
+        self.assertEqual((sent, held), (2, []))
+        self.assertEqual(self.statuses(), ['sent', 'sent'])
+        self.assertFalse(NotificationLog.objects.filter(claimed_at__isnull=False).exists())
+        self.assertEqual(list(NotificationLog.objects.values_list('attempts', flat=True)), [1, 1])
+    
+    def test_held_logs_go_back_to_pending(self):
+        self.create_logs(3)
+        self.throttle.side_effect = lambda counts: {'email': 1}
+        
+        sent, held = NotificationOutbox.send(NotificationOutbox.claim('refill_reminder', 10))
+        
+        self.assertEqual((sent, len(held)), (1, 2))
+        self.assertEqual(self.statuses(), ['sent', 'pending', 'pending'])
+    
+    def test_rate_limited_batch_is_released(self):
+        self.create_logs(2)
+        self.throttle.side_effect = RateLimited(3)
+        logs = NotificationOutbox.claim('refill_reminder', 10)
+        
+        with self.assertRaises(RateLimited):
+            NotificationOutbox.send(logs)
+        
+        self.assertEqual(self.statuses(), ['pending', 'pending'])
+        EmailService.send_messages.assert_not_called()
+    
+    def test_crashed_sender_leaves_batch_claimed(self):
+        self.create_logs(2)
+        EmailService.send_messages.side_effect = RuntimeError('Worker lost')
+        
+        with self.assertRaises(RuntimeError):
+            NotificationOutbox.send(NotificationOutbox.claim('refill_reminder', 10))
+        
+        self.assertEqual(self.statuses(), ['sending', 'sending'])
+        self.assertEqual(NotificationOutbox.claim('refill_reminder', 10), [])
+    
+    def test_claim_retries_only_takes_logs_waiting_for_retry(self):
+        retry_at = timezone.now()
+        waiting = self.create_logs(1, status='failed', next_retry_at=retry_at)
+        deferred = self.create_logs(1, status='deferred', next_retry_at=retry_at)
+        given_up = self.create_logs(1, status='failed')
+        pending = self.create_logs(1)
+        log_ids = [log.id for log in waiting + deferred + given_up + pending]
+        
+        logs = NotificationOutbox.claim_retries(log_ids)
+        
+        self.assertEqual([log.id for log in logs], log_ids[:2])
+        self.assertEqual(self.statuses(), ['sending', 'sending', 'failed', 'pending'])
+        
+        # Released retries keep their retry time
+        NotificationOutbox.release(logs)
+        self.assertEqual(self.statuses(), ['failed', 'deferred', 'failed', 'pending'])
+        self.assertEqual(NotificationLog.objects.filter(next_retry_at=retry_at).count(), 2)
+    
+    @mock.patch('apps.notifications.tasks.NotificationOutbox.start_senders')
+    def test_sender_task_drains_outbox(self, start_senders):
+        self.create_logs(5)
+        
+        with override_settings(NOTIFICATION_OUTBOX_BATCH_SIZE=2):
+            result = send_pending_notifications('refill_reminder')
+        
+        self.assertEqual(result, 'Sent 5 notifications')
+        self.assertEqual(self.statuses(), ['sent'] * 5)
+        start_senders.assert_not_called()
+
+
+
+@override_settings(NOTIFICATION_RETRY_MAX_ATTEMPTS=3, NOTIFICATION_RETRY_MAX_DEFERRALS=2)
+class NotificationRetryTests(OutboxTestMixin, TestCase):
+    """Backoff, retry budgets and the sweep of overdue retries"""
+    
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('apps.notifications.tasks.retry_notifications.apply_async')
+        self.start_retry = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def send(self, result=SendResult(True)):
+        EmailService.send_messages.side_effect = lambda messages: [result] * len(messages)
+        with self.captureOnCommitCallbacks(execute=True):
+            NotificationOutbox.send(NotificationOutbox.claim('refill_reminder', 10))
+        return NotificationLog.objects.get()
+    
+    @override_settings(NOTIFICATION_RETRY_BASE_DELAY=30, NOTIFICATION_RETRY_MAX_DELAY=100)
+    def test_backoff_doubles_up_to_max_delay(self):
+        with mock.patch.object(services.random, 'uniform', side_effect=lambda low, high: (low, high)):
+            self.assertEqual(
+                [NotificationRetryPolicy.backoff(tries) for tries in [1, 2, 3, 4]],
+                [(15, 30), (30, 60), (50, 100), (50, 100)]
+            )
+    
+    def test_transient_failure_is_retried(self):
+        self.create_logs(1)
+        
+        log = self.send(SendResult(False, 'Connection reset', True))
+        
+        self.assertEqual((log.status, log.attempts), ('failed', 1))
+        self.assertIsNotNone(log.next_retry_at)
+        self.start_retry.assert_called_once()
+        self.assertEqual(self.start_retry.call_args.kwargs['args'], [[log.id]])
+        self.assertEqual(self.start_retry.call_args.kwargs['queue'], settings.NOTIFICATION_RETRY_QUEUE)
+    
+    def test_rejected_message_is_not_retried(self):
+        self.create_logs(1)
+        
+        log = self.send(SendResult(False, 'Invalid recipient'))
+        
+        self.assertEqual(log.status, 'failed')
+        self.assertIsNone(log.next_retry_at)
+        self.start_retry.assert_not_called()
+    
+    def test_last_attempt_is_not_retried(self):
+        self.create_logs(1, attempts=2)
+        
+        log = self.send(SendResult(False, 'Connection reset', True))
+        
+        self.assertEqual((log.status, log.attempts), ('failed', 3))
+        self.assertIsNone(log.next_retry_at)
+    
+    def test_deferrals_have_their_own_budget(self):
+        ProviderCircuitBreaker.allow.return_value = RedisCircuitBreaker.OPEN
+        self.create_logs(1, attempts=2)
+        
+        log = self.send()
+        self.assertEqual((log.status, log.attempts, log.deferrals), ('deferred', 2, 1))
+        self.assertIsNotNone(log.next_retry_at)
+        
+        NotificationLog.objects.update(status='pending')
+        log = self.send()
+        self.assertEqual((log.status, log.deferrals), ('failed', 2))
+        self.assertIsNone(log.next_retry_at)
+    
+    def test_sweep_retries_overdue_logs_with_tries_left(self):
+        past = timezone.now() - timedelta(minutes=5)
+        self.create_logs(1, status='failed', attempts=1, next_retry_at=past)
+        self.create_logs(1, status='deferred', deferrals=1, next_retry_at=past)
+        self.create_logs(1, status='failed', attempts=1, next_retry_at=timezone.now() + timedelta(minutes=5))
+        self.create_logs(1, status='failed', attempts=3, next_retry_at=past)
+        self.create_logs(1, status='failed', attempts=1)
+        
+        result = retry_due_notifications()
+        
+        self.assertEqual(result, 'Sent 2 of 2 notifications')
+        self.assertEqual(self.statuses(), ['sent', 'sent', 'failed', 'failed', 'failed'])
+    
+    def test_sweep_skips_claimed_retries(self):
+        log, = self.create_logs(1, status='failed', attempts=1, next_retry_at=timezone.now())
+        NotificationOutbox.claim_retries([log.id])
+        
+        self.assertEqual(retry_due_notifications(), 'Sent 0 of 0 notifications')
+        self.assertEqual(self.statuses(), ['sending'])
+
+
+class NotificationDispatcherTests(NotificationTestMixin, SimpleTestCase):
+    """Concurrent sends and channel timeouts"""
+    
+    def test_map_sends_concurrently_in_order(self):
+        # Each send only returns once all three run at the same time
+        barrier = threading.Barrier(3, timeout=5)
+        
+        def send(message):
+            barrier.wait()
+            return SendResult(True, message)
+        
+        results = NotificationDispatcher.map('sms', send, ['a', 'b', 'c'])
+        
+        self.assertEqual([result.error_message for result in results], ['a', 'b', 'c'])
+    
+    def test_map_nothing(self):
+        self.assertEqual(NotificationDispatcher.map('sms', mock.Mock(), []), [])
+    
+    @override_settings(NOTIFICATION_CHANNEL_TIMEOUTS={'sms': 0.05})
+    def test_map_times_out_as_transient_failure(self):
+        release = self.hang_until_cleanup()
+        
+        def send(message):
+            if message == 'slow':
+                release.wait(5)
+            return SendResult(True)
+        
+        results = NotificationDispatcher.map('sms', send, ['slow', 'fast'])
+        
+        self.assertEqual(results, [SendResult(False, 'Timed out after 0.05s', True), SendResult(True)])
+
+
+class NotificationBatchTests(NotificationTestMixin, TestCase):
+    """Sending a batch's channels side by side"""
+    
+    def setUp(self):
+        self.user = self.create_user()
+        self.reminder = self.create_reminder(self.user)
+        self.close_circuits()
+    
+    def make_batch(self, methods):
+        batch = NotificationBatch()
+        for method in methods:
+            batch.add_log(NotificationLog(
+                user=self.user, reminder=self.reminder, notification_type='refill_reminder', method=method
+            ))
+        return batch
+    
+    def test_channels_are_sent_side_by_side(self):
+        barrier = threading.Barrier(3, timeout=5)
+        
+        def send(messages):
+            barrier.wait()
+            return [SendResult(True)] * len(messages)
+        
+        self.patch_channels(email=send, sms=send, push=send)
+        batch = self.make_batch(['email', 'sms', 'push_notification'])
+        
+        logs = batch.send()
+        
+        self.assertEqual([log.status for log in logs], ['sent', 'sent', 'sent'])
+        self.assertEqual(batch.sent_count, 3)
+        self.assertEqual(batch.retryable, [])
+    
+    @override_settings(NOTIFICATION_CHANNEL_TIMEOUTS={'email': 5, 'sms': 5, 'push_notification': 0.05})
+    def test_hung_channel_times_out_as_transient_failure(self):
+        release = self.hang_until_cleanup()
+        
+        def hang(messages):
+            release.wait(5)
+            return [SendResult(True)] * len(messages)
+        
+        self.patch_channels(push=hang)
+        batch = self.make_batch(['email', 'push_notification'])
+        email_log, push_log = batch.send()
+        
+        self.assertEqual(email_log.status, 'sent')
+        self.assertEqual(push_log.status, 'failed')
+        self.assertEqual(push_log.error_message, 'Timed out after 0.05s')
+        self.assertEqual(batch.retryable, [push_log])
+    
+    def test_unreachable_recipient_is_not_sent(self):
+        self.patch_channels()
+        self.user.phone_number = None
+        batch = self.make_batch(['sms'])
+        
+        log, = batch.send()
+        
+        self.assertEqual(log.status, 'failed')
+        self.assertEqual(log.error_message, 'User does not have a phone number')
+        SMSService.send_messages.assert_called_once_with([])
+
+
+
+class EmailServiceTests(NotificationTestMixin, SimpleTestCase):
+    """Pooled SMTP connection of a worker"""
+    
+    def setUp(self):
+        self.connections = []
+        for target, name, kwargs in [
+            (services, 'get_connection', {'side_effect': self.open_connection}),
+            (ProviderCircuitBreaker, 'is_open', {'return_value': False}),
+            (ProviderCircuitBreaker, 'record', {}),
+        ]:
+            patcher = mock.patch.object(target, name, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        EmailService.reset_connection()
+        self.addCleanup(EmailService.reset_connection)
+    
+    def open_connection(self, **kwargs):
+        connection = mock.Mock()
+        self.connections.append(connection)
+        return connection
+    
+    def make_messages(self, count):
+        return [EmailMessage('Subject', 'Body', 'from@example.com', [f"user{i}@example.com"]) for i in range(count)]
+    
+    def test_messages_share_one_connection(self):
+        results = EmailService.send_messages(self.make_messages(3))
+        EmailService.send_messages(self.make_messages(1))
+        
+        self.assertEqual(results, [SendResult(True)] * 3)
+        self.assertEqual(len(self.connections), 1)
+        self.assertEqual(self.connections[0].send_messages.call_count, 4)
+    
+    @override_settings(EMAIL_CONNECTION_IDLE_SECONDS=60)
+    def test_idle_connection_is_reopened(self):
+        with mock.patch.object(services.time, 'monotonic', side_effect=[1000, 1030, 1100]):
+            EmailService.send_messages(self.make_messages(2))
+            EmailService.send_messages(self.make_messages(1))
+        
+        self.assertEqual(len(self.connections), 2)
+        self.connections[0].close.assert_called_once()
+    
+    def test_broken_connection_is_reopened_once(self):
+        EmailService.send_messages(self.make_messages(1))
+        self.connections[0].send_messages.side_effect = smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        
+        result, = EmailService.send_messages(self.make_messages(1))
+        
+        self.assertEqual(result, SendResult(True))
+        self.assertEqual(len(self.connections), 2)
+    
+    def test_connection_failure_is_transient(self):
+        connection = mock.Mock(**{'open.side_effect': ConnectionRefusedError('Connection refused')})
+        services.get_connection.side_effect = lambda **kwargs: connection
+        
+        result, = EmailService.send_messages(self.make_messages(1))
+        
+        self.assertEqual(result, SendResult(False, 'Connection refused', True))
+        self.assertEqual(connection.open.call_count, 2)
+        ProviderCircuitBreaker.record.assert_called_once_with('email', False)
+    
+    def test_rejected_login_is_permanent(self):
+        rejected = smtplib.SMTPAuthenticationError(535, b'Authentication credentials invalid')
+        connection = mock.Mock(**{'open.side_effect': rejected})
+        services.get_connection.side_effect = lambda **kwargs: connection
+        
+        result, = EmailService.send_messages(self.make_messages(1))
+        
+        self.assertIs(result.success, False)
+        self.assertFalse(result.transient)
+        connection.open.assert_called_once()
+        connection.close.assert_called_once()
+        ProviderCircuitBreaker.record.assert_called_once_with('email', True)
+    
+    def test_temporary_reply_is_retried_on_new_connection(self):
+        EmailService.send_messages(self.make_messages(1))
+        self.connections[0].send_messages.side_effect = smtplib.SMTPResponseException(421, b'Try again later')
+        
+        result, = EmailService.send_messages(self.make_messages(1))
+        
+        self.assertEqual(result, SendResult(True))
+        self.assertEqual(len(self.connections), 2)
+
+
+class PushNotificationServiceTests(NotificationTestMixin, SimpleTestCase):
+    """FCM send_each batches"""
+    
+    def setUp(self):
+        for target, name, kwargs in [
+            (PushNotificationService, 'initialize', {'return_value': True}),
+            (ProviderCircuitBreaker, 'is_open', {'return_value': False}),
+            (ProviderCircuitBreaker, 'record', {}),
+            (messaging, 'send_each', {'side_effect': self.fcm_send_each}),
+        ]:
+            patcher = mock.patch.object(target, name, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.fcm_failures = {}
+    
+    def fcm_send_each(self, messages):
+        """Answer like FCM: one response per message, failing those in fcm_failures"""
+        responses = [
+            mock.Mock(success=message.token not in self.fcm_failures, exception=self.fcm_failures.get(message.token))
+            for message in messages
+        ]
+        return mock.Mock(responses=responses, success_count=sum(response.success for response in responses))
+    
+    def make_messages(self, count):
+        return [messaging.Message(token=f"token-{i}") for i in range(count)]
+    
+    @mock.patch.object(PushNotificationService, 'BATCH_SIZE', 2)
+    def test_sends_one_request_per_batch(self):
+        results = PushNotificationService.send_each(self.make_messages(5))
+        
+        self.assertEqual(results, [SendResult(True)] * 5)
+        self.assertEqual([len(call.args[0]) for call in messaging.send_each.call_args_list], [2, 2, 1])
+        ProviderCircuitBreaker.record.assert_called_with('push_notification', True)
+    
+    def test_reports_each_message_result(self):
+        self.fcm_failures['token-1'] = messaging.UnregisteredError('Requested entity was not found.')
+        
+        results = PushNotificationService.send_each(self.make_messages(3))
+        
+        self.assertEqual([result.success for result in results], [True, False, True])
+        self.assertEqual(results[1].error_message, 'Requested entity was not found.')
+        self.assertFalse(results[1].transient)
+    
+    def test_failed_request_fails_its_batch(self):
+        messaging.send_each.side_effect = ConnectionError('Connection reset')
+        
+        results = PushNotificationService.send_each(self.make_messages(2))
+        
+        self.assertEqual(results, [SendResult(False, 'Connection reset', True)] * 2)
+        ProviderCircuitBreaker.record.assert_called_once_with('push_notification', False)
+    
+    def test_open_circuit_defers_batch(self):
+        ProviderCircuitBreaker.is_open.return_value = True
+        
+        results = PushNotificationService.send_each(self.make_messages(2))
+        
+        self.assertEqual([(result.success, result.transient) for result in results], [(None, True)] * 2)
+        messaging.send_each.assert_not_called()
+    
+    def test_not_configured(self):
+        PushNotificationService.initialize.return_value = False
+        
+        results = PushNotificationService.send_each(self.make_messages(1))
+        
+        self.assertEqual(results, [SendResult(False, 'Firebase credentials not configured')])
+        messaging.send_each.assert_not_called()
+
+
+class RedisTokenBucketTests(FakeClockMixin, SimpleTestCase):
+    """GCRA token bucket: 10 tokens per second, bursts of 5"""
+    
+    def setUp(self):
+        super().setUp()
+        self.bucket = self.freeze(RedisTokenBucket('test', rate=10, burst=5, client=self.make_client()))
+    
+    def test_burst_is_available_at_once(self):
+        self.assertEqual(self.bucket.reserve(5), (5, 0))
+    
+    def test_empty_bucket_reports_wait_for_next_token(self):
+        self.bucket.reserve(5)
+        self.assertEqual(self.bucket.reserve(3), (0, 0.1))
+    
+    def test_reserves_what_is_available_within_max_wait(self):
+        self.bucket.reserve(5)
+        self.assertEqual(self.bucket.reserve(3, max_wait=0.2), (2, 0.2))
+    
+    def test_request_larger_than_bucket_is_served_in_part(self):
+        self.assertEqual(self.bucket.reserve(100, max_wait=1), (15, 1.0))
+        self.assertEqual(self.bucket.reserve(100, max_wait=1), (0, 1.1))
+        self.advance(1)
+        self.assertEqual(self.bucket.reserve(100, max_wait=1), (10, 1.0))
+    
+    def test_refills_over_time(self):
+        self.bucket.reserve(5)
+        self.advance(0.3)
+        self.assertEqual(self.bucket.reserve(5), (3, 0))
+        self.advance(10)
+        self.assertEqual(self.bucket.reserve(10), (5, 0))
+    
+    def test_shared_between_workers(self):
+        other = self.freeze(RedisTokenBucket('test', rate=10, burst=5, client=self.make_client()))
+        self.assertEqual(self.bucket.reserve(4), (4, 0))
+        self.assertEqual(other.reserve(4), (1, 0))
+
+
+class RedisCircuitBreakerTests(FakeClockMixin, SimpleTestCase):
+    """Closed, open and half-open states shared by two workers"""
+    
+    def setUp(self):
+        super().setUp()
+        self.breaker = self.make_breaker()
+        self.other = self.make_breaker()
+    
+    def make_breaker(self):
+        return self.freeze(RedisCircuitBreaker(
+            'test', failure_threshold=3, failure_window=60, reset_timeout=30, client=self.make_client()
+        ))
+    
+    def open_circuit(self):
+        for _ in range(3):
+            self.breaker.record_failure()
+    
+    def test_closed_until_threshold(self):
+        self.assertEqual(self.breaker.allow(), RedisCircuitBreaker.CLOSED)
+        self.assertFalse(self.breaker.record_failure())
+        self.assertFalse(self.breaker.record_failure())
+        self.assertEqual(self.other.allow(), RedisCircuitBreaker.CLOSED)
+    
+    def test_opens_for_every_worker(self):
+        self.open_circuit()
+        
+        self.assertTrue(self.breaker.is_open())
+        self.assertEqual(self.breaker.allow(), RedisCircuitBreaker.OPEN)
+        self.assertFalse(self.other.is_open())
+        self.assertEqual(self.other.allow(), RedisCircuitBreaker.OPEN)
+        self.assertTrue(self.other.is_open())
+    
+    def test_failures_from_all_workers_count(self):
+        self.breaker.record_failure()
+        self.other.record_failure()
+        self.assertTrue(self.breaker.record_failure())
+        self.assertEqual(self.other.allow(), RedisCircuitBreaker.OPEN)
+    
+    def test_single_probe_after_reset_timeout(self):
+        self.open_circuit()
+        self.advance(30)
+        
+        self.assertEqual(self.breaker.allow(), RedisCircuitBreaker.HALF_OPEN)
+        self.assertEqual(self.other.allow(), RedisCircuitBreaker.OPEN)
+    
+    def test_probe_success_closes(self):
+        self.open_circuit()
+        self.advance(30)
+        self.breaker.allow()
+        
+        self.breaker.record_success()
+        
+        self.assertEqual(self.breaker.allow(), RedisCircuitBreaker.CLOSED)
+        self.assertEqual(self.other.allow(), RedisCircuitBreaker.CLOSED)
+    
+    def test_probe_failure_reopens(self):
+        self.open_circuit()
+        self.advance(30)
+        self.breaker.allow()
+        
+        self.assertTrue(self.breaker.record_failure())
+        
+        self.assertEqual(self.other.allow(), RedisCircuitBreaker.OPEN)
+        self.advance(29)
+        self.assertEqual(self.breaker.allow(), RedisCircuitBreaker.OPEN)
+        self.advance(1)
+        self.assertEqual(self.other.allow(), RedisCircuitBreaker.HALF_OPEN)
+    
+    def test_success_outside_probe_keeps_circuit_open(self):
+        self.open_circuit()
+        self.other.record_success()
+        self.assertEqual(self.other.allow(), RedisCircuitBreaker.OPEN)
+
+
+class ProviderCircuitBreakerTests(FakeClockMixin, SimpleTestCase):
+    """Per-provider breakers fail open while Redis is down"""
+    
+    def setUp(self):
+        super().setUp()
+        breaker = self.freeze(RedisCircuitBreaker(
+            'smtp', failure_threshold=1, failure_window=60, reset_timeout=30, client=self.make_client()
+        ))
+        patcher = mock.patch.dict(ProviderCircuitBreaker._breakers, {'smtp': breaker}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_failure_opens_provider_circuit(self):
+        ProviderCircuitBreaker.record('email', False)
+        
+        self.assertEqual(ProviderCircuitBreaker.allow('email'), RedisCircuitBreaker.OPEN)
+        self.assertTrue(ProviderCircuitBreaker.is_open('email'))
+    
+    def test_redis_outage_keeps_circuit_closed(self):
+        self.server.connected = False
+        
+        ProviderCircuitBreaker.record('email', False)
+        
+        self.assertEqual(ProviderCircuitBreaker.allow('email'), RedisCircuitBreaker.CLOSED)
+
+
+class NotificationRateLimiterTests(FakeClockMixin, SimpleTestCase):
+    """Per-channel reservations for a batch"""
+    
+    def setUp(self):
+        super().setUp()
+        bucket = self.freeze(RedisTokenBucket('twilio:sms', rate=10, burst=5, client=self.make_client()))
+        patcher = mock.patch.dict(NotificationRateLimiter._buckets, {'sms': bucket, 'email': None}, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_unlimited_channel_is_reserved_in_full(self):
+        reserved, wait = NotificationRateLimiter.reserve({'email': 500, 'sms': 5}, max_wait=0)
+        self.assertEqual(reserved, {'email': 500, 'sms': 5})
+        self.assertEqual(wait, 0)
+    
+    def test_partial_reservation(self):
+        reserved, wait = NotificationRateLimiter.reserve({'sms': 20}, max_wait=0.5)
+        self.assertEqual(reserved, {'sms': 10})
+        self.assertEqual(wait, 0.5)
+    
+    def test_raises_when_nothing_can_be_reserved(self):
+        NotificationRateLimiter.reserve({'sms': 5}, max_wait=0)
+        
+        with self.assertRaises(RateLimited) as context:
+            NotificationRateLimiter.reserve({'sms': 5}, max_wait=0)
+        # Retries are never scheduled sooner than a second ahead
+        self.assertEqual(context.exception.retry_after, 1)
+    
+    def test_empty_batch(self):
+        self.assertEqual(NotificationRateLimiter.reserve({}, max_wait=0), ({}, 0))
@@ -120,6 +120,8 @@ class NotificationLogViewSet(viewsets.ReadOnlyModelViewSet):
         sent_count = queryset.filter(status='sent').count()
         failed_count = queryset.filter(status='failed').count()
         pending_count = queryset.filter(status='pending').count()
+        sending_count = queryset.filter(status='sending').count()
+        deferred_count = queryset.filter(status='deferred').count()
         
         # By notification type
         dose_reminders = queryset.filter(notification_type='dose_reminder').count()
@@ -143,7 +145,9 @@ class NotificationLogViewSet(viewsets.ReadOnlyModelViewSet):
             'by_status': {
                 'sent': sent_count,
                 'failed': failed_count,
-                'pending': pending_count
+                'pending': pending_count,
+                'sending': sending_count,
+                'deferred': deferred_count
             },
             'by_type': {
                 'dose_reminder': dose_reminders,
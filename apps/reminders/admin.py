@@ -1,6 +1,6 @@
 # apps/reminders/admin.py
 from django.contrib import admin
-from .models import Reminder, DoseSchedule
+from .models import Reminder, DoseSchedule, DoseOccurrence, SchedulerCheckpoint
 
 class DoseScheduleInline(admin.TabularInline):
     model = DoseSchedule
@@ -28,4 +28,19 @@ class ReminderAdmin(admin.ModelAdmin):
         ('Status', {
             'fields': ('is_active', 'created_at', 'updated_at')
         }),
-    )
\ No newline at end of file
+    )
+
+
+@admin.register(DoseOccurrence)
+class DoseOccurrenceAdmin(admin.ModelAdmin):
+    list_display = ['dose_schedule', 'scheduled_for', 'dispatched_at', 'created_at']
+    list_filter = ['scheduled_for']
+    search_fields = ['dose_schedule__reminder__medicine_name', 'dose_schedule__reminder__user__email']
+    raw_id_fields = ['dose_schedule']
+    readonly_fields = ['created_at']
+
+
+@admin.register(SchedulerCheckpoint)
+class SchedulerCheckpointAdmin(admin.ModelAdmin):
+    list_display = ['name', 'processed_until', 'fencing_token', 'updated_at']
+    readonly_fields = ['updated_at']
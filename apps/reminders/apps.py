@@ -5,3 +5,7 @@ class RemindersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.reminders'
     verbose_name = 'Reminders'
+    
+    def ready(self):
+        # Keep scheduling state in step with reminder, dose and timezone changes
+        import apps.reminders.signals  # noqa: F401
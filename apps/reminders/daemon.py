@@ -0,0 +1,253 @@
+"""
+Long-running dose scheduler for DOSE_SCHEDULER_MODE='daemon'.
+
+Instead of polling the database every tick, the daemon keeps the dose
+schedules due within DOSE_DAEMON_HORIZON_SECONDS in a heap ordered by
+next_fire_at and sleeps until the earliest one. When a dose fires it is
+claimed, its schedule advanced and its notifications queued in one transaction
+for the sender workers, so doses go out within about a second of their time. The database is read
+only when doses fire, when a reminder changes and on a periodic reload.
+
+Reminder changes are published on a Redis channel after commit and wake
+the daemon, which reloads just that reminder's schedules. The periodic
+reload covers messages lost while no daemon was subscribed.
+
+Several daemons can run at once for availability. They compete for a
+Redis lease: the holder is active and renews it, the others stay on
+standby and retry. An active daemon that is stopped releases the lease
+so a standby takes over within one renew interval; one that dies is
+replaced once its lease expires. Claims are unique per occurrence, so a
+daemon that loses its lease mid-way never sends a dose twice.
+"""
+import heapq
+import logging
+import signal
+import time
+from datetime import timedelta
+import redis
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from apps.reminders.models import DoseSchedule, DoseOccurrence
+from apps.reminders.tasks import _advance_dose_schedules, dispatch_occurrences
+from utils.redis_client import get_redis_client, RedisLease, LeaseLost
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_CHANGES_CHANNEL = 'dose_schedule_changes'
+
+# Upper bound on one sleep, so lease renewal and shutdown stay responsive
+MAX_WAIT_SECONDS = 1.0
+
+
+def publish_schedule_change(reminder_id):
+    """Tell running scheduler daemons that a reminder's schedules changed"""
+    try:
+        get_redis_client().publish(SCHEDULE_CHANGES_CHANNEL, reminder_id)
+    except redis.RedisError as e:
+        # The daemon's periodic reload picks the change up instead
+        logger.warning(f"Failed to publish schedule change of reminder {reminder_id}: {str(e)}")
+
+
+class DoseSchedulerDaemon:
+    """Heap-based dose scheduler with active/standby failover"""
+    
+    def __init__(self, client=None):
+        self.client = client or get_redis_client()
+        self.lease = RedisLease('dose_scheduler_daemon', ttl=settings.DOSE_DAEMON_LEASE_SECONDS, client=self.client)
+        self.horizon = timedelta(seconds=settings.DOSE_DAEMON_HORIZON_SECONDS)
+        self.reload_interval = timedelta(seconds=settings.DOSE_DAEMON_RELOAD_SECONDS)
+        self.renew_interval = timedelta(seconds=settings.DOSE_DAEMON_LEASE_SECONDS / 3)
+        
+        # Heap of (fire_at, schedule_id); entries not matching _fire_at are stale
+        self._heap = []
+        self._fire_at = {}
+        self._loaded_until = None
+        self._reload_at = None
+        self._renew_at = None
+        self._pubsub = None
+        self._stopping = False
+        
+        self.doses_fired = 0
+        self.notifications_queued = 0
+    
+    @property
+    def is_active(self):
+        return self.lease.token is not None
+    
+    def stop(self, *args):
+        """Finish the current step, release the lease and exit"""
+        self._stopping = True
+    
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        
+        logger.info("Dose scheduler daemon started")
+        try:
+            while not self._stopping:
+                if not self.is_active and not self._try_activate():
+                    self._sleep(self.renew_interval.total_seconds())
+                    continue
+                
+                try:
+                    self._step()
+                except LeaseLost:
+                    logger.warning("Dose scheduler lease lost; returning to standby")
+                    self._deactivate()
+                except Exception as e:
+                    # Popped schedules may have been dropped; reload them on the next step
+                    logger.error(f"Error in dose scheduler daemon: {str(e)}", exc_info=True)
+                    self._reload_at = timezone.now()
+                    self._sleep(MAX_WAIT_SECONDS)
+        finally:
+            self._deactivate()
+            logger.info(
+                f"Dose scheduler daemon stopped: {self.doses_fired} doses fired, "
+                f"{self.notifications_queued} notifications queued"
+            )
+    
+    def _try_activate(self):
+        """Try to become active; stays on standby while Redis is unreachable"""
+        try:
+            return self._activate()
+        except redis.RedisError as e:
+            logger.warning(f"Dose scheduler daemon cannot reach Redis, staying on standby: {str(e)}")
+            self._deactivate()
+            return False
+    
+    def _activate(self):
+        if not self.lease.acquire():
+            return False
+        
+        logger.info(f"Dose scheduler daemon is active (fencing token {self.lease.fencing_token})")
+        # Subscribe before loading so no change between the two is missed
+        self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(SCHEDULE_CHANGES_CHANNEL)
+        self._renew_at = timezone.now() + self.renew_interval
+        self._reload(timezone.now())
+        return True
+    
+    def _deactivate(self):
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except redis.RedisError:
+                pass
+            self._pubsub = None
+        
+        self._heap = []
+        self._fire_at = {}
+        self.lease.release()
+    
+    def _step(self):
+        now = timezone.now()
+        
+        if now >= self._renew_at:
+            if not self.lease.renew():
+                raise LeaseLost(f"Lease {self.lease.name} expired")
+            self._renew_at = now + self.renew_interval
+        
+        if now >= self._reload_at:
+            self._reload(now)
+        
+        self._fire_due(now)
+        
+        # Sleep until the next dose, renewal or reload, waking up on changes
+        wake_at = min(self._renew_at, self._reload_at)
+        if self._heap:
+            wake_at = min(wake_at, self._heap[0][0])
+        timeout = min(max((wake_at - timezone.now()).total_seconds(), 0), MAX_WAIT_SECONDS)
+        
+        message = self._pubsub.get_message(timeout=timeout)
+        while message is not None:
+            self._reload_reminder(int(message['data']))
+            message = self._pubsub.get_message()
+    
+    def _reload(self, now):
+        """Rebuild the heap from every schedule due within the horizon"""
+        close_old_connections()
+        self._loaded_until = now + self.horizon
+        
+        self._heap = []
+        self._fire_at = {}
+        for schedule_id, fire_at in DoseSchedule.objects.filter(
+            next_fire_at__lte=self._loaded_until
+        ).values_list('id', 'next_fire_at'):
+            self._push(schedule_id, fire_at)
+        
+        self._reload_at = now + self.reload_interval
+        logger.info(f"Dose scheduler loaded {len(self._fire_at)} schedules due before {self._loaded_until}")
+    
+    def _reload_reminder(self, reminder_id):
+        """Pick up new fire times of one reminder's schedules"""
+        close_old_connections()
+        for schedule_id, fire_at in DoseSchedule.objects.filter(
+            reminder_id=reminder_id
+        ).values_list('id', 'next_fire_at'):
+            self._fire_at.pop(schedule_id, None)
+            self._push(schedule_id, fire_at)
+        logger.debug(f"Dose scheduler reloaded schedules of reminder {reminder_id}")
+    
+    def _push(self, schedule_id, fire_at):
+        if fire_at is None or fire_at > self._loaded_until:
+            return
+        self._fire_at[schedule_id] = fire_at
+        heapq.heappush(self._heap, (fire_at, schedule_id))
+    
+    def _pop_due(self, now):
+        due_ids = []
+        while self._heap and self._heap[0][0] <= now:
+            fire_at, schedule_id = heapq.heappop(self._heap)
+            if self._fire_at.get(schedule_id) == fire_at:
+                del self._fire_at[schedule_id]
+                due_ids.append(schedule_id)
+        return due_ids
+    
+    def _fire_due(self, now):
+        """Claim and queue every dose that is due, then re-queue its schedule"""
+        due_ids = self._pop_due(now)
+        if not due_ids:
+            return
+        
+        close_old_connections()
+        horizon = now - timedelta(minutes=settings.DOSE_MAX_CATCH_UP_MINUTES)
+        
+        with transaction.atomic():
+            # Schedules changed or deleted since they were loaded drop out here
+            due_schedules = list(
+                DoseSchedule.objects.filter(id__in=due_ids, next_fire_at__lte=now)
+                .select_for_update(of=('self',)).select_related('reminder__user')
+            )
+            
+            due_doses = [
+                (dose_schedule.id, dose_schedule.next_fire_at)
+                for dose_schedule in due_schedules
+                if dose_schedule.reminder.is_active
+                and dose_schedule.reminder.quantity > 0
+                and dose_schedule.next_fire_at > horizon
+            ]
+            occurrence_ids = [occurrence_id for occurrence_id, _ in DoseOccurrence.objects.claim(due_doses)]
+            
+            _advance_dose_schedules(due_schedules, now)
+            
+            # Dispatched in the claiming transaction, so a crash can never leave a claimed dose unsent
+            notifications_queued = dispatch_occurrences(occurrence_ids)
+            
+            if not self.lease.renew():
+                raise LeaseLost(f"Lease {self.lease.name} expired before committing")
+        
+        for dose_schedule in due_schedules:
+            self._push(dose_schedule.id, dose_schedule.next_fire_at)
+        
+        self.doses_fired += len(occurrence_ids)
+        self.notifications_queued += notifications_queued
+        
+        lag = (timezone.now() - now).total_seconds()
+        logger.info(f"Dose scheduler fired {len(occurrence_ids)} doses ({lag:.3f}s)")
+    
+    def _sleep(self, seconds):
+        # Short sleeps so a stop signal is noticed quickly on standby
+        deadline = time.monotonic() + seconds
+        while not self._stopping and time.monotonic() < deadline:
+            time.sleep(min(deadline - time.monotonic(), MAX_WAIT_SECONDS))
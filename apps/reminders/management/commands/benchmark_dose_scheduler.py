@@ -0,0 +1,129 @@
+# apps/reminders/management/commands/benchmark_dose_scheduler.py
+import json
+import statistics
+import subprocess
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncMinute
+from django.test.utils import override_settings
+from django.utils import timezone
+from apps.users.models import CustomUser
+from apps.reminders.models import Reminder, DoseSchedule
+from apps.reminders.replay import reset_schedules, run_dry_tick
+
+
+class Command(BaseCommand):
+    help = (
+        'Time dry-run dose ticks at the quietest and busiest minute of the next '
+        'day and write query counts, wall time and memory to a JSON file'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default='scheduler-benchmark.json', help='JSON file to write')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per tick (default 5)')
+        parser.add_argument('--mode', choices=['index', 'snapshot'], default=None, help='Scheduler mode (default: settings)')
+    
+    def handle(self, *args, **options):
+        mode = options['mode'] or settings.DOSE_SCHEDULER_MODE
+        if mode not in ('index', 'snapshot'):
+            raise CommandError(f"Only the index and snapshot tick can be benchmarked, not '{mode}'")
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        
+        now = timezone.now().replace(second=0, microsecond=0)
+        quiet_minute, peak_minute = self._pick_minutes(now)
+        
+        with override_settings(DOSE_SCHEDULER_MODE=mode):
+            # Builds the snapshot in snapshot mode and warms up caches and connections
+            self._measure(now, repeat=1)
+            
+            results = {
+                'quiet': self._measure(quiet_minute, options['repeat']),
+                'peak': self._measure(peak_minute, options['repeat']),
+            }
+        
+        report = {
+            'commit': self._commit(),
+            'created_at': timezone.now().isoformat(),
+            'database': settings.DATABASES['default']['ENGINE'],
+            'mode': mode,
+            'chunk_size': settings.DOSE_TICK_CHUNK_SIZE,
+            'population': {
+                'users': CustomUser.objects.count(),
+                'reminders': Reminder.objects.count(),
+                'dose_schedules': DoseSchedule.objects.count(),
+            },
+            'ticks': results,
+        }
+        
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name}: {result['doses']} doses, {result['queries']} queries, "
+                f"median {result['wall_ms']['median']} ms, peak alloc {result['peak_alloc_kb']} KB"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}"))
+    
+    def _pick_minutes(self, now):
+        """Return the minutes with the fewest and the most doses due in the next day"""
+        per_minute = list(
+            DoseSchedule.objects.filter(
+                next_fire_at__gt=now,
+                next_fire_at__lte=now + timedelta(days=1)
+            ).annotate(minute=TruncMinute('next_fire_at')).values('minute')
+            .annotate(doses=Count('id')).order_by('-doses', 'minute')
+            .values_list('minute', 'doses')
+        )
+        if not per_minute:
+            raise CommandError('No doses are due in the next day; seed some with seed_dose_population')
+        
+        peak_minute = per_minute[0][0]
+        
+        # Prefer a minute with no doses at all, otherwise the least busy one
+        busy_minutes = {minute for minute, _ in per_minute}
+        quiet_minute = now + timedelta(minutes=1)
+        while quiet_minute in busy_minutes and quiet_minute < now + timedelta(days=1):
+            quiet_minute += timedelta(minutes=1)
+        if quiet_minute in busy_minutes:
+            quiet_minute = per_minute[-1][0]
+        
+        return quiet_minute, peak_minute
+    
+    def _measure(self, minute, repeat):
+        """Time the tick covering `minute`, each run starting from the same state"""
+        runs = []
+        for run in range(repeat + 1):
+            with transaction.atomic():
+                # Only the doses of this minute are due when the tick runs
+                previous_tick = minute - timedelta(minutes=1)
+                reset_schedules(previous_tick, DoseSchedule.objects.filter(next_fire_at__lte=previous_tick))
+                # The last run traces allocations, which slows it down
+                runs.append(run_dry_tick(minute, trace_memory=run == repeat))
+                transaction.set_rollback(True)
+        
+        timed = [tick['wall_ms'] for tick in runs[:-1]] or [runs[-1]['wall_ms']]
+        return {
+            'minute': minute.isoformat(),
+            'doses': runs[-1]['doses'],
+            'queries': runs[-1]['queries'],
+            'wall_ms': {
+                'min': min(timed),
+                'median': round(statistics.median(timed), 2),
+                'max': max(timed),
+            },
+            'peak_alloc_kb': runs[-1]['peak_alloc_kb'],
+            'peak_rss_kb': runs[-1]['peak_rss_kb'],
+        }
+    
+    def _commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,27 @@
+# apps/reminders/management/commands/queue_metrics.py
+import json
+from django.core.management.base import BaseCommand
+from medicine_reminder.celery import QUEUES, app
+from utils.queue_metrics import collect
+
+
+class Command(BaseCommand):
+    help = 'Show the depth of each Celery queue and how long its recent tasks waited to start'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print the metrics as JSON')
+    
+    def handle(self, *args, **options):
+        metrics = collect(app, QUEUES)
+        
+        if options['json']:
+            self.stdout.write(json.dumps(metrics, indent=2))
+            return
+        
+        for queue, queue_metrics in metrics.items():
+            wait = queue_metrics['wait']
+            self.stdout.write(
+                f"{queue}: {queue_metrics['depth']} waiting, "
+                f"wait p50 {wait['p50_ms']} ms, p95 {wait['p95_ms']} ms, max {wait['max_ms']} ms "
+                f"over {wait['samples']} tasks"
+            )
@@ -0,0 +1,87 @@
+# apps/reminders/management/commands/replay_dose_scheduler.py
+import json
+from datetime import timedelta, timezone as dt_timezone
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from apps.reminders.replay import reset_schedules, run_dry_tick
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay dose ticks over a time window as dry runs and report which doses '
+        'would fire, with per-tick query counts and wall time. Nothing is sent or '
+        'kept, but dose schedules stay locked until the replay ends, so run it '
+        'against a copy of production.'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='Window start (ISO datetime, default now)')
+        parser.add_argument('--end', help='Window end (ISO datetime, default start + 1 day)')
+        parser.add_argument('--step', type=int, default=60, help='Seconds between ticks (default 60)')
+        parser.add_argument('--output', help='Write the full report to this JSON file')
+        parser.add_argument('--show-doses', action='store_true', help='Print every dose that would fire')
+    
+    def handle(self, *args, **options):
+        start = self._parse(options['start']) if options['start'] else timezone.now()
+        end = self._parse(options['end']) if options['end'] else start + timedelta(days=1)
+        step = timedelta(seconds=options['step'])
+        
+        if end <= start or options['step'] <= 0:
+            raise CommandError('The window must be non-empty and --step positive')
+        if start + step > end:
+            raise CommandError('The window is shorter than --step, so it contains no tick')
+        
+        ticks = []
+        
+        with transaction.atomic():
+            reset_schedules(start)
+            
+            now = start + step
+            while now <= end:
+                tick = run_dry_tick(now)
+                ticks.append(tick)
+                
+                if options['show_doses']:
+                    for dose_schedule_id, scheduled_for in tick['fired']:
+                        self.stdout.write(f"{now.isoformat()}  schedule {dose_schedule_id} due {scheduled_for}")
+                
+                now += step
+            
+            # Leave no trace of the replay
+            transaction.set_rollback(True)
+        
+        summary = self._summarize(start, end, ticks)
+        
+        for key, value in summary.items():
+            self.stdout.write(f"{key}: {value}")
+        
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'summary': summary, 'ticks': ticks}, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
+    
+    def _parse(self, value):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f"Invalid datetime: {value}")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+        return parsed
+    
+    def _summarize(self, start, end, ticks):
+        peak = max(ticks, key=lambda tick: tick['doses'])
+        return {
+            'window': f"{start.isoformat()} - {end.isoformat()}",
+            'ticks': len(ticks),
+            'doses': sum(tick['doses'] for tick in ticks),
+            'peak_tick': peak['now'],
+            'peak_doses': peak['doses'],
+            'max_queries': max(tick['queries'] for tick in ticks),
+            'max_wall_ms': max(tick['wall_ms'] for tick in ticks),
+            'total_wall_ms': round(sum(tick['wall_ms'] for tick in ticks), 2),
+            'peak_rss_kb': max(
+                (tick['peak_rss_kb'] for tick in ticks if tick['peak_rss_kb'] is not None), default=None
+            ),
+        }
@@ -0,0 +1,23 @@
+# apps/reminders/management/commands/run_dose_scheduler.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.reminders.daemon import DoseSchedulerDaemon
+
+
+class Command(BaseCommand):
+    help = 'Run the dose scheduler daemon (DOSE_SCHEDULER_MODE=daemon); extra instances wait on standby'
+    
+    def handle(self, *args, **options):
+        if settings.DOSE_SCHEDULER_MODE != 'daemon':
+            self.stdout.write(self.style.WARNING(
+                f"DOSE_SCHEDULER_MODE is '{settings.DOSE_SCHEDULER_MODE}'; "
+                f"set it to 'daemon' so beat ticks do not fire doses as well"
+            ))
+        
+        daemon = DoseSchedulerDaemon()
+        daemon.run()
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Dose scheduler stopped: {daemon.doses_fired} doses fired, "
+            f"{daemon.notifications_queued} notifications queued"
+        ))
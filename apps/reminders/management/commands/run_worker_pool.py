@@ -0,0 +1,29 @@
+# apps/reminders/management/commands/run_worker_pool.py
+from django.core.management.base import BaseCommand, CommandError
+from medicine_reminder.celery import WORKER_POOLS, app
+
+
+class Command(BaseCommand):
+    help = 'Start a Celery worker for one worker pool, consuming only that pool\'s queues'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('pool', choices=sorted(WORKER_POOLS), help='Worker pool to run')
+        parser.add_argument('--concurrency', type=int, default=None, help='Override the pool concurrency')
+        parser.add_argument('--loglevel', default='info', help='Worker log level (default info)')
+    
+    def handle(self, *args, **options):
+        pool = WORKER_POOLS[options['pool']]
+        concurrency = options['concurrency'] or pool['concurrency']
+        if concurrency < 1:
+            raise CommandError('--concurrency must be at least 1')
+        
+        app.conf.worker_prefetch_multiplier = pool['prefetch_multiplier']
+        app.worker_main(argv=[
+            'worker',
+            f"--hostname={options['pool']}@%h",
+            f"--queues={','.join(pool['queues'])}",
+            f'--concurrency={concurrency}',
+            f"--loglevel={options['loglevel']}",
+            # Hand tasks to free processes only, so one slow send holds up nothing queued behind it
+            '-O', 'fair',
+        ])
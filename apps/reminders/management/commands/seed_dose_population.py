@@ -0,0 +1,143 @@
+# apps/reminders/management/commands/seed_dose_population.py
+import random
+from datetime import time, timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from apps.users.models import CustomUser
+from apps.reminders.models import Reminder, DoseSchedule
+from apps.reminders.scheduling import TimezoneContextCache, dose_minutes_for
+
+# Synthetic users are recognised by this email domain
+SEED_EMAIL_DOMAIN = 'benchmark.invalid'
+
+# Rough share of users per timezone
+TIMEZONE_WEIGHTS = [
+    ('Asia/Kolkata', 30),
+    ('America/New_York', 14),
+    ('America/Chicago', 6),
+    ('America/Denver', 2),
+    ('America/Los_Angeles', 8),
+    ('America/Sao_Paulo', 5),
+    ('Europe/London', 8),
+    ('Europe/Berlin', 8),
+    ('Africa/Lagos', 4),
+    ('Asia/Dubai', 3),
+    ('Asia/Singapore', 3),
+    ('Asia/Tokyo', 4),
+    ('Australia/Sydney', 3),
+    ('UTC', 2),
+]
+
+# Most people take one to three doses a day
+DOSE_COUNT_WEIGHTS = [35, 30, 15, 8, 4, 3, 2, 1, 1, 1]
+
+
+class Command(BaseCommand):
+    help = 'Create synthetic users with reminders and dose schedules for scheduler benchmarks'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users to create (default 1000)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users created per transaction')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for a reproducible population')
+        parser.add_argument('--clear', action='store_true', help='Delete previously seeded users first')
+    
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        
+        if options['clear']:
+            deleted, _ = CustomUser.objects.filter(email__endswith=f'@{SEED_EMAIL_DOMAIN}').delete()
+            self.stdout.write(f"Deleted {deleted} seeded rows")
+        
+        # Hashing is slow, so every seeded user shares one password hash
+        password = make_password('benchmark')
+        offset = CustomUser.objects.filter(email__endswith=f'@{SEED_EMAIL_DOMAIN}').count()
+        totals = {'users': 0, 'reminders': 0, 'dose_schedules': 0}
+        
+        for batch_start in range(0, options['users'], options['batch_size']):
+            batch_end = min(batch_start + options['batch_size'], options['users'])
+            counts = self._create_batch(rng, password, offset + batch_start, offset + batch_end)
+            
+            for key, value in counts.items():
+                totals[key] += value
+            self.stdout.write(f"Seeded {batch_end}/{options['users']} users")
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {totals['users']} users, {totals['reminders']} reminders "
+            f"and {totals['dose_schedules']} dose schedules"
+        ))
+    
+    @transaction.atomic
+    def _create_batch(self, rng, password, start, end):
+        now = timezone.now()
+        today = now.date()
+        timezones, weights = zip(*TIMEZONE_WEIGHTS)
+        
+        users = CustomUser.objects.bulk_create([
+            CustomUser(
+                email=f'user{number}@{SEED_EMAIL_DOMAIN}',
+                password=password,
+                timezone=rng.choices(timezones, weights)[0],
+                is_onboarded=True,
+            )
+            for number in range(start, end)
+        ])
+        
+        reminders = []
+        dose_times = []
+        for user in users:
+            for reminder_number in range(rng.choices([1, 2, 3], [60, 30, 10])[0]):
+                times = self._dose_times(rng, rng.choices(range(1, 11), DOSE_COUNT_WEIGHTS)[0])
+                quantity = Decimal(rng.randint(10, 120))
+                reminders.append(Reminder(
+                    user=user,
+                    medicine_name=f'Medicine {reminder_number + 1}',
+                    medicine_type=rng.choice(['tablet', 'tablet', 'capsule', 'syrup']),
+                    dose_count_daily=len(times),
+                    notification_methods=['email'],
+                    start_date=today - timedelta(days=rng.randint(0, 60)),
+                    quantity=quantity,
+                    initial_quantity=quantity,
+                    dose_minutes=dose_minutes_for(times),
+                ))
+                dose_times.append(times)
+        
+        reminders = Reminder.objects.bulk_create(reminders)
+        
+        # bulk_create skips save(), so the first occurrence is set here
+        tz_cache = TimezoneContextCache(now)
+        dose_schedules = []
+        for reminder, times in zip(reminders, dose_times):
+            for dose_number, dose_time in enumerate(times, start=1):
+                dose_schedules.append(DoseSchedule(
+                    reminder=reminder,
+                    dose_number=dose_number,
+                    amount=1,
+                    time=dose_time,
+                    next_fire_at=tz_cache.next_fire_at(reminder.user.timezone, dose_time, reminder.start_date),
+                ))
+        
+        DoseSchedule.objects.bulk_create(dose_schedules)
+        
+        return {'users': len(users), 'reminders': len(reminders), 'dose_schedules': len(dose_schedules)}
+    
+    def _dose_times(self, rng, count):
+        """Spread doses over the waking day, mostly on the quarter hour"""
+        if count == 1:
+            minutes = [rng.choice([8 * 60, 9 * 60, 21 * 60, 22 * 60])]
+        else:
+            step = 14 * 60 // (count - 1)
+            minutes = [8 * 60 + i * step for i in range(count)]
+        
+        dose_times = []
+        for minute in minutes:
+            # Some people pick an odd time or shift the usual one a little
+            if rng.random() < 0.3:
+                minute += rng.choice([-30, -15, 15, 30])
+            if rng.random() < 0.1:
+                minute += rng.randint(-7, 7)
+            minute = min(max(minute, 0), 24 * 60 - 1)
+            dose_times.append(time(minute // 60, minute % 60))
+        return sorted(set(dose_times))
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.9 on 2026-10-16 22:33
+
+from datetime import datetime, timedelta
+
+import pytz
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def populate_next_fire_at(apps, schema_editor):
+    DoseSchedule = apps.get_model('reminders', 'DoseSchedule')
+    now_utc = timezone.now()
+
+    dose_schedules = list(DoseSchedule.objects.select_related('reminder__user'))
+    for dose_schedule in dose_schedules:
+        reminder = dose_schedule.reminder
+        user_timezone = pytz.timezone(reminder.user.timezone)
+        local_date = max(now_utc.astimezone(user_timezone).date(), reminder.start_date)
+        for day_offset in range(3):
+            dose_datetime = datetime.combine(local_date + timedelta(days=day_offset), dose_schedule.time)
+            dose_datetime = user_timezone.normalize(user_timezone.localize(dose_datetime))
+            if dose_datetime > now_utc:
+                dose_schedule.next_fire_at = dose_datetime.astimezone(pytz.utc)
+                break
+
+    DoseSchedule.objects.bulk_update(dose_schedules, ['next_fire_at'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doseschedule',
+            name='next_fire_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='Next UTC time this dose is due (maintained by the scheduler)', null=True),
+        ),
+        migrations.RunPython(populate_next_fire_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.9 on 2026-10-16 22:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0003_doseschedule_next_fire_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoseOccurrence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scheduled_for', models.DateTimeField(help_text='UTC time the dose was due')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('dose_schedule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='occurrences', to='reminders.doseschedule')),
+            ],
+            options={
+                'verbose_name': 'Dose Occurrence',
+                'verbose_name_plural': 'Dose Occurrences',
+                'db_table': 'reminders_doseoccurrence',
+                'ordering': ['-scheduled_for'],
+                'constraints': [models.UniqueConstraint(fields=('dose_schedule', 'scheduled_for'), name='unique_dose_occurrence')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.9 on 2026-10-16 22:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0004_doseoccurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doseoccurrence',
+            name='dispatched_at',
+            field=models.DateTimeField(blank=True, help_text='When a dispatch worker picked up this occurrence', null=True),
+        ),
+    ]
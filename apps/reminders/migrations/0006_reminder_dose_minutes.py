@@ -0,0 +1,31 @@
+# Generated by Django 5.2.9 on 2026-10-16 22:37
+
+from django.db import migrations, models
+
+
+def populate_dose_minutes(apps, schema_editor):
+    Reminder = apps.get_model('reminders', 'Reminder')
+
+    reminders = list(Reminder.objects.prefetch_related('dose_schedules'))
+    for reminder in reminders:
+        reminder.dose_minutes = sorted(
+            dose.time.hour * 60 + dose.time.minute for dose in reminder.dose_schedules.all()
+        )
+
+    Reminder.objects.bulk_update(reminders, ['dose_minutes'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0005_doseoccurrence_dispatched_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reminder',
+            name='dose_minutes',
+            field=models.JSONField(blank=True, default=list, help_text='Sorted local minute-of-day (0-1439) of each dose schedule'),
+        ),
+        migrations.RunPython(populate_dose_minutes, migrations.RunPython.noop),
+    ]
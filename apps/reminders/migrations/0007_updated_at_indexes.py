@@ -0,0 +1,23 @@
+# Generated by Django 5.2.9 on 2026-10-16 22:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0006_reminder_dose_minutes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doseschedule',
+            index=models.Index(fields=['updated_at'], name='reminders_d_updated_eb403d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reminder',
+            index=models.Index(fields=['updated_at'], name='reminders_r_updated_e81b10_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-16 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0007_updated_at_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SchedulerCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('processed_until', models.DateTimeField(help_text='Doses due up to this UTC time have been planned')),
+                ('fencing_token', models.BigIntegerField(default=0, help_text='Fencing token of the lease that last advanced the watermark')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Scheduler Checkpoint',
+                'verbose_name_plural': 'Scheduler Checkpoints',
+                'db_table': 'reminders_schedulercheckpoint',
+            },
+        ),
+    ]
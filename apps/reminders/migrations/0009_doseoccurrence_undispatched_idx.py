@@ -0,0 +1,17 @@
+# Generated by Django 5.2.9 on 2026-10-16 23:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reminders', '0008_schedulercheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doseoccurrence',
+            index=models.Index(condition=models.Q(('dispatched_at__isnull', True)), fields=['scheduled_for'], name='undispatched_occurrence_idx'),
+        ),
+    ]
@@ -1,7 +1,10 @@
 # apps/reminders/models.py
-from django.db import models
+from django.conf import settings
+from django.db import models, connection, transaction
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 from apps.users.models import CustomUser
+from apps.reminders.scheduling import next_fire_at
 
 
 class Reminder(models.Model):
@@ -49,6 +52,11 @@ class Reminder(models.Model):
         help_text='Flag to track if refill reminder has been sent'
     )
     is_active = models.BooleanField(default=True, db_index=True)
+    dose_minutes = models.JSONField(
+        default=list,
+        blank=True,
+        help_text='Sorted local minute-of-day (0-1439) of each dose schedule'
+    )
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -61,6 +69,7 @@ class Reminder(models.Model):
         indexes = [
             models.Index(fields=['user', 'is_active']),
             models.Index(fields=['start_date']),
+            models.Index(fields=['updated_at']),
         ]
     
     def __str__(self):
@@ -80,6 +89,25 @@ class Reminder(models.Model):
             self.is_active = False
         
         super().save(*args, **kwargs)
+    
+    def reschedule_doses(self, after=None):
+        """
+        Recompute next_fire_at for all dose schedules of this reminder.
+        In ETA mode the reminder's queued occurrences are rebuilt as well,
+        and in daemon mode running scheduler daemons are notified.
+        """
+        dose_schedules = list(self.dose_schedules.all())
+        for dose_schedule in dose_schedules:
+            dose_schedule.reminder = self
+            dose_schedule.next_fire_at = dose_schedule.compute_next_fire_at(after)
+        DoseSchedule.objects.bulk_update(dose_schedules, ['next_fire_at'])
+        
+        if settings.DOSE_SCHEDULER_MODE == 'eta':
+            from apps.reminders.tasks import rebuild_reminder_occurrences
+            transaction.on_commit(lambda: rebuild_reminder_occurrences.delay(self.id))
+        elif settings.DOSE_SCHEDULER_MODE == 'daemon':
+            from apps.reminders.daemon import publish_schedule_change
+            transaction.on_commit(lambda: publish_schedule_change(self.id))
 
 
 class DoseSchedule(models.Model):
@@ -100,6 +128,12 @@ class DoseSchedule(models.Model):
         help_text='Amount of medicine per dose (tablets/ml/units)'
     )
     time = models.TimeField(help_text='Time to take the dose')
+    next_fire_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text='Next UTC time this dose is due (maintained by the scheduler)'
+    )
     
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -112,7 +146,145 @@ class DoseSchedule(models.Model):
         unique_together = [['reminder', 'dose_number']]
         indexes = [
             models.Index(fields=['reminder', 'time']),
+            models.Index(fields=['updated_at']),
         ]
     
     def __str__(self):
-        return f"Dose {self.dose_number} - {self.reminder.medicine_name} at {self.time}"
\ No newline at end of file
+        return f"Dose {self.dose_number} - {self.reminder.medicine_name} at {self.time}"
+    
+    def save(self, *args, **kwargs):
+        # Schedule the first occurrence on creation
+        if self.next_fire_at is None:
+            self.next_fire_at = self.compute_next_fire_at()
+        
+        super().save(*args, **kwargs)
+    
+    def compute_next_fire_at(self, after=None, tz_cache=None):
+        """
+        Return the next UTC datetime this dose is due, strictly after `after`.
+        The dose time is interpreted in the user's timezone and never before
+        the reminder's start date. A TimezoneContextCache may be passed to
+        reuse per-timezone work computed for the cache's "now".
+        """
+        if tz_cache is not None:
+            return tz_cache.next_fire_at(self.reminder.user.timezone, self.time, self.reminder.start_date)
+        
+        return next_fire_at(self.reminder.user.timezone, self.time, self.reminder.start_date, after or timezone.now())
+
+
+class DoseOccurrenceManager(models.Manager):
+    """Manager that claims dose occurrences exactly once"""
+    
+    def claim(self, due_doses):
+        """
+        Insert occurrences for (dose_schedule_id, scheduled_for) pairs in a
+        single INSERT ... ON CONFLICT DO NOTHING statement.
+        
+        Returns (occurrence_id, dose_schedule_id) tuples for the rows this
+        call inserted; pairs already claimed by another tick are skipped.
+        """
+        if not due_doses:
+            return []
+        
+        adapt = connection.ops.adapt_datetimefield_value
+        created_at = adapt(timezone.now())
+        
+        params = []
+        for dose_schedule_id, scheduled_for in due_doses:
+            params.extend([dose_schedule_id, adapt(scheduled_for), created_at])
+        
+        placeholders = ', '.join(['(%s, %s, %s)'] * len(due_doses))
+        sql = (
+            f'INSERT INTO {self.model._meta.db_table} (dose_schedule_id, scheduled_for, created_at) '
+            f'VALUES {placeholders} '
+            f'ON CONFLICT (dose_schedule_id, scheduled_for) DO NOTHING '
+            f'RETURNING id, dose_schedule_id'
+        )
+        
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [tuple(row) for row in cursor.fetchall()]
+    
+    def mark_dispatched(self, occurrence_ids):
+        """
+        Stamp dispatched_at on the given occurrences and return the ids that
+        were not dispatched before, so a redelivered batch never re-sends.
+        """
+        if not occurrence_ids:
+            return []
+        
+        adapt = connection.ops.adapt_datetimefield_value
+        placeholders = ', '.join(['%s'] * len(occurrence_ids))
+        sql = (
+            f'UPDATE {self.model._meta.db_table} SET dispatched_at = %s '
+            f'WHERE id IN ({placeholders}) AND dispatched_at IS NULL '
+            f'RETURNING id'
+        )
+        
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [adapt(timezone.now()), *occurrence_ids])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class DoseOccurrence(models.Model):
+    """A single due dose of a schedule, claimed once by the scheduler"""
+    
+    dose_schedule = models.ForeignKey(
+        DoseSchedule,
+        on_delete=models.CASCADE,
+        related_name='occurrences'
+    )
+    scheduled_for = models.DateTimeField(help_text='UTC time the dose was due')
+    dispatched_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text='When a dispatch worker picked up this occurrence'
+    )
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    objects = DoseOccurrenceManager()
+    
+    class Meta:
+        db_table = 'reminders_doseoccurrence'
+        verbose_name = 'Dose Occurrence'
+        verbose_name_plural = 'Dose Occurrences'
+        ordering = ['-scheduled_for']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dose_schedule', 'scheduled_for'],
+                name='unique_dose_occurrence'
+            ),
+        ]
+        indexes = [
+            # Finds claimed doses that were never dispatched
+            models.Index(
+                fields=['scheduled_for'],
+                condition=models.Q(dispatched_at__isnull=True),
+                name='undispatched_occurrence_idx'
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Dose {self.dose_schedule.dose_number} - {self.dose_schedule.reminder.medicine_name} due {self.scheduled_for}"
+
+
+class SchedulerCheckpoint(models.Model):
+    """Persisted "processed up to" watermark of a scheduler loop"""
+    
+    name = models.CharField(max_length=100, unique=True)
+    processed_until = models.DateTimeField(help_text='Doses due up to this UTC time have been planned')
+    fencing_token = models.BigIntegerField(
+        default=0,
+        help_text='Fencing token of the lease that last advanced the watermark'
+    )
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'reminders_schedulercheckpoint'
+        verbose_name = 'Scheduler Checkpoint'
+        verbose_name_plural = 'Scheduler Checkpoints'
+    
+    def __str__(self):
+        return f"{self.name} processed until {self.processed_until}"
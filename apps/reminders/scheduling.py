@@ -0,0 +1,114 @@
+from bisect import bisect_right
+from datetime import datetime, time, timedelta
+import pytz
+
+MINUTES_PER_DAY = 24 * 60
+
+# Any dose due "today" or "tomorrow" in local time lies within this window
+LOOKAHEAD = timedelta(hours=48)
+
+
+def minute_of_day(value):
+    """Return the minute of the day (0-1439) of a time or datetime"""
+    return value.hour * 60 + value.minute
+
+
+def time_from_minute(minute):
+    """Return the time for a minute of the day"""
+    return time(minute // 60, minute % 60)
+
+
+def dose_minutes_for(times):
+    """Return the sorted minute-of-day array for a list of dose times"""
+    return sorted(minute_of_day(value) for value in times)
+
+
+def next_dose_minute(dose_minutes, minute):
+    """
+    Return the first dose minute strictly after `minute`, wrapping to the
+    first dose of the next day. Returns None if there are no doses.
+    """
+    if not dose_minutes:
+        return None
+    index = bisect_right(dose_minutes, minute)
+    return dose_minutes[index] if index < len(dose_minutes) else dose_minutes[0]
+
+
+def next_fire_at(timezone_name, dose_time, start_date, after):
+    """
+    Return the next UTC datetime a local dose time is due, strictly after
+    `after` and never before `start_date` (a local date).
+    """
+    user_timezone = pytz.timezone(timezone_name)
+    local_date = max(after.astimezone(user_timezone).date(), start_date)
+    
+    # Three days covers any UTC offset plus a DST shift
+    for day_offset in range(3):
+        dose_datetime = datetime.combine(local_date + timedelta(days=day_offset), dose_time)
+        # normalize() moves times that fall into a DST gap forward
+        dose_datetime = user_timezone.normalize(user_timezone.localize(dose_datetime))
+        if dose_datetime > after:
+            return dose_datetime.astimezone(pytz.utc)
+    
+    return None
+
+
+class TimezoneContext:
+    """Localized view of one UTC instant in one timezone"""
+    
+    def __init__(self, timezone_name, now_utc):
+        self.timezone_name = timezone_name
+        self.now_utc = now_utc
+        
+        user_timezone = pytz.timezone(timezone_name)
+        self.now_local = now_utc.astimezone(user_timezone)
+        self.today = self.now_local.date()
+        self.minute_of_day = minute_of_day(self.now_local)
+        self.utc_offset_minutes = int(self.now_local.utcoffset().total_seconds()) // 60
+        
+        # A DST change within the lookahead makes the fixed offset unreliable
+        later_offset = (now_utc + LOOKAHEAD).astimezone(user_timezone).utcoffset()
+        self.has_transition = later_offset != self.now_local.utcoffset()
+    
+    def next_fire_at(self, dose_time, start_date):
+        """Return the next UTC datetime a local dose time is due after now"""
+        if self.has_transition or start_date > self.today or dose_time.second or dose_time.microsecond:
+            return next_fire_at(self.timezone_name, dose_time, start_date, self.now_utc)
+        
+        dose_minute = minute_of_day(dose_time)
+        local_date = self.today if dose_minute > self.minute_of_day else self.today + timedelta(days=1)
+        
+        local_minutes = dose_minute - self.utc_offset_minutes
+        return datetime.combine(local_date, datetime.min.time(), tzinfo=pytz.utc) + timedelta(minutes=local_minutes)
+
+
+class TimezoneContextCache:
+    """
+    Per-tick cache of TimezoneContext objects keyed by timezone name.
+    
+    Users share a few dozen timezones, so each tick localizes "now" once
+    per timezone and due checks become integer minute-of-day comparisons.
+    Days with a DST transition fall back to full localization.
+    """
+    
+    def __init__(self, now_utc):
+        self.now_utc = now_utc
+        self.hits = 0
+        self.misses = 0
+        self._contexts = {}
+    
+    def get(self, timezone_name):
+        context = self._contexts.get(timezone_name)
+        if context is None:
+            self.misses += 1
+            context = self._contexts[timezone_name] = TimezoneContext(timezone_name, self.now_utc)
+        else:
+            self.hits += 1
+        return context
+    
+    def next_fire_at(self, timezone_name, dose_time, start_date):
+        """Return the next UTC datetime a dose is due after the cached now"""
+        return self.get(timezone_name).next_fire_at(dose_time, start_date)
+    
+    def stats(self):
+        return {'timezones': len(self._contexts), 'hits': self.hits, 'misses': self.misses}
@@ -1,6 +1,8 @@
 # apps/reminders/serializers.py
+from django.db import transaction
 from rest_framework import serializers
 from .models import Reminder, DoseSchedule
+from .scheduling import minute_of_day, next_dose_minute, time_from_minute
 from apps.inventory.models import Inventory
 
 
@@ -79,6 +81,7 @@ class ReminderSerializer(serializers.ModelSerializer):
         
         return attrs
     
+    @transaction.atomic
     def create(self, validated_data):
         dose_schedules_data = validated_data.pop('dose_schedules')
         phone_number = validated_data.pop('phone_number', None)
@@ -108,6 +111,7 @@ class ReminderSerializer(serializers.ModelSerializer):
         
         return reminder
     
+    @transaction.atomic
     def update(self, instance, validated_data):
         dose_schedules_data = validated_data.pop('dose_schedules', None)
         phone_number = validated_data.pop('phone_number', None)
@@ -166,13 +170,8 @@ class ReminderListSerializer(serializers.ModelSerializer):
         user_timezone = pytz.timezone(obj.user.timezone)
         
         # Convert current UTC time to user's timezone
-        now_user_tz = timezone.now().astimezone(user_timezone).time()
+        now_user_tz = timezone.now().astimezone(user_timezone)
         
-        # Find next dose after current time in user's timezone
-        next_dose = obj.dose_schedules.filter(time__gt=now_user_tz).order_by('time').first()
-        if next_dose:
-            return next_dose.time
-        
-        # If no dose found for today, return first dose of tomorrow
-        first_dose = obj.dose_schedules.order_by('time').first()
-        return first_dose.time if first_dose else None
\ No newline at end of file
+        # Find next dose after current time (wrapping to tomorrow's first dose)
+        next_minute = next_dose_minute(obj.dose_minutes, minute_of_day(now_user_tz))
+        return time_from_minute(next_minute) if next_minute is not None else None
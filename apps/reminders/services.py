@@ -0,0 +1,69 @@
+import logging
+from collections import defaultdict
+from django.db import connection, transaction
+from django.utils import timezone
+from apps.reminders.models import Reminder
+from apps.inventory.models import Inventory
+
+logger = logging.getLogger(__name__)
+
+
+class DoseDispenser:
+    """Service for deducting dispensed doses from reminder and inventory stock"""
+    
+    @staticmethod
+    def dispense(doses):
+        """
+        Deduct a batch of doses given as (reminder_id, amount) pairs.
+        
+        Runs one set-based UPDATE ... FROM (VALUES ...) per table, so the
+        decrement happens in the database (quantity = quantity - amount)
+        and concurrent workers cannot lose updates. Reminders that reach
+        zero are deactivated, matching Reminder.save().
+        
+        Returns a dict of reminder_id -> new quantity.
+        """
+        amounts = defaultdict(int)
+        for reminder_id, amount in doses:
+            amounts[reminder_id] += amount
+        
+        if not amounts:
+            return {}
+        
+        adapt = connection.ops.adapt_datetimefield_value
+        now = adapt(timezone.now())
+        
+        values = ', '.join(['(%s, %s)'] * len(amounts))
+        params = []
+        for reminder_id, amount in amounts.items():
+            params.extend([reminder_id, amount])
+        
+        reminder_sql = (
+            f'WITH dispensed (reminder_id, amount) AS (VALUES {values}) '
+            f'UPDATE {Reminder._meta.db_table} AS r '
+            f'SET quantity = r.quantity - dispensed.amount, '
+            f'is_active = CASE WHEN r.quantity - dispensed.amount <= 0 THEN false ELSE r.is_active END, '
+            f'updated_at = %s '
+            f'FROM dispensed WHERE r.id = dispensed.reminder_id '
+            f'RETURNING id, quantity'
+        )
+        inventory_sql = (
+            f'WITH dispensed (reminder_id, amount) AS (VALUES {values}) '
+            f'UPDATE {Inventory._meta.db_table} AS i '
+            f'SET current_quantity = i.current_quantity - dispensed.amount, '
+            f'updated_at = %s '
+            f'FROM dispensed WHERE i.reminder_id = dispensed.reminder_id'
+        )
+        
+        quantity_field = Reminder._meta.get_field('quantity')
+        
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(reminder_sql, [*params, now])
+            new_quantities = {
+                reminder_id: quantity_field.to_python(quantity)
+                for reminder_id, quantity in cursor.fetchall()
+            }
+            cursor.execute(inventory_sql, [*params, now])
+        
+        logger.info(f"Dispensed doses for {len(new_quantities)} reminders")
+        return new_quantities
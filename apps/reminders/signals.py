@@ -0,0 +1,133 @@
+# apps/reminders/signals.py
+"""
+Keep precomputed dose scheduling state in step with reminder changes.
+
+Saving a reminder with a new start date or active flag, adding, editing
+or deleting its dose schedules, or changing a user's timezone marks the
+affected reminders. Once the transaction commits, only those reminders
+are rescheduled, which recomputes next_fire_at and refreshes ETA or
+daemon state through Reminder.reschedule_doses; reminders whose dose
+schedules changed also get their dose_minutes recomputed. Changes that
+do not affect scheduling, such as dispensing or refill flags, are ignored.
+"""
+import logging
+import threading
+from collections import defaultdict
+from django.db import connection, transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from apps.users.models import CustomUser
+from apps.reminders.models import Reminder, DoseSchedule
+from apps.reminders.scheduling import dose_minutes_for
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class RescheduleBatch:
+    """
+    Reminder ids to reschedule once the current transaction commits.
+    
+    The pending batch is kept per thread and cleared when it runs. One left
+    behind by a rolled-back transaction is dropped by the next change made
+    outside a transaction, or else runs with the next transaction's changes,
+    which only recomputes what is already stored.
+    """
+    
+    def __init__(self):
+        self.reminder_ids = set()
+        self.user_ids = set()
+        # Reminders whose dose schedules changed, so their dose_minutes are stale
+        self.dose_minutes_ids = set()
+    
+    def __call__(self):
+        if getattr(_local, 'batch', None) is not self:
+            return
+        _local.batch = None
+        
+        self._refresh_dose_minutes()
+        
+        reminders = Reminder.objects.filter(id__in=self.reminder_ids) | Reminder.objects.filter(user_id__in=self.user_ids)
+        count = 0
+        for reminder in reminders.select_related('user'):
+            reminder.reschedule_doses()
+            count += 1
+        logger.debug(f"Rescheduled doses of {count} changed reminders")
+    
+    def _refresh_dose_minutes(self):
+        if not self.dose_minutes_ids:
+            return
+        
+        dose_times = defaultdict(list)
+        for reminder_id, dose_time in DoseSchedule.objects.filter(
+            reminder_id__in=self.dose_minutes_ids
+        ).values_list('reminder_id', 'time'):
+            dose_times[reminder_id].append(dose_time)
+        
+        # Reminders deleted along with their schedules are simply not updated
+        Reminder.objects.bulk_update([
+            Reminder(id=reminder_id, dose_minutes=dose_minutes_for(dose_times[reminder_id]))
+            for reminder_id in self.dose_minutes_ids
+        ], ['dose_minutes'])
+
+
+def _reschedule_on_commit(reminder_ids=(), user_ids=(), dose_minutes_ids=()):
+    """Add reminders to the batch rescheduled when the current transaction commits"""
+    batch = getattr(_local, 'batch', None)
+    # Outside a transaction, a pending batch can only be left by one that rolled back
+    if batch is None or not connection.in_atomic_block:
+        batch = _local.batch = RescheduleBatch()
+    
+    batch.reminder_ids.update(reminder_ids)
+    batch.user_ids.update(user_ids)
+    batch.dose_minutes_ids.update(dose_minutes_ids)
+    
+    # Registered for every change, since a rollback drops the callbacks registered
+    # before it; the batch runs on the first one and the rest find nothing to do.
+    # Runs right away outside a transaction.
+    transaction.on_commit(batch)
+
+
+def _scheduling_state(instance, fields):
+    # Read from __dict__ so deferred fields are not loaded just for this
+    return tuple(instance.__dict__.get(field) for field in fields)
+
+
+REMINDER_FIELDS = ('start_date', 'is_active')
+USER_FIELDS = ('timezone',)
+
+
+@receiver(post_init, sender=Reminder)
+def remember_reminder_state(sender, instance, **kwargs):
+    instance._scheduling_state = _scheduling_state(instance, REMINDER_FIELDS)
+
+
+@receiver(post_init, sender=CustomUser)
+def remember_user_state(sender, instance, **kwargs):
+    instance._scheduling_state = _scheduling_state(instance, USER_FIELDS)
+
+
+@receiver(post_save, sender=Reminder)
+def reminder_saved(sender, instance, created, **kwargs):
+    """Reschedule a reminder whose start date or active flag changed"""
+    state = _scheduling_state(instance, REMINDER_FIELDS)
+    if not created and state != instance._scheduling_state:
+        _reschedule_on_commit(reminder_ids=[instance.id])
+    instance._scheduling_state = state
+
+
+@receiver(post_save, sender=CustomUser)
+def user_saved(sender, instance, created, **kwargs):
+    """Reschedule every reminder of a user whose timezone changed"""
+    state = _scheduling_state(instance, USER_FIELDS)
+    if not created and state != instance._scheduling_state:
+        _reschedule_on_commit(user_ids=[instance.id])
+    instance._scheduling_state = state
+
+
+@receiver(post_save, sender=DoseSchedule)
+@receiver(post_delete, sender=DoseSchedule)
+def dose_schedule_changed(sender, instance, **kwargs):
+    """Reschedule the reminder of an added, edited or deleted dose schedule"""
+    _reschedule_on_commit(reminder_ids=[instance.reminder_id], dose_minutes_ids=[instance.reminder_id])
@@ -0,0 +1,261 @@
+"""
+Worker-resident snapshot of all dose schedules for the dose tick.
+
+Schedules are stored column-wise in typed stdlib arrays rather than as
+model instances, and indexed by (timezone, local minute of day). Finding
+the doses due in a window is then one bucket lookup per timezone and
+local minute, so the cost of a tick depends on the number of timezones
+and due doses, not on the size of the user base.
+
+Memory footprint per row:
+
+    schedule_id   8 bytes  (array 'q')
+    reminder_id   8 bytes  (array 'q')
+    timezone      2 bytes  (array 'H', index into the timezone name list)
+    minute        2 bytes  (array 'H', local minute of day)
+    amount        8 bytes  (array 'd')
+    quantity      8 bytes  (array 'd', 0 for inactive reminders)
+    start_date    4 bytes  (array 'i', proleptic ordinal)
+    bucket entry  4 bytes  (array 'I', row number in its bucket)
+
+That is 44 bytes per schedule, about 44 MB per million schedules, plus
+at most one small array per (timezone, minute) bucket (a few MB for
+every timezone in use). Arrays grow by over-allocation, so the resident
+size right after a rebuild can be up to ~12% higher.
+
+The snapshot keeps the timezone rather than a fixed UTC offset, so DST
+changes are handled when due doses are looked up instead of requiring a
+rebuild. Deleted schedules are not seen by the incremental refresh; they
+stay in the snapshot until the next full rebuild and are dropped when the
+tick checks candidates against the database before claiming them.
+"""
+import logging
+import time
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+import pytz
+from django.conf import settings
+from django.utils import timezone
+from apps.users.models import CustomUser
+from apps.reminders.models import Reminder, DoseSchedule
+from apps.reminders.scheduling import minute_of_day
+
+logger = logging.getLogger(__name__)
+
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+# Largest change of UTC offset at a DST transition in the tz database
+MAX_DST_SHIFT = timedelta(hours=2)
+
+SNAPSHOT_FIELDS = (
+    'id', 'reminder_id', 'reminder__user__timezone', 'time', 'amount',
+    'reminder__quantity', 'reminder__is_active', 'reminder__start_date',
+)
+
+
+class ScheduleSnapshot:
+    """Compact in-memory copy of every dose schedule, bucketed by local minute"""
+    
+    def __init__(self):
+        self._reset()
+    
+    def _reset(self):
+        self.schedule_ids = array('q')
+        self.reminder_ids = array('q')
+        self.timezone_indexes = array('H')
+        self.minutes = array('H')
+        self.amounts = array('d')
+        self.quantities = array('d')
+        self.start_dates = array('i')
+        
+        self.timezone_names = []
+        self._timezone_lookup = {}
+        self._buckets = {}
+        
+        self.refreshed_at = None
+        self.rebuilt_at = None
+    
+    def __len__(self):
+        return len(self.schedule_ids)
+    
+    def refresh(self, now=None):
+        """
+        Bring the snapshot up to date. Only schedules whose schedule,
+        reminder or user changed since the last refresh are reloaded;
+        a full rebuild happens on first use and every
+        DOSE_SNAPSHOT_FULL_REFRESH_SECONDS.
+        """
+        now = now or timezone.now()
+        full_refresh_after = timedelta(seconds=settings.DOSE_SNAPSHOT_FULL_REFRESH_SECONDS)
+        
+        if self.rebuilt_at is None or now - self.rebuilt_at >= full_refresh_after:
+            self.rebuild(now)
+            return
+        
+        started = time.monotonic()
+        # Overlap refreshes so rows committed late by slow transactions are not missed
+        since = self.refreshed_at - REFRESH_OVERLAP
+        
+        changed_reminders = Reminder.objects.filter(updated_at__gte=since).values('id')
+        changed_users = CustomUser.objects.filter(updated_at__gte=since).values('id')
+        
+        rows = {}
+        for queryset in (
+            DoseSchedule.objects.filter(updated_at__gte=since),
+            DoseSchedule.objects.filter(reminder__in=changed_reminders),
+            DoseSchedule.objects.filter(reminder__user__in=changed_users),
+        ):
+            for row in queryset.values_list(*SNAPSHOT_FIELDS):
+                rows[row[0]] = row
+        
+        for schedule_id in sorted(rows):
+            row = rows[schedule_id]
+            if not self._upsert(row):
+                # Ids are expected to grow; anything else needs a rebuild
+                self.rebuild(now)
+                return
+        
+        self.refreshed_at = now
+        logger.debug(
+            f"Schedule snapshot refreshed: {len(rows)} changed rows in "
+            f"{(time.monotonic() - started) * 1000:.1f} ms"
+        )
+    
+    def rebuild(self, now=None):
+        """Reload every dose schedule from the database"""
+        now = now or timezone.now()
+        started = time.monotonic()
+        
+        self._reset()
+        queryset = DoseSchedule.objects.order_by('id').values_list(*SNAPSHOT_FIELDS)
+        for row in queryset.iterator(chunk_size=5000):
+            self._append(row)
+        
+        self.refreshed_at = self.rebuilt_at = now
+        logger.info(
+            f"Schedule snapshot rebuilt: {len(self)} schedules in "
+            f"{(time.monotonic() - started) * 1000:.1f} ms"
+        )
+    
+    def due_doses(self, start, end):
+        """
+        Return (dose_schedule_id, scheduled_for) pairs for doses whose local
+        time falls in the half-open UTC window (start, end].
+        
+        The window is mapped onto each timezone's wall clock, so minutes
+        skipped by a DST change fire when the wall clock reaches them one
+        shift later and minutes repeated by a DST change fire only once,
+        on their second pass, as in the index path.
+        """
+        due = []
+        
+        for timezone_index, timezone_name in enumerate(self.timezone_names):
+            user_timezone = pytz.timezone(timezone_name)
+            wall_start = start.astimezone(user_timezone).replace(tzinfo=None, second=0, microsecond=0)
+            wall_end = end.astimezone(user_timezone).replace(tzinfo=None, second=0, microsecond=0)
+            # Clocks going back make the wall-clock window shorter than the real one, or reversed
+            wall_start = min(wall_start, (wall_end - (end - start)).replace(second=0, microsecond=0))
+            # Minutes skipped by clocks going forward fire up to one shift later on the wall clock
+            shift = (
+                end.astimezone(user_timezone).utcoffset()
+                - (start - MAX_DST_SHIFT).astimezone(user_timezone).utcoffset()
+            )
+            if shift > timedelta(0):
+                wall_start -= shift
+            
+            wall_minute = wall_start + timedelta(minutes=1)
+            while wall_minute <= wall_end:
+                rows = self._buckets.get((timezone_index, minute_of_day(wall_minute)))
+                scheduled_for = _local_to_utc(user_timezone, wall_minute, start, end) if rows else None
+                if scheduled_for is not None:
+                    local_date = wall_minute.toordinal()
+                    for row in rows:
+                        if self.quantities[row] <= 0 or self.start_dates[row] > local_date:
+                            continue
+                        due.append((self.schedule_ids[row], scheduled_for))
+                wall_minute += timedelta(minutes=1)
+        
+        return due
+    
+    def _timezone_index(self, timezone_name):
+        index = self._timezone_lookup.get(timezone_name)
+        if index is None:
+            index = self._timezone_lookup[timezone_name] = len(self.timezone_names)
+            self.timezone_names.append(timezone_name)
+        return index
+    
+    def _bucket(self, row):
+        return self._buckets.setdefault(
+            (self.timezone_indexes[row], self.minutes[row]), array('I')
+        )
+    
+    def _append(self, values):
+        schedule_id, reminder_id, timezone_name, dose_time, amount, quantity, is_active, start_date = values
+        
+        self.schedule_ids.append(schedule_id)
+        self.reminder_ids.append(reminder_id)
+        self.timezone_indexes.append(self._timezone_index(timezone_name))
+        self.minutes.append(minute_of_day(dose_time))
+        self.amounts.append(float(amount))
+        self.quantities.append(float(quantity) if is_active else 0.0)
+        self.start_dates.append(start_date.toordinal())
+        
+        row = len(self.schedule_ids) - 1
+        self._bucket(row).append(row)
+    
+    def _upsert(self, values):
+        """Update or append one row; returns False if a rebuild is needed"""
+        schedule_id = values[0]
+        row = bisect_left(self.schedule_ids, schedule_id)
+        
+        if row == len(self.schedule_ids):
+            self._append(values)
+            return True
+        if self.schedule_ids[row] != schedule_id:
+            return False
+        
+        _, reminder_id, timezone_name, dose_time, amount, quantity, is_active, start_date = values
+        
+        timezone_index = self._timezone_index(timezone_name)
+        dose_minute = minute_of_day(dose_time)
+        if (timezone_index, dose_minute) != (self.timezone_indexes[row], self.minutes[row]):
+            self._bucket(row).remove(row)
+            self.timezone_indexes[row] = timezone_index
+            self.minutes[row] = dose_minute
+            self._bucket(row).append(row)
+        
+        self.reminder_ids[row] = reminder_id
+        self.amounts[row] = float(amount)
+        self.quantities[row] = float(quantity) if is_active else 0.0
+        self.start_dates[row] = start_date.toordinal()
+        return True
+
+
+def _local_to_utc(user_timezone, wall_minute, start, end):
+    """
+    Convert a wall-clock minute to UTC, or return None if it does not fire
+    in the window (start, end]: a minute of the repeated hour of a DST
+    change fires on its second pass, in standard time, and a minute
+    skipped by one fires one shift later, like scheduling.next_fire_at.
+    """
+    try:
+        scheduled_for = user_timezone.localize(wall_minute, is_dst=None).astimezone(pytz.utc)
+    except pytz.NonExistentTimeError:
+        # Skipped by the clocks going forward: fires one shift later, like the index path
+        scheduled_for = user_timezone.normalize(user_timezone.localize(wall_minute)).astimezone(pytz.utc)
+    except pytz.AmbiguousTimeError:
+        scheduled_for = user_timezone.localize(wall_minute, is_dst=False).astimezone(pytz.utc)
+    return scheduled_for if start < scheduled_for <= end else None
+
+
+_snapshot = None
+
+
+def get_schedule_snapshot():
+    """Return this worker's schedule snapshot, refreshed up to now"""
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = ScheduleSnapshot()
+    _snapshot.refresh()
+    return _snapshot
@@ -1,175 +1,582 @@
 # apps/reminders/tasks.py
 import logging
-from celery import shared_task
+import time
+from collections import defaultdict
+from functools import partial
+from celery import shared_task, group
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
-from datetime import datetime, timedelta
-import pytz
-from apps.reminders.models import Reminder, DoseSchedule
+from django.utils.dateparse import parse_datetime
+from datetime import timedelta, timezone as dt_timezone
+from apps.reminders.models import Reminder, DoseSchedule, DoseOccurrence, SchedulerCheckpoint
+from apps.reminders.services import DoseDispenser
+from apps.reminders.scheduling import TimezoneContextCache
+from apps.reminders.snapshot import get_schedule_snapshot
 from apps.notifications.models import NotificationLog
-from apps.notifications.services import NotificationDispatcher
+from apps.notifications.services import NotificationOutbox
+from utils.redis_client import RedisLease, LeaseLost
 
 logger = logging.getLogger(__name__)
 
+DOSE_SCHEDULER_CHECKPOINT = 'send_dose_reminders'
+# Watermark of dry-run ticks, so replays never touch the live one
+DOSE_REPLAY_CHECKPOINT = 'send_dose_reminders_replay'
+
+# Old occurrences are deleted this many at a time
+OCCURRENCE_CLEANUP_CHUNK_SIZE = 5000
+
 
 @shared_task(name='apps.reminders.tasks.send_dose_reminders')
-def send_dose_reminders():
+def send_dose_reminders(now=None, dry_run=False):
     """
-    Celery task to send dose reminders at scheduled times.
+    Celery task that plans dose reminders at scheduled times.
     Runs every minute via Celery Beat.
+    
+    Only dose schedules whose next_fire_at has passed are loaded, so the
+    cost of a tick scales with the number of due doses rather than with
+    the number of reminders. They are streamed in DOSE_TICK_CHUNK_SIZE
+    chunks, keeping worker memory bounded at peak minutes; the result
+    reports the tick's peak RSS where the platform can measure it. Due
+    doses are claimed as DoseOccurrence rows and handed to
+    dispatch_dose_batch in fixed-size batches on the dose dispatch queue;
+    the planner itself never talks to a provider.
+    
+    Each run holds a Redis lease, so overlapping ticks and redundant beat
+    nodes exit immediately instead of planning the same minute twice.
+    
+    `now` (an ISO datetime, UTC if it has no offset) freezes the tick's
+    clock. With `dry_run` the tick only reports the doses it would claim:
+    it takes no lease, uses its own watermark and rolls back everything
+    it wrote.
+    """
+    now_utc = parse_datetime(now) if isinstance(now, str) else now or timezone.now()
+    if now_utc is None:
+        raise ValueError(f"Invalid datetime: {now}")
+    if timezone.is_naive(now_utc):
+        now_utc = timezone.make_aware(now_utc, dt_timezone.utc)
+    
+    if dry_run:
+        with transaction.atomic():
+            result = _plan_dose_reminders(now_utc, None, dry_run=True)
+            transaction.set_rollback(True)
+        return result
+    
+    if settings.DOSE_SCHEDULER_MODE == 'eta':
+        return "Skipped: doses are scheduled ahead of time in ETA mode"
+    if settings.DOSE_SCHEDULER_MODE == 'daemon':
+        return "Skipped: doses are fired by the run_dose_scheduler daemon"
+    
+    lease = RedisLease('send_dose_reminders', ttl=settings.DOSE_TICK_LEASE_SECONDS)
+    if not lease.acquire():
+        logger.warning("Another dose reminder tick holds the lease, skipping this run")
+        return "Skipped: another tick is running"
+    
+    logger.info(f"Starting dose reminder task (fencing token {lease.fencing_token})...")
+    started = time.monotonic()
+    
+    try:
+        return _plan_dose_reminders(now_utc, lease)
+        
+    except Exception as e:
+        logger.error(f"Error in send_dose_reminders task: {str(e)}", exc_info=True)
+        raise
+        
+    finally:
+        elapsed = time.monotonic() - started
+        if elapsed > settings.DOSE_TICK_INTERVAL_SECONDS:
+            logger.warning(
+                f"Dose reminder tick overran its {settings.DOSE_TICK_INTERVAL_SECONDS}s interval: "
+                f"took {elapsed:.1f}s, lag {elapsed - settings.DOSE_TICK_INTERVAL_SECONDS:.1f}s"
+            )
+        lease.release()
+
+
+def _plan_dose_reminders(now_utc, lease, dry_run=False):
+    """
+    Claim dose occurrences due in (watermark, now] and enqueue them for
+    dispatch. Doses older than DOSE_MAX_CATCH_UP_MINUTES are skipped.
+    
+    A dry run advances the replay watermark instead, enqueues nothing and
+    lists the doses it claimed; the caller is expected to roll it back.
+    """
+    measuring_rss = _reset_peak_rss()
+    
+    with transaction.atomic():
+        checkpoint = _lock_checkpoint(now_utc, DOSE_REPLAY_CHECKPOINT if dry_run else DOSE_SCHEDULER_CHECKPOINT)
+        
+        # Reject a stale tick if a newer lease holder already advanced the watermark
+        if lease is not None and lease.fencing_token < checkpoint.fencing_token:
+            if not lease.renew():
+                raise LeaseLost(f"Dose tick lease {lease.fencing_token} superseded by {checkpoint.fencing_token}")
+            # Still holding the live lease, so the Redis counter was reset
+            logger.warning(f"Lease fencing token went back from {checkpoint.fencing_token} to {lease.fencing_token}")
+        
+        horizon = now_utc - timedelta(minutes=settings.DOSE_MAX_CATCH_UP_MINUTES)
+        window_start = max(checkpoint.processed_until, horizon)
+        
+        if checkpoint.processed_until < horizon:
+            logger.warning(
+                f"Dose scheduler fell behind: skipping doses due between "
+                f"{checkpoint.processed_until} and {horizon}"
+            )
+        elif now_utc - checkpoint.processed_until > timedelta(seconds=2 * settings.DOSE_TICK_INTERVAL_SECONDS):
+            logger.info(f"Catching up on doses due since {checkpoint.processed_until}")
+        
+        occurrence_count = 0
+        chunk_count = 0
+        would_fire = []
+        
+        # Candidates are streamed in fixed-size chunks so memory stays bounded
+        for due_schedules, doses_to_claim in _due_dose_chunks(window_start, now_utc):
+            # Claim occurrences in one statement; rows claimed by another tick are skipped
+            occurrence_ids = [
+                occurrence_id
+                for occurrence_id, _ in DoseOccurrence.objects.claim(doses_to_claim)
+            ]
+            
+            # Move every processed schedule to its next occurrence
+            _advance_dose_schedules(due_schedules, now_utc)
+            
+            if dry_run:
+                would_fire.extend(doses_to_claim)
+            else:
+                transaction.on_commit(partial(_enqueue_dose_batches, occurrence_ids))
+            occurrence_count += len(occurrence_ids)
+            chunk_count += 1
+        
+        checkpoint.processed_until = now_utc
+        if lease is not None:
+            checkpoint.fencing_token = lease.fencing_token
+        checkpoint.save()
+        
+        # A tick that outlived its lease must not commit over a newer one
+        if lease is not None and not lease.renew():
+            raise LeaseLost(f"Dose tick lease {lease.fencing_token} expired before commit")
+    
+    result = {
+        'queued': occurrence_count,
+        'chunks': chunk_count,
+        'peak_rss_kb': _peak_rss_kb() if measuring_rss else None,
+    }
+    
+    if dry_run:
+        # Unlike `queued`, includes doses whose occurrence already exists
+        result['doses'] = [
+            (dose_schedule_id, scheduled_for.isoformat())
+            for dose_schedule_id, scheduled_for in would_fire
+        ]
+        return result
+    
+    logger.info(f"Dose reminder task completed. {occurrence_count} doses queued for dispatch.")
+    return result
+
+
+def _due_dose_chunks(window_start, now_utc):
+    """
+    Yield (due_schedules, doses_to_claim) for the doses due by now_utc,
+    DOSE_TICK_CHUNK_SIZE schedules at a time.
+    
+    Index mode pages through due schedules by keyset on (next_fire_at, id),
+    loading each chunk's reminders and users in the same query. Schedules
+    are only returned for advancing in index mode.
+    """
+    chunk_size = settings.DOSE_TICK_CHUNK_SIZE
+    
+    if settings.DOSE_SCHEDULER_MODE == 'snapshot':
+        # Due detection runs against the worker-resident schedule snapshot
+        due_doses = get_schedule_snapshot().due_doses(window_start, now_utc)
+        for i in range(0, len(due_doses), chunk_size):
+            yield [], _filter_claimable(due_doses[i:i + chunk_size])
+        return
+    
+    due = DoseSchedule.objects.filter(
+        next_fire_at__lte=now_utc
+    ).select_related('reminder__user').order_by('next_fire_at', 'id')
+    
+    due_schedules = list(due[:chunk_size])
+    while due_schedules:
+        doses_to_claim = []
+        
+        for dose_schedule in due_schedules:
+            reminder = dose_schedule.reminder
+            
+            if not reminder.is_active or reminder.quantity <= 0:
+                continue
+            
+            # Doses before the window were missed beyond the catch-up horizon
+            if dose_schedule.next_fire_at <= window_start:
+                logger.info(
+                    f"Skipping missed dose of {reminder.medicine_name} for {reminder.user.email} "
+                    f"due at {dose_schedule.next_fire_at}"
+                )
+                continue
+            
+            doses_to_claim.append((dose_schedule.id, dose_schedule.next_fire_at))
+        
+        # Key for the next chunk is read before the caller advances these schedules
+        last = due_schedules[-1]
+        last_fire_at, last_id = last.next_fire_at, last.id
+        
+        yield due_schedules, doses_to_claim
+        
+        due_schedules = list(due.filter(
+            Q(next_fire_at__gt=last_fire_at) | Q(next_fire_at=last_fire_at, id__gt=last_id)
+        )[:chunk_size])
+
+
+def _reset_peak_rss():
+    """
+    Reset this process's peak RSS so _peak_rss_kb() measures from now on.
+    Only Linux allows this; returns False where it is not possible.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_kb():
+    """Return the peak resident set size in KB since _reset_peak_rss()"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _lock_checkpoint(now_utc, name=DOSE_SCHEDULER_CHECKPOINT):
+    """Return a dose scheduler watermark, locked for the current transaction"""
+    checkpoint, _ = SchedulerCheckpoint.objects.select_for_update().get_or_create(
+        name=name,
+        defaults={'processed_until': now_utc - timedelta(seconds=settings.DOSE_TICK_INTERVAL_SECONDS)}
+    )
+    return checkpoint
+
+
+def _filter_claimable(due_doses):
+    """Drop candidates whose schedule was deleted or whose reminder is inactive"""
+    claimable_ids = set(
+        DoseSchedule.objects.filter(
+            id__in=[dose_schedule_id for dose_schedule_id, _ in due_doses],
+            reminder__is_active=True,
+            reminder__quantity__gt=0
+        ).values_list('id', flat=True)
+    )
+    return [dose for dose in due_doses if dose[0] in claimable_ids]
+
+
+def _advance_dose_schedules(dose_schedules, now_utc):
+    """Point dose schedules at their next occurrence after now_utc"""
+    tz_cache = TimezoneContextCache(now_utc)
+    for dose_schedule in dose_schedules:
+        dose_schedule.next_fire_at = dose_schedule.compute_next_fire_at(tz_cache=tz_cache)
+    DoseSchedule.objects.bulk_update(dose_schedules, ['next_fire_at'])
+    logger.debug(f"Timezone cache: {tz_cache.stats()}")
+
+
+def _enqueue_dose_batches(occurrence_ids, eta=None):
+    """
+    Fan claimed occurrences out to the dispatch queue in fixed-size batches,
+    optionally held back by the broker until `eta`.
+    """
+    if not occurrence_ids:
+        return
+    
+    batch_size = settings.DOSE_DISPATCH_BATCH_SIZE
+    batches = [
+        occurrence_ids[i:i + batch_size]
+        for i in range(0, len(occurrence_ids), batch_size)
+    ]
+    
+    group(
+        dispatch_dose_batch.s(batch).set(queue=settings.DOSE_DISPATCH_QUEUE, eta=eta)
+        for batch in batches
+    ).apply_async()
+    
+    logger.info(f"Enqueued {len(batches)} dose batches for {len(occurrence_ids)} occurrences")
+
+
+@shared_task(name='apps.reminders.tasks.requeue_stranded_occurrences')
+def requeue_stranded_occurrences():
     """
-    logger.info("Starting dose reminder task...")
+    Celery task that enqueues claimed dose occurrences that were never
+    dispatched, because the publish after the claim failed or the worker
+    died in between. Runs every DOSE_DISPATCH_SWEEP_MINUTES via Celery Beat.
     
+    Only doses within the catch-up horizon are enqueued again; a batch
+    that was merely slow skips occurrences dispatched in the meantime.
+    """
     try:
-        # Get current UTC time
         now_utc = timezone.now()
-        current_time_utc = now_utc.time()
+        grace = now_utc - timedelta(seconds=settings.DOSE_DISPATCH_SWEEP_GRACE_SECONDS)
         
-        # Get all active reminders
-        active_reminders = Reminder.objects.filter(
-            is_active=True,
-            quantity__gt=0,
-            start_date__lte=now_utc.date()
-        ).select_related('user').prefetch_related('dose_schedules')
+        occurrence_ids = list(
+            DoseOccurrence.objects.filter(
+                dispatched_at__isnull=True,
+                scheduled_for__gt=now_utc - timedelta(minutes=settings.DOSE_MAX_CATCH_UP_MINUTES),
+                scheduled_for__lt=grace,
+                created_at__lt=grace
+            ).order_by('scheduled_for').values_list('id', flat=True)
+        )
         
-        notifications_sent = 0
+        if occurrence_ids:
+            logger.warning(f"Requeueing {len(occurrence_ids)} claimed doses that were never dispatched")
+            _enqueue_dose_batches(occurrence_ids)
+        return f"Requeued {len(occurrence_ids)} doses"
         
-        for reminder in active_reminders:
-            user = reminder.user
-            user_timezone = pytz.timezone(user.timezone)
-            
-            # Convert current UTC time to user's timezone
-            now_user_tz = now_utc.astimezone(user_timezone)
-            current_time_user = now_user_tz.time()
-            
-            # Get all dose schedules for this reminder
-            for dose_schedule in reminder.dose_schedules.all():
-                # Check if current time matches dose schedule time (within 1 minute tolerance)
-                dose_time = dose_schedule.time
-                
-                # Create datetime objects for comparison
-                dose_datetime = datetime.combine(now_user_tz.date(), dose_time)
-                dose_datetime = user_timezone.localize(dose_datetime)
-                
-                # Check if we're within 1 minute of the scheduled time
-                time_diff = abs((now_user_tz - dose_datetime).total_seconds())
-                
-                if time_diff <= 60:  # Within 1 minute
-                    # Check if notification already sent in the last 2 minutes
-                    two_minutes_ago = now_utc - timedelta(minutes=2)
-                    recent_notification = NotificationLog.objects.filter(
-                        user=user,
-                        reminder=reminder,
-                        notification_type='dose_reminder',
-                        created_at__gte=two_minutes_ago
-                    ).exists()
-                    
-                    if recent_notification:
-                        logger.info(f"Notification already sent recently for {reminder.medicine_name} - {user.email}")
-                        continue
-                    
-                    # Send notifications via specified methods
-                    notification_methods = reminder.notification_methods
-                    results = NotificationDispatcher.send_dose_reminder(
-                        user, reminder, dose_schedule, notification_methods
-                    )
-                    
-                    # Log notification results
-                    for method, success in results.items():
-                        NotificationLog.objects.create(
-                            user=user,
-                            reminder=reminder,
-                            notification_type='dose_reminder',
-                            method=method,
-                            status='sent' if success else 'failed',
-                            sent_at=timezone.now() if success else None,
-                            error_message=None if success else 'Failed to send notification'
-                        )
-                        
-                        if success:
-                            notifications_sent += 1
-                    
-                    # Deduct dose amount from quantity (auto inventory management)
-                    old_quantity = reminder.quantity
-                    reminder.quantity -= dose_schedule.amount
-                    reminder.save()
-                    
-                    # Update linked inventory
-                    if hasattr(reminder, 'inventory_items') and reminder.inventory_items.exists():
-                        inventory = reminder.inventory_items.first()
-                        inventory.current_quantity = reminder.quantity
-                        inventory.save()
-                    
-                    logger.info(
-                        f"Dose reminder sent for {reminder.medicine_name} to {user.email}. "
-                        f"Quantity: {old_quantity} -> {reminder.quantity}"
-                    )
-                    
-                    # Check if refill reminder should be sent
-                    if reminder.refill_reminder and not reminder.refill_reminder_sent:
-                        if reminder.refill_threshold and reminder.quantity <= reminder.refill_threshold:
-                            send_refill_reminder_task.delay(reminder.id)
-        
-        logger.info(f"Dose reminder task completed. {notifications_sent} notifications sent.")
-        return f"Sent {notifications_sent} notifications"
+    except Exception as e:
+        logger.error(f"Error in requeue_stranded_occurrences task: {str(e)}", exc_info=True)
+        raise
+
+
+@shared_task(name='apps.reminders.tasks.materialize_dose_occurrences')
+def materialize_dose_occurrences():
+    """
+    Celery task that schedules doses ahead of time in ETA mode.
+    Runs every DOSE_ETA_MATERIALIZE_MINUTES via Celery Beat.
+    
+    Occurrences due within the next DOSE_ETA_HORIZON_HOURS are claimed and
+    enqueued with an eta, so the broker releases each batch at its dose
+    time and the database is not polled every minute.
+    """
+    if settings.DOSE_SCHEDULER_MODE != 'eta':
+        return "Skipped: ETA scheduling is disabled"
+    
+    try:
+        count = _materialize_occurrences(DoseSchedule.objects.all(), timezone.now())
+        
+        logger.info(f"Materialized {count} dose occurrences")
+        return f"Scheduled {count} doses"
         
     except Exception as e:
-        logger.error(f"Error in send_dose_reminders task: {str(e)}", exc_info=True)
+        logger.error(f"Error in materialize_dose_occurrences task: {str(e)}", exc_info=True)
         raise
 
 
-@shared_task(name='apps.reminders.tasks.send_refill_reminder_task')
-def send_refill_reminder_task(reminder_id):
+@shared_task(name='apps.reminders.tasks.rebuild_reminder_occurrences')
+def rebuild_reminder_occurrences(reminder_id):
     """
-    Celery task to send refill reminder for a specific reminder.
+    Celery task to replace a reminder's scheduled occurrences after it changed.
+    Only this reminder's not-yet-dispatched future occurrences are rebuilt.
     """
+    if settings.DOSE_SCHEDULER_MODE != 'eta':
+        return "Skipped: ETA scheduling is disabled"
+    
     try:
-        reminder = Reminder.objects.get(id=reminder_id)
+        now_utc = timezone.now()
         
-        # Check if refill reminder already sent
-        if reminder.refill_reminder_sent:
-            logger.info(f"Refill reminder already sent for {reminder.medicine_name}")
-            return "Refill reminder already sent"
+        with transaction.atomic():
+            dose_schedules = list(
+                DoseSchedule.objects.filter(reminder_id=reminder_id)
+                .select_for_update(of=('self',)).select_related('reminder__user')
+            )
+            
+            # Already enqueued tasks for deleted occurrences find nothing to send
+            deleted_count = DoseOccurrence.objects.filter(
+                dose_schedule__reminder_id=reminder_id,
+                dispatched_at__isnull=True,
+                scheduled_for__gt=now_utc
+            ).delete()[0]
+            
+            _advance_dose_schedules(dose_schedules, now_utc)
+            count = _materialize_occurrences(DoseSchedule.objects.filter(reminder_id=reminder_id), now_utc)
         
-        user = reminder.user
-        notification_methods = reminder.notification_methods
+        logger.info(f"Rebuilt occurrences of reminder {reminder_id}: {deleted_count} removed, {count} scheduled")
+        return f"Scheduled {count} doses"
         
-        # Send refill notifications
-        results = NotificationDispatcher.send_refill_reminder(
-            user, reminder, notification_methods
+    except Exception as e:
+        logger.error(f"Error in rebuild_reminder_occurrences task: {str(e)}", exc_info=True)
+        raise
+
+
+def _materialize_occurrences(dose_schedules, now_utc):
+    """
+    Claim every occurrence of the given schedules due up to the ETA horizon,
+    advance their next_fire_at past it and enqueue the claimed occurrences
+    with an eta. Returns the number of occurrences claimed.
+    """
+    until = now_utc + timedelta(hours=settings.DOSE_ETA_HORIZON_HOURS)
+    horizon = now_utc - timedelta(minutes=settings.DOSE_MAX_CATCH_UP_MINUTES)
+    
+    with transaction.atomic():
+        due_schedules = list(
+            dose_schedules.filter(next_fire_at__lte=until)
+            .select_for_update(of=('self',)).select_related('reminder__user')
         )
         
-        # Log notification results
-        for method, success in results.items():
-            NotificationLog.objects.create(
-                user=user,
-                reminder=reminder,
-                notification_type='refill_reminder',
-                method=method,
-                status='sent' if success else 'failed',
-                sent_at=timezone.now() if success else None,
-                error_message=None if success else 'Failed to send notification'
-            )
+        doses_to_claim = []
+        
+        for dose_schedule in due_schedules:
+            reminder = dose_schedule.reminder
+            is_active = reminder.is_active and reminder.quantity > 0
+            
+            while dose_schedule.next_fire_at is not None and dose_schedule.next_fire_at <= until:
+                # Inactive reminders and long-missed doses only move their pointer
+                if is_active and dose_schedule.next_fire_at > horizon:
+                    doses_to_claim.append((dose_schedule.id, dose_schedule.next_fire_at))
+                dose_schedule.next_fire_at = dose_schedule.compute_next_fire_at(dose_schedule.next_fire_at)
+        
+        DoseSchedule.objects.bulk_update(due_schedules, ['next_fire_at'])
+        
+        occurrence_ids = [
+            occurrence_id
+            for occurrence_id, _ in DoseOccurrence.objects.claim(doses_to_claim)
+        ]
         
-        # Mark refill reminder as sent
-        reminder.refill_reminder_sent = True
-        reminder.save()
+        occurrences_by_eta = defaultdict(list)
+        for occurrence_id, scheduled_for in DoseOccurrence.objects.filter(
+            id__in=occurrence_ids
+        ).values_list('id', 'scheduled_for'):
+            occurrences_by_eta[scheduled_for].append(occurrence_id)
         
-        logger.info(f"Refill reminder sent for {reminder.medicine_name} to {user.email}")
-        return "Refill reminder sent successfully"
+        def enqueue():
+            for eta, ids in occurrences_by_eta.items():
+                _enqueue_dose_batches(ids, eta=eta)
+        
+        transaction.on_commit(enqueue)
+    
+    return len(occurrence_ids)
+
+
+@shared_task(name='apps.reminders.tasks.dispatch_dose_batch')
+def dispatch_dose_batch(occurrence_ids):
+    """
+    Celery task to queue notifications for a batch of claimed dose occurrences.
+    Runs on the dose dispatch queue so worker concurrency sets throughput.
+    """
+    try:
+        notifications_queued = dispatch_occurrences(occurrence_ids)
+        
+        logger.info(f"Dose batch completed. {notifications_queued} notifications queued.")
+        return f"Queued {notifications_queued} notifications"
         
-    except Reminder.DoesNotExist:
-        logger.error(f"Reminder with id {reminder_id} does not exist")
-        return "Reminder not found"
     except Exception as e:
-        logger.error(f"Error in send_refill_reminder_task: {str(e)}", exc_info=True)
+        logger.error(f"Error in dispatch_dose_batch task: {str(e)}", exc_info=True)
+        raise
+
+
+def dispatch_occurrences(occurrence_ids):
+    """
+    Queue the notifications of claimed dose occurrences in the outbox and
+    dispense the doses, all in one transaction; sender workers deliver
+    them once it commits. Occurrences already dispatched elsewhere are
+    skipped. Returns the number of notifications queued.
+    """
+    with transaction.atomic():
+        # Only dispatch occurrences no other worker has picked up yet
+        occurrence_ids = DoseOccurrence.objects.mark_dispatched(occurrence_ids)
+        
+        occurrences = DoseOccurrence.objects.filter(
+            id__in=occurrence_ids
+        ).select_related('dose_schedule__reminder__user').order_by('scheduled_for')
+        
+        reminders = {}
+        dispensed_doses = []
+        notification_logs = []
+        
+        for occurrence in occurrences:
+            dose_schedule = occurrence.dose_schedule
+            # Share one Reminder instance between doses of the same reminder
+            reminder = reminders.setdefault(dose_schedule.reminder_id, dose_schedule.reminder)
+            dose_schedule.reminder = reminder
+            user = reminder.user
+            
+            # Reminder may have been deactivated after the dose was planned
+            if not reminder.is_active or reminder.quantity <= 0:
+                logger.info(f"Skipping dose of inactive reminder {reminder.medicine_name} - {user.email}")
+                continue
+            
+            notification_logs.extend(NotificationOutbox.build_logs(
+                user, reminder, 'dose_reminder', reminder.notification_methods, occurrence=occurrence
+            ))
+            
+            dispensed_doses.append((reminder.id, dose_schedule.amount))
+            logger.info(f"Dose reminder queued for {reminder.medicine_name} to {user.email}")
+        
+        NotificationOutbox.enqueue(notification_logs)
+        
+        # Deduct all dispensed doses from quantity and linked inventory at once
+        new_quantities = DoseDispenser.dispense(dispensed_doses)
+        
+        refill_reminder_ids = []
+        for reminder_id, quantity in new_quantities.items():
+            reminder = reminders[reminder_id]
+            logger.info(f"Quantity of {reminder.medicine_name}: {reminder.quantity} -> {quantity}")
+            reminder.quantity = quantity
+            
+            # Check if refill reminder should be sent
+            if reminder.refill_reminder and not reminder.refill_reminder_sent:
+                if reminder.refill_threshold and reminder.quantity <= reminder.refill_threshold:
+                    refill_reminder_ids.append(reminder.id)
+        
+        if refill_reminder_ids:
+            transaction.on_commit(partial(send_refill_reminders_task.delay, refill_reminder_ids))
+    
+    return len(notification_logs)
+
+
+@shared_task(name='apps.reminders.tasks.send_refill_reminder_task')
+def send_refill_reminder_task(reminder_id):
+    """
+    Celery task to send refill reminder for a specific reminder.
+    """
+    return send_refill_reminders_task(reminder_ids=[reminder_id])
+
+
+@shared_task(name='apps.reminders.tasks.send_refill_reminders_task')
+def send_refill_reminders_task(reminder_ids):
+    """
+    Celery task to queue refill reminders for the reminders of a dose batch.
+    The reminders are flagged and their notifications queued in the outbox
+    in one transaction, so concurrent tasks never queue one twice.
+    """
+    try:
+        with transaction.atomic():
+            reminders = list(
+                Reminder.objects.select_for_update(skip_locked=True, of=('self',))
+                .filter(id__in=reminder_ids, refill_reminder_sent=False)
+                .select_related('user')
+            )
+            
+            if not reminders:
+                logger.info(f"Refill reminders already sent for reminders {reminder_ids}")
+                return "Refill reminder already sent"
+            
+            Reminder.objects.filter(
+                id__in=[reminder.id for reminder in reminders]
+            ).update(refill_reminder_sent=True, updated_at=timezone.now())
+            
+            notification_logs = []
+            for reminder in reminders:
+                notification_logs.extend(NotificationOutbox.build_logs(
+                    reminder.user, reminder, 'refill_reminder', reminder.notification_methods
+                ))
+                logger.info(f"Refill reminder queued for {reminder.medicine_name} to {reminder.user.email}")
+            
+            NotificationOutbox.enqueue(notification_logs)
+        
+        return f"Refill reminders queued for {len(reminders)} reminders"
+        
+    except Exception as e:
+        logger.error(f"Error in send_refill_reminders_task: {str(e)}", exc_info=True)
         raise
 
 
 @shared_task(name='apps.reminders.tasks.cleanup_old_notifications')
 def cleanup_old_notifications():
     """
-    Celery task to cleanup old notification logs (older than 90 days).
-    Can be scheduled to run daily.
+    Celery task to cleanup old notification logs and dose occurrences
+    (older than 90 days). Runs daily via Celery Beat.
+    
+    Occurrences that old are far behind the catch-up horizon, so no tick
+    can claim them again once their rows are gone.
     """
     try:
         ninety_days_ago = timezone.now() - timedelta(days=90)
@@ -177,8 +584,19 @@ def cleanup_old_notifications():
             created_at__lt=ninety_days_ago
         ).delete()[0]
         
-        logger.info(f"Cleaned up {deleted_count} old notification logs")
-        return f"Deleted {deleted_count} old notifications"
+        # In chunks, so one run never holds a huge delete open
+        occurrence_count = 0
+        while True:
+            occurrence_ids = list(
+                DoseOccurrence.objects.filter(scheduled_for__lt=ninety_days_ago)
+                .values_list('id', flat=True)[:OCCURRENCE_CLEANUP_CHUNK_SIZE]
+            )
+            if not occurrence_ids:
+                break
+            occurrence_count += DoseOccurrence.objects.filter(id__in=occurrence_ids).delete()[0]
+        
+        logger.info(f"Cleaned up {deleted_count} old notification logs and {occurrence_count} dose occurrences")
+        return f"Deleted {deleted_count} old notifications and {occurrence_count} dose occurrences"
         
     except Exception as e:
         logger.error(f"Error in cleanup_old_notifications task: {str(e)}", exc_info=True)
@@ -1,3 +1,818 @@
-from django.test import TestCase
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import fakeredis
+import pytz
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from apps.inventory.models import Inventory
+from apps.notifications.models import NotificationLog
+from apps.notifications.services import NotificationOutbox
+from apps.users.models import CustomUser
+from medicine_reminder.celery import QUEUES, WORKER_POOLS, app as celery_app, record_queue_wait
+from utils import queue_metrics
+from utils.redis_client import LeaseLost
+
+from .daemon import DoseSchedulerDaemon
+from .models import DoseOccurrence, DoseSchedule, Reminder, SchedulerCheckpoint
+from .scheduling import TimezoneContext, TimezoneContextCache, next_fire_at
+from .services import DoseDispenser
+from .snapshot import ScheduleSnapshot
+from .tasks import (
+    DOSE_SCHEDULER_CHECKPOINT,
+    _plan_dose_reminders,
+    cleanup_old_notifications,
+    materialize_dose_occurrences,
+    rebuild_reminder_occurrences,
+    send_dose_reminders,
+)
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=pytz.utc)
+
+
+class ReminderTestMixin:
+    
+    def create_reminder(self, quantity=10, user=None, **kwargs):
+        user = user or self.user
+        fields = {
+            'medicine_name': 'Aspirin',
+            'medicine_type': 'tablet',
+            'dose_count_daily': 1,
+            'notification_methods': ['email'],
+            'start_date': date(2026, 1, 1),
+            **kwargs
+        }
+        reminder = Reminder.objects.create(user=user, quantity=quantity, **fields)
+        Inventory.objects.create(
+            user=user,
+            reminder=reminder,
+            medicine_name='Aspirin',
+            medicine_type='tablet',
+            current_quantity=quantity
+        )
+        return reminder
+    
+    def create_dose_schedule(self, reminder, fire_at, dose_number=1):
+        dose_schedule = DoseSchedule.objects.create(
+            reminder=reminder,
+            dose_number=dose_number,
+            amount=1,
+            time=fire_at.astimezone(pytz.timezone(reminder.user.timezone)).time()
+        )
+        # Pin the occurrence under test regardless of the real clock
+        DoseSchedule.objects.filter(pk=dose_schedule.pk).update(next_fire_at=fire_at)
+        dose_schedule.next_fire_at = fire_at
+        return dose_schedule
+
+
+class DoseOccurrenceClaimTests(ReminderTestMixin, TestCase):
+    """Occurrences are claimed and dispatched exactly once"""
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('claim@example.com', 'password123', timezone='UTC')
+        reminder = self.create_reminder()
+        self.first = self.create_dose_schedule(reminder, utc(2026, 5, 4, 9, 0), dose_number=1)
+        self.second = self.create_dose_schedule(reminder, utc(2026, 5, 4, 21, 0), dose_number=2)
+    
+    def test_claim_is_idempotent(self):
+        due = [(self.first.id, utc(2026, 5, 4, 9, 0)), (self.second.id, utc(2026, 5, 4, 21, 0))]
+        
+        claimed = DoseOccurrence.objects.claim(due)
+        self.assertEqual(sorted(schedule_id for _, schedule_id in claimed), [self.first.id, self.second.id])
+        self.assertEqual(DoseOccurrence.objects.claim(due), [])
+        self.assertEqual(DoseOccurrence.objects.count(), 2)
+    
+    def test_claim_returns_only_new_occurrences(self):
+        DoseOccurrence.objects.claim([(self.first.id, utc(2026, 5, 4, 9, 0))])
+        
+        claimed = DoseOccurrence.objects.claim([
+            (self.first.id, utc(2026, 5, 4, 9, 0)),
+            (self.first.id, utc(2026, 5, 5, 9, 0)),
+        ])
+        
+        self.assertEqual(len(claimed), 1)
+        occurrence = DoseOccurrence.objects.get(pk=claimed[0][0])
+        self.assertEqual(occurrence.scheduled_for, utc(2026, 5, 5, 9, 0))
+    
+    def test_claim_nothing(self):
+        self.assertEqual(DoseOccurrence.objects.claim([]), [])
+    
+    def test_mark_dispatched_once(self):
+        occurrence_ids = [
+            occurrence_id for occurrence_id, _ in
+            DoseOccurrence.objects.claim([(self.first.id, utc(2026, 5, 4, 9, 0))])
+        ]
+        
+        self.assertEqual(DoseOccurrence.objects.mark_dispatched(occurrence_ids), occurrence_ids)
+        self.assertEqual(DoseOccurrence.objects.mark_dispatched(occurrence_ids), [])
+        self.assertIsNotNone(DoseOccurrence.objects.get(pk=occurrence_ids[0]).dispatched_at)
+    
+    def test_cleanup_prunes_old_occurrences(self):
+        now = timezone.now()
+        DoseOccurrence.objects.claim([
+            (self.first.id, now - timedelta(days=91)),
+            (self.first.id, now - timedelta(days=89)),
+        ])
+        
+        cleanup_old_notifications()
+        
+        self.assertEqual(
+            list(DoseOccurrence.objects.values_list('scheduled_for', flat=True)),
+            [now - timedelta(days=89)]
+        )
+
+
+class DoseDispenserTests(ReminderTestMixin, TestCase):
+    """Batch decrement of reminder and inventory stock"""
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('dispense@example.com', 'password123', timezone='UTC')
+    
+    def test_dispense_decrements_reminder_and_inventory(self):
+        reminder = self.create_reminder(quantity=10)
+        
+        new_quantities = DoseDispenser.dispense([(reminder.id, Decimal('1.5'))])
+        
+        self.assertEqual(new_quantities, {reminder.id: Decimal('8.5')})
+        reminder.refresh_from_db()
+        self.assertEqual(reminder.quantity, Decimal('8.5'))
+        self.assertTrue(reminder.is_active)
+        self.assertEqual(Inventory.objects.get(reminder=reminder).current_quantity, Decimal('8.5'))
+    
+    def test_dispense_sums_doses_per_reminder(self):
+        first = self.create_reminder(quantity=10)
+        second = self.create_reminder(quantity=5)
+        
+        new_quantities = DoseDispenser.dispense([(first.id, 1), (second.id, 2), (first.id, 3)])
+        
+        self.assertEqual(new_quantities, {first.id: Decimal('6'), second.id: Decimal('3')})
+    
+    def test_dispense_deactivates_empty_reminder(self):
+        reminder = self.create_reminder(quantity=2)
+        
+        DoseDispenser.dispense([(reminder.id, 2)])
+        
+        reminder.refresh_from_db()
+        self.assertEqual(reminder.quantity, 0)
+        self.assertFalse(reminder.is_active)
+    
+    def test_dispense_nothing(self):
+        self.assertEqual(DoseDispenser.dispense([]), {})
+
+
+class NextFireAtTests(SimpleTestCase):
+    """next_fire_at and TimezoneContext across DST transitions"""
+    
+    TIMEZONE = 'America/New_York'
+    
+    def test_regular_day(self):
+        self.assertEqual(
+            next_fire_at(self.TIMEZONE, time(8, 0), date(2026, 1, 1), utc(2026, 1, 10, 12, 0)),
+            utc(2026, 1, 10, 13, 0)
+        )
+    
+    def test_time_already_passed_moves_to_next_day(self):
+        self.assertEqual(
+            next_fire_at(self.TIMEZONE, time(8, 0), date(2026, 1, 1), utc(2026, 1, 10, 13, 0)),
+            utc(2026, 1, 11, 13, 0)
+        )
+    
+    def test_never_before_start_date(self):
+        self.assertEqual(
+            next_fire_at(self.TIMEZONE, time(8, 0), date(2026, 1, 20), utc(2026, 1, 10, 12, 0)),
+            utc(2026, 1, 20, 13, 0)
+        )
+    
+    def test_spring_forward_gap_moves_forward(self):
+        # 02:30 does not exist on 2026-03-08; it fires at 03:30 EDT
+        self.assertEqual(
+            next_fire_at(self.TIMEZONE, time(2, 30), date(2026, 1, 1), utc(2026, 3, 8, 5, 0)),
+            utc(2026, 3, 8, 7, 30)
+        )
+    
+    def test_fall_back_fires_once_on_second_pass(self):
+        # 01:30 happens twice on 2026-11-01; it fires at 01:30 EST only
+        after = utc(2026, 11, 1, 4, 0)
+        fire_at = next_fire_at(self.TIMEZONE, time(1, 30), date(2026, 1, 1), after)
+        self.assertEqual(fire_at, utc(2026, 11, 1, 6, 30))
+        self.assertEqual(
+            next_fire_at(self.TIMEZONE, time(1, 30), date(2026, 1, 1), fire_at),
+            utc(2026, 11, 2, 6, 30)
+        )
+    
+    def test_context_detects_transition(self):
+        self.assertTrue(TimezoneContext(self.TIMEZONE, utc(2026, 3, 8, 5, 0)).has_transition)
+        self.assertTrue(TimezoneContext(self.TIMEZONE, utc(2026, 11, 1, 4, 0)).has_transition)
+        self.assertFalse(TimezoneContext(self.TIMEZONE, utc(2026, 1, 10, 12, 0)).has_transition)
+    
+    def test_context_matches_next_fire_at(self):
+        instants = [
+            utc(2026, 1, 10, 12, 0),
+            utc(2026, 3, 7, 6, 45),
+            utc(2026, 3, 8, 5, 0),
+            utc(2026, 6, 30, 23, 59),
+            utc(2026, 11, 1, 4, 0),
+            utc(2026, 11, 1, 5, 30),
+        ]
+        dose_times = [time(0, 0), time(1, 30), time(2, 30), time(8, 0), time(23, 59)]
+        
+        for timezone_name in [self.TIMEZONE, 'Asia/Kolkata', 'Australia/Lord_Howe', 'UTC']:
+            for now_utc in instants:
+                context = TimezoneContext(timezone_name, now_utc)
+                for dose_time in dose_times:
+                    with self.subTest(timezone=timezone_name, now=now_utc, dose_time=dose_time):
+                        self.assertEqual(
+                            context.next_fire_at(dose_time, date(2026, 1, 1)),
+                            next_fire_at(timezone_name, dose_time, date(2026, 1, 1), now_utc)
+                        )
+    
+    def test_cache_localizes_each_timezone_once(self):
+        cache = TimezoneContextCache(utc(2026, 1, 10, 12, 0))
+        
+        for dose_time in [time(8, 0), time(20, 0)]:
+            cache.next_fire_at(self.TIMEZONE, dose_time, date(2026, 1, 1))
+        cache.next_fire_at('UTC', time(8, 0), date(2026, 1, 1))
+        
+        self.assertEqual(cache.stats(), {'timezones': 2, 'hits': 1, 'misses': 2})
+        self.assertEqual(cache.next_fire_at(self.TIMEZONE, time(20, 0), date(2026, 1, 1)), utc(2026, 1, 11, 1, 0))
+
+
+class ScheduleSnapshotTests(ReminderTestMixin, TestCase):
+    """Due-dose lookup and incremental refresh of the schedule snapshot"""
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('snapshot@example.com', 'password123', timezone='America/New_York')
+        self.reminder = self.create_reminder()
+        self.snapshot = ScheduleSnapshot()
+    
+    def add_dose(self, dose_time, reminder=None, dose_number=1):
+        return DoseSchedule.objects.create(
+            reminder=reminder or self.reminder, dose_number=dose_number, amount=1, time=dose_time
+        )
+    
+    def tick(self, start, end, step=timedelta(minutes=1)):
+        """Run due_doses over (start, end] in consecutive windows of `step`"""
+        fired = []
+        while start < end:
+            window_end = min(start + step, end)
+            for dose in self.snapshot.due_doses(start, window_end):
+                self.assertTrue(start < dose[1] <= window_end, f"{dose} fired outside ({start}, {window_end}]")
+                fired.append(dose)
+            start = window_end
+        return fired
+    
+    def test_due_in_window(self):
+        dose_schedule = self.add_dose(time(8, 0))
+        self.snapshot.rebuild()
+        
+        self.assertEqual(
+            self.snapshot.due_doses(utc(2026, 1, 10, 12, 59, 30), utc(2026, 1, 10, 13, 0, 30)),
+            [(dose_schedule.id, utc(2026, 1, 10, 13, 0))]
+        )
+        self.assertEqual(self.snapshot.due_doses(utc(2026, 1, 10, 13, 0), utc(2026, 1, 10, 13, 1)), [])
+    
+    def test_spring_forward_gap_fires_one_shift_later(self):
+        # 02:30 does not exist on 2026-03-08; like the index path it fires at 03:30 EDT
+        dose_schedule = self.add_dose(time(2, 30))
+        self.snapshot.rebuild()
+        
+        fired = self.tick(utc(2026, 3, 8, 6, 0, 30), utc(2026, 3, 8, 8, 0, 30))
+        
+        self.assertEqual(fired, [(dose_schedule.id, utc(2026, 3, 8, 7, 30))])
+    
+    def test_fall_back_fires_on_second_pass(self):
+        dose_schedule = self.add_dose(time(1, 30))
+        self.snapshot.rebuild()
+        
+        fired = self.tick(utc(2026, 11, 1, 4, 0, 30), utc(2026, 11, 1, 8, 0, 30))
+        
+        self.assertEqual(fired, [(dose_schedule.id, utc(2026, 11, 1, 6, 30))])
+    
+    def test_matches_index_path_across_transitions(self):
+        dose_times = [time(hour, minute) for hour in range(5) for minute in (0, 15, 30, 45)]
+        for dose_number, dose_time in enumerate(dose_times, start=1):
+            reminder = self.create_reminder()
+            self.add_dose(dose_time, reminder=reminder, dose_number=dose_number)
+        self.snapshot.rebuild()
+        
+        for start, step in [
+            (utc(2026, 3, 7, 12, 0), timedelta(seconds=37)),
+            (utc(2026, 3, 7, 12, 0), timedelta(minutes=5)),
+            (utc(2026, 10, 31, 12, 0), timedelta(seconds=37)),
+            (utc(2026, 10, 31, 12, 0), timedelta(hours=1)),
+        ]:
+            end = start + timedelta(days=2)
+            expected = set()
+            for dose_schedule in DoseSchedule.objects.select_related('reminder__user'):
+                fire_at = dose_schedule.compute_next_fire_at(start)
+                while fire_at <= end:
+                    expected.add((dose_schedule.id, fire_at))
+                    fire_at = dose_schedule.compute_next_fire_at(fire_at)
+            
+            with self.subTest(start=start, step=step):
+                fired = self.tick(start, end, step)
+                self.assertEqual(len(fired), len(set(fired)))
+                self.assertEqual(set(fired), expected)
+    
+    def test_skips_inactive_and_not_started_reminders(self):
+        self.add_dose(time(8, 0), reminder=self.create_reminder(is_active=False))
+        self.add_dose(time(8, 0), reminder=self.create_reminder(start_date=date(2026, 2, 1)))
+        self.snapshot.rebuild()
+        
+        self.assertEqual(self.snapshot.due_doses(utc(2026, 1, 10, 12, 59), utc(2026, 1, 10, 13, 0)), [])
+    
+    def test_refresh_picks_up_changes(self):
+        dose_schedule = self.add_dose(time(8, 0))
+        self.snapshot.rebuild(timezone.now())
+        
+        dose_schedule.time = time(9, 0)
+        dose_schedule.save()
+        added = self.add_dose(time(9, 0), reminder=self.create_reminder())
+        self.snapshot.refresh(timezone.now())
+        
+        self.assertEqual(len(self.snapshot), 2)
+        self.assertEqual(self.snapshot.due_doses(utc(2026, 1, 10, 12, 59), utc(2026, 1, 10, 13, 0)), [])
+        self.assertEqual(
+            sorted(self.snapshot.due_doses(utc(2026, 1, 10, 13, 59), utc(2026, 1, 10, 14, 0))),
+            [(dose_schedule.id, utc(2026, 1, 10, 14, 0)), (added.id, utc(2026, 1, 10, 14, 0))]
+        )
+    
+    def test_refresh_picks_up_reminder_and_user_changes(self):
+        dose_schedule = self.add_dose(time(8, 0))
+        self.snapshot.rebuild(timezone.now())
+        
+        self.user.timezone = 'UTC'
+        self.user.save()
+        self.snapshot.refresh(timezone.now())
+        self.assertEqual(
+            self.snapshot.due_doses(utc(2026, 1, 10, 7, 59), utc(2026, 1, 10, 8, 0)),
+            [(dose_schedule.id, utc(2026, 1, 10, 8, 0))]
+        )
+        
+        self.reminder.is_active = False
+        self.reminder.save()
+        self.snapshot.refresh(timezone.now())
+        self.assertEqual(self.snapshot.due_doses(utc(2026, 1, 10, 7, 59), utc(2026, 1, 10, 8, 0)), [])
+
+
+class DoseTickTests(ReminderTestMixin, TestCase):
+    """Watermark catch-up and the catch-up horizon of a dose tick"""
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('tick@example.com', 'password123', timezone='UTC')
+        self.now = utc(2026, 5, 4, 9, 0)
+    
+    def set_watermark(self, processed_until):
+        SchedulerCheckpoint.objects.create(name=DOSE_SCHEDULER_CHECKPOINT, processed_until=processed_until)
+    
+    def test_catches_up_on_doses_missed_since_watermark(self):
+        self.set_watermark(self.now - timedelta(minutes=5))
+        dose_schedule = self.create_dose_schedule(self.create_reminder(), self.now - timedelta(minutes=3))
+        
+        result = _plan_dose_reminders(self.now, None)
+        
+        self.assertEqual(result['queued'], 1)
+        self.assertTrue(DoseOccurrence.objects.filter(
+            dose_schedule=dose_schedule, scheduled_for=self.now - timedelta(minutes=3)
+        ).exists())
+        self.assertEqual(SchedulerCheckpoint.objects.get(name=DOSE_SCHEDULER_CHECKPOINT).processed_until, self.now)
+        
+        dose_schedule.refresh_from_db()
+        self.assertEqual(dose_schedule.next_fire_at, utc(2026, 5, 5, 8, 57))
+    
+    def test_skips_doses_beyond_horizon(self):
+        self.set_watermark(self.now - timedelta(hours=2))
+        dose_schedule = self.create_dose_schedule(
+            self.create_reminder(),
+            self.now - timedelta(minutes=settings.DOSE_MAX_CATCH_UP_MINUTES + 5)
+        )
+        
+        result = _plan_dose_reminders(self.now, None)
+        
+        self.assertEqual(result['queued'], 0)
+        self.assertFalse(DoseOccurrence.objects.exists())
+        dose_schedule.refresh_from_db()
+        self.assertGreater(dose_schedule.next_fire_at, self.now)
+    
+    def test_repeated_tick_claims_nothing(self):
+        self.set_watermark(self.now - timedelta(minutes=1))
+        dose_schedule = self.create_dose_schedule(self.create_reminder(), self.now - timedelta(seconds=30))
+        
+        self.assertEqual(_plan_dose_reminders(self.now, None)['queued'], 1)
+        # A redelivered tick with a stale watermark finds the dose already claimed
+        SchedulerCheckpoint.objects.filter(name=DOSE_SCHEDULER_CHECKPOINT).update(
+            processed_until=self.now - timedelta(minutes=1)
+        )
+        DoseSchedule.objects.filter(pk=dose_schedule.pk).update(next_fire_at=self.now - timedelta(seconds=30))
+        self.assertEqual(_plan_dose_reminders(self.now, None)['queued'], 0)
+        self.assertEqual(DoseOccurrence.objects.count(), 1)
+    
+    def test_inactive_reminder_is_not_claimed(self):
+        self.set_watermark(self.now - timedelta(minutes=1))
+        self.create_dose_schedule(self.create_reminder(is_active=False), self.now - timedelta(seconds=30))
+        
+        self.assertEqual(_plan_dose_reminders(self.now, None)['queued'], 0)
+    
+    @override_settings(DOSE_TICK_CHUNK_SIZE=2)
+    def test_streams_due_schedules_in_chunks(self):
+        self.set_watermark(self.now - timedelta(minutes=1))
+        for seconds in range(5):
+            self.create_dose_schedule(self.create_reminder(), self.now - timedelta(seconds=50 - seconds))
+        
+        result = _plan_dose_reminders(self.now, None)
+        
+        self.assertEqual(result['queued'], 5)
+        self.assertEqual(result['chunks'], 3)
+        self.assertEqual(DoseOccurrence.objects.count(), 5)
+
+
+
+class DoseReplayTests(ReminderTestMixin, TestCase):
+    """Dry-run ticks and the replay_dose_scheduler command"""
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('replay@example.com', 'password123', timezone='UTC')
+        self.now = utc(2026, 5, 4, 9, 0)
+        self.dose_schedule = self.create_dose_schedule(self.create_reminder(), self.now - timedelta(seconds=30))
+    
+    def replay(self, *args):
+        stdout = StringIO()
+        call_command('replay_dose_scheduler', *args, stdout=stdout)
+        return stdout.getvalue()
+    
+    def test_dry_run_reports_doses_and_writes_nothing(self):
+        SchedulerCheckpoint.objects.create(name=DOSE_SCHEDULER_CHECKPOINT, processed_until=self.now - timedelta(minutes=1))
+        
+        result = send_dose_reminders(now=self.now.isoformat(), dry_run=True)
+        
+        self.assertEqual(result['doses'], [(self.dose_schedule.id, (self.now - timedelta(seconds=30)).isoformat())])
+        self.assertFalse(DoseOccurrence.objects.exists())
+        self.assertEqual(
+            SchedulerCheckpoint.objects.get(name=DOSE_SCHEDULER_CHECKPOINT).processed_until,
+            self.now - timedelta(minutes=1)
+        )
+        self.dose_schedule.refresh_from_db()
+        self.assertEqual(self.dose_schedule.next_fire_at, self.now - timedelta(seconds=30))
+    
+    def test_dry_run_treats_naive_now_as_utc(self):
+        result = send_dose_reminders(now='2026-05-04T09:00:00', dry_run=True)
+        
+        self.assertEqual(len(result['doses']), 1)
+    
+    def test_replay_reports_doses_per_tick(self):
+        output = self.replay('--start', '2026-05-04T08:55', '--end', '2026-05-04T09:05', '--show-doses')
+        
+        self.assertIn(f"schedule {self.dose_schedule.id} due 2026-05-04T08:59:30+00:00", output)
+        self.assertIn('ticks: 10', output)
+        self.assertIn('doses: 1', output)
+        self.assertFalse(DoseOccurrence.objects.exists())
+        self.assertFalse(SchedulerCheckpoint.objects.exists())
+    
+    def test_replay_rejects_window_without_ticks(self):
+        with self.assertRaises(CommandError):
+            self.replay('--start', '2026-10-17T00:00', '--end', '2026-10-17T00:00:30')
+
+
+@override_settings(DOSE_SCHEDULER_MODE='eta', DOSE_ETA_HORIZON_HOURS=1)
+class EtaSchedulingTests(ReminderTestMixin, TestCase):
+    """Materializing occurrences ahead of time and rebuilding them after a change"""
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('eta@example.com', 'password123', timezone='UTC')
+        self.reminder = self.create_reminder()
+        self.now = timezone.now().replace(second=0, microsecond=0)
+        self.dose_schedule = self.create_dose_schedule(self.reminder, self.now + timedelta(minutes=10))
+        
+        patcher = mock.patch('apps.reminders.tasks._enqueue_dose_batches')
+        self.enqueue = patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_materialize_enqueues_with_eta(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            materialize_dose_occurrences()
+        
+        occurrence = DoseOccurrence.objects.get()
+        self.assertEqual(occurrence.scheduled_for, self.now + timedelta(minutes=10))
+        self.enqueue.assert_called_once_with([occurrence.id], eta=self.now + timedelta(minutes=10))
+        
+        self.dose_schedule.refresh_from_db()
+        self.assertEqual(self.dose_schedule.next_fire_at, self.now + timedelta(days=1, minutes=10))
+    
+    def test_materialize_is_idempotent(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            materialize_dose_occurrences()
+        DoseSchedule.objects.filter(pk=self.dose_schedule.pk).update(next_fire_at=self.now + timedelta(minutes=10))
+        with self.captureOnCommitCallbacks(execute=True):
+            materialize_dose_occurrences()
+        
+        self.assertEqual(DoseOccurrence.objects.count(), 1)
+        self.assertEqual(self.enqueue.call_count, 1)
+    
+    def test_materialize_skips_inactive_reminders(self):
+        Reminder.objects.filter(pk=self.reminder.pk).update(is_active=False)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            materialize_dose_occurrences()
+        
+        self.assertFalse(DoseOccurrence.objects.exists())
+        self.dose_schedule.refresh_from_db()
+        self.assertGreater(self.dose_schedule.next_fire_at, self.now + timedelta(hours=1))
+    
+    @override_settings(DOSE_SCHEDULER_MODE='index')
+    def test_materialize_only_in_eta_mode(self):
+        self.assertEqual(materialize_dose_occurrences(), "Skipped: ETA scheduling is disabled")
+        self.assertFalse(DoseOccurrence.objects.exists())
+    
+    def test_rebuild_replaces_undispatched_occurrences(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            materialize_dose_occurrences()
+        old_occurrence = DoseOccurrence.objects.get()
+        
+        new_time = self.now + timedelta(minutes=20)
+        DoseSchedule.objects.filter(pk=self.dose_schedule.pk).update(time=new_time.time())
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_reminder_occurrences(self.reminder.id)
+        
+        occurrence = DoseOccurrence.objects.get()
+        self.assertNotEqual(occurrence.id, old_occurrence.id)
+        self.assertEqual(occurrence.scheduled_for, new_time)
+        self.enqueue.assert_called_with([occurrence.id], eta=new_time)
+    
+    def test_rebuild_keeps_dispatched_occurrences(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            materialize_dose_occurrences()
+        old_occurrence = DoseOccurrence.objects.get()
+        DoseOccurrence.objects.mark_dispatched([old_occurrence.id])
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            rebuild_reminder_occurrences(self.reminder.id)
+        
+        self.assertEqual(list(DoseOccurrence.objects.values_list('id', flat=True)), [old_occurrence.id])
+
+
+class DoseSchedulerDaemonTests(ReminderTestMixin, TestCase):
+    """Active/standby failover and firing of the dose scheduler daemon"""
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('daemon@example.com', 'password123', timezone='UTC')
+        self.reminder = self.create_reminder()
+        self.server = fakeredis.FakeServer()
+        
+        # The test transaction must stay open
+        patcher = mock.patch('apps.reminders.daemon.close_old_connections')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def make_daemon(self):
+        daemon = DoseSchedulerDaemon(client=fakeredis.FakeRedis(server=self.server))
+        self.addCleanup(daemon._deactivate)
+        return daemon
+    
+    def test_one_daemon_is_active(self):
+        active, standby = self.make_daemon(), self.make_daemon()
+        
+        self.assertTrue(active._try_activate())
+        self.assertFalse(standby._try_activate())
+        
+        active._deactivate()
+        self.assertTrue(standby._try_activate())
+        self.assertTrue(standby.is_active)
+    
+    def test_stays_on_standby_while_redis_is_down(self):
+        daemon = self.make_daemon()
+        self.server.connected = False
+        
+        self.assertFalse(daemon._try_activate())
+        self.assertFalse(daemon.is_active)
+        
+        self.server.connected = True
+        self.assertTrue(daemon._try_activate())
+    
+    def test_fires_due_doses(self):
+        now = timezone.now()
+        dose_schedule = self.create_dose_schedule(self.reminder, now - timedelta(seconds=5))
+        self.create_dose_schedule(self.create_reminder(), now + timedelta(hours=2))
+        daemon = self.make_daemon()
+        daemon._try_activate()
+        self.assertEqual(len(daemon._fire_at), 1)
+        
+        daemon._fire_due(now)
+        
+        occurrence = DoseOccurrence.objects.get()
+        self.assertEqual(occurrence.dose_schedule_id, dose_schedule.id)
+        self.assertIsNotNone(occurrence.dispatched_at)
+        self.assertEqual(NotificationLog.objects.filter(occurrence=occurrence, status='pending').count(), 1)
+        self.assertEqual(daemon.doses_fired, 1)
+        
+        dose_schedule.refresh_from_db()
+        self.assertEqual(dose_schedule.next_fire_at, now - timedelta(seconds=5) + timedelta(days=1))
+        self.reminder.refresh_from_db()
+        self.assertEqual(self.reminder.quantity, 9)
+    
+    def test_lost_lease_rolls_back_claims(self):
+        now = timezone.now()
+        self.create_dose_schedule(self.reminder, now - timedelta(seconds=5))
+        daemon = self.make_daemon()
+        daemon._try_activate()
+        daemon.client.delete(daemon.lease.key)
+        
+        with self.assertRaises(LeaseLost):
+            daemon._fire_due(now)
+        
+        self.assertFalse(DoseOccurrence.objects.exists())
+        self.assertFalse(NotificationLog.objects.exists())
+    
+    def test_reload_reminder_replaces_fire_time(self):
+        now = timezone.now()
+        dose_schedule = self.create_dose_schedule(self.reminder, now + timedelta(minutes=5))
+        daemon = self.make_daemon()
+        daemon._try_activate()
+        
+        DoseSchedule.objects.filter(pk=dose_schedule.pk).update(next_fire_at=now - timedelta(seconds=1))
+        daemon._reload_reminder(self.reminder.id)
+        
+        self.assertEqual(daemon._pop_due(now), [dose_schedule.id])
+        # The old entry is stale once replaced
+        self.assertEqual(daemon._pop_due(now + timedelta(minutes=10)), [])
+
+
+class RescheduleSignalTests(ReminderTestMixin, TestCase):
+    """Reminders are rescheduled once per transaction after scheduling changes"""
+    
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('signals@example.com', 'password123', timezone='UTC')
+        self.reminder = self.create_reminder()
+        self.dose_schedule = DoseSchedule.objects.create(
+            reminder=self.reminder, dose_number=1, amount=1, time=time(8, 0)
+        )
+    
+    def rescheduled(self):
+        """Patch reschedule_doses and return the mock recording its calls"""
+        patcher = mock.patch.object(Reminder, 'reschedule_doses', autospec=True)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+    
+    def test_dose_time_change_reschedules(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dose_schedule.time = time(9, 30)
+            self.dose_schedule.save()
+        
+        self.dose_schedule.refresh_from_db()
+        self.assertEqual(self.dose_schedule.next_fire_at.astimezone(pytz.utc).time(), time(9, 30))
+        self.reminder.refresh_from_db()
+        self.assertEqual(self.reminder.dose_minutes, [9 * 60 + 30])
+    
+    def test_dose_schedule_delete_refreshes_dose_minutes(self):
+        DoseSchedule.objects.create(reminder=self.reminder, dose_number=2, amount=1, time=time(20, 0))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dose_schedule.delete()
+        
+        self.reminder.refresh_from_db()
+        self.assertEqual(self.reminder.dose_minutes, [20 * 60])
+    
+    def test_timezone_change_reschedules_user_reminders(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.timezone = 'Asia/Kolkata'
+            self.user.save()
+        
+        self.dose_schedule.refresh_from_db()
+        local_time = self.dose_schedule.next_fire_at.astimezone(pytz.timezone('Asia/Kolkata')).time()
+        self.assertEqual(local_time, time(8, 0))
+    
+    def test_changes_are_batched_per_transaction(self):
+        reschedule_doses = self.rescheduled()
+        other = self.create_reminder()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.dose_schedule.time = time(9, 0)
+            self.dose_schedule.save()
+            DoseSchedule.objects.create(reminder=self.reminder, dose_number=2, amount=1, time=time(21, 0))
+            other.start_date = date(2026, 2, 1)
+            other.save()
+        
+        self.assertEqual(
+            sorted(call.args[0].id for call in reschedule_doses.call_args_list),
+            [self.reminder.id, other.id]
+        )
+    
+    def test_unrelated_changes_are_ignored(self):
+        reschedule_doses = self.rescheduled()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reminder.quantity = 5
+            self.reminder.refill_reminder_sent = True
+            self.reminder.save()
+            self.user.name = 'Someone'
+            self.user.save()
+        
+        reschedule_doses.assert_not_called()
+    
+    def test_change_after_rollback_is_rescheduled(self):
+        reschedule_doses = self.rescheduled()
+        other = self.create_reminder()
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.dose_schedule.time = time(9, 0)
+                    self.dose_schedule.save()
+                    raise ValueError
+            except ValueError:
+                pass
+            other.is_active = False
+            other.save()
+        
+        self.assertIn(other.id, [call.args[0].id for call in reschedule_doses.call_args_list])
+
+
+class QueueRoutingTests(SimpleTestCase):
+    """Every task runs on a named queue that a worker pool consumes"""
+    
+    def setUp(self):
+        celery_app.loader.import_default_modules()
+        self.task_names = sorted(name for name in celery_app.tasks if name.startswith('apps.'))
+    
+    def queue_of(self, task_name):
+        return celery_app.amqp.router.route({}, task_name)['queue'].name
+    
+    def test_every_task_is_routed_to_a_declared_queue(self):
+        self.assertTrue(self.task_names)
+        for task_name in self.task_names:
+            with self.subTest(task_name):
+                self.assertIn(task_name, celery_app.conf.task_routes)
+                self.assertIn(self.queue_of(task_name), QUEUES)
+    
+    def test_dose_work_has_its_own_queues(self):
+        self.assertEqual(self.queue_of('apps.reminders.tasks.send_dose_reminders'), settings.DOSE_SCHEDULER_QUEUE)
+        self.assertEqual(self.queue_of('apps.reminders.tasks.dispatch_dose_batch'), settings.DOSE_DISPATCH_QUEUE)
+        self.assertEqual(self.queue_of('apps.reminders.tasks.send_refill_reminders_task'), settings.REFILL_QUEUE)
+        self.assertEqual(self.queue_of('apps.reminders.tasks.cleanup_old_notifications'), settings.MAINTENANCE_QUEUE)
+    
+    def test_every_queue_has_exactly_one_pool(self):
+        pool_queues = [queue for pool in WORKER_POOLS.values() for queue in pool['queues']]
+        self.assertCountEqual(pool_queues, QUEUES)
+    
+    def test_refill_senders_use_refill_queue(self):
+        with mock.patch('apps.notifications.tasks.send_pending_notifications.apply_async') as apply_async:
+            NotificationOutbox.start_senders('refill_reminder')
+            NotificationOutbox.start_senders('dose_reminder')
+        
+        self.assertEqual(
+            [call.kwargs['queue'] for call in apply_async.call_args_list],
+            [settings.REFILL_QUEUE, settings.NOTIFICATION_OUTBOX_QUEUE]
+        )
+
+
+class QueueMetricsTests(SimpleTestCase):
+    """Per-queue wait times kept in Redis"""
+    
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        patcher = mock.patch.object(
+            queue_metrics, 'get_redis_client', return_value=fakeredis.FakeRedis(server=self.server)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def test_wait_stats(self):
+        for seconds in range(1, 101):
+            queue_metrics.record_wait('dose_dispatch', seconds / 1000)
+        
+        self.assertEqual(
+            queue_metrics.wait_stats('dose_dispatch'),
+            {'samples': 100, 'p50_ms': 51, 'p95_ms': 96, 'max_ms': 100}
+        )
+        self.assertEqual(queue_metrics.wait_stats('refill')['samples'], 0)
+    
+    def test_keeps_latest_samples(self):
+        with mock.patch.object(queue_metrics, 'WAIT_SAMPLES', 3):
+            for seconds in [5, 1, 2, 3]:
+                queue_metrics.record_wait('refill', seconds)
+        
+        self.assertEqual(queue_metrics.wait_stats('refill')['max_ms'], 3000)
+    
+    def test_redis_outage_is_ignored(self):
+        self.server.connected = False
+        queue_metrics.record_wait('refill', 1)
+    
+    def test_wait_is_measured_from_eta(self):
+        request = mock.Mock(
+            delivery_info={'routing_key': 'dose_dispatch'},
+            published_at=1000.0,
+            eta=datetime.fromtimestamp(1060, tz=pytz.utc).isoformat()
+        )
+        
+        with mock.patch('medicine_reminder.celery.time.time', return_value=1062.5):
+            record_queue_wait(task=mock.Mock(request=request))
+        
+        self.assertEqual(queue_metrics.wait_stats('dose_dispatch')['max_ms'], 2500)
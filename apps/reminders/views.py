@@ -116,6 +116,7 @@ class ReminderViewSet(viewsets.ModelViewSet):
             )
         
         reminder.is_active = True
+        # Doses that passed while inactive are skipped by the reschedule on save
         reminder.save()
         
         return StandardResponse.success(
@@ -1,7 +1,12 @@
 # medicine_reminder/celery.py
 import os
+import time
+from datetime import datetime
 from celery import Celery
 from celery.schedules import crontab
+from celery.signals import before_task_publish, task_prerun, worker_process_init
+from django.conf import settings
+from kombu import Queue
 
 # Set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'medicine_reminder.settings')
@@ -12,6 +17,106 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 
 app.autodiscover_tasks()
 
+# Queues, most urgent first. On-time dose work has its own queues so a
+# refill burst, a retry storm or a large cleanup never delays it.
+QUEUES = [
+    settings.DOSE_SCHEDULER_QUEUE,
+    settings.DOSE_DISPATCH_QUEUE,
+    settings.NOTIFICATION_OUTBOX_QUEUE,
+    settings.REFILL_QUEUE,
+    settings.NOTIFICATION_RETRY_QUEUE,
+    settings.MAINTENANCE_QUEUE,
+    'celery',
+]
+
+app.conf.task_queues = [Queue(name) for name in QUEUES]
+app.conf.task_default_queue = 'celery'
+app.conf.task_routes = {
+    'apps.reminders.tasks.send_dose_reminders': {'queue': settings.DOSE_SCHEDULER_QUEUE},
+    'apps.reminders.tasks.materialize_dose_occurrences': {'queue': settings.DOSE_SCHEDULER_QUEUE},
+    'apps.reminders.tasks.rebuild_reminder_occurrences': {'queue': settings.DOSE_SCHEDULER_QUEUE},
+    'apps.reminders.tasks.requeue_stranded_occurrences': {'queue': settings.DOSE_SCHEDULER_QUEUE},
+    'apps.reminders.tasks.dispatch_dose_batch': {'queue': settings.DOSE_DISPATCH_QUEUE},
+    # Refill senders are sent to REFILL_QUEUE explicitly
+    'apps.notifications.tasks.send_pending_notifications': {'queue': settings.NOTIFICATION_OUTBOX_QUEUE},
+    'apps.reminders.tasks.send_refill_reminder_task': {'queue': settings.REFILL_QUEUE},
+    'apps.reminders.tasks.send_refill_reminders_task': {'queue': settings.REFILL_QUEUE},
+    'apps.notifications.tasks.retry_notifications': {'queue': settings.NOTIFICATION_RETRY_QUEUE},
+    'apps.notifications.tasks.retry_due_notifications': {'queue': settings.NOTIFICATION_RETRY_QUEUE},
+    'apps.reminders.tasks.cleanup_old_notifications': {'queue': settings.MAINTENANCE_QUEUE},
+    'apps.reminders.tasks.deactivate_empty_reminders': {'queue': settings.MAINTENANCE_QUEUE},
+}
+
+# Worker pools, each consuming its own queues with its own concurrency.
+# Start one with `python manage.py run_worker_pool <name>`.
+WORKER_POOLS = {
+    # Planning and claiming doses: short database work that must never wait
+    'dose': {
+        'queues': [settings.DOSE_SCHEDULER_QUEUE, settings.DOSE_DISPATCH_QUEUE],
+        'concurrency': 4,
+        'prefetch_multiplier': 1,
+    },
+    # Delivering dose notifications: mostly waiting on providers
+    'dose_senders': {
+        'queues': [settings.NOTIFICATION_OUTBOX_QUEUE],
+        'concurrency': 8,
+        'prefetch_multiplier': 1,
+    },
+    'refill': {
+        'queues': [settings.REFILL_QUEUE],
+        'concurrency': 2,
+        'prefetch_multiplier': 1,
+    },
+    'retry': {
+        'queues': [settings.NOTIFICATION_RETRY_QUEUE],
+        'concurrency': 2,
+        'prefetch_multiplier': 1,
+    },
+    'maintenance': {
+        'queues': [settings.MAINTENANCE_QUEUE, 'celery'],
+        'concurrency': 1,
+        'prefetch_multiplier': 1,
+    },
+}
+
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """Create provider clients once per worker process, after the fork"""
+    from apps.notifications.services import EmailService, SMSService
+    
+    # A client inherited from the parent would share its sockets
+    SMSService.reset_client()
+    SMSService.get_client()
+    # The SMTP connection is opened lazily, on the first email
+    EmailService.reset_connection()
+
+
+@before_task_publish.connect
+def stamp_published_at(headers=None, **kwargs):
+    """Record when each task was published, for per-queue wait times"""
+    from utils.queue_metrics import PUBLISHED_AT_HEADER
+    
+    if headers is not None:
+        headers.setdefault(PUBLISHED_AT_HEADER, time.time())
+
+
+@task_prerun.connect
+def record_queue_wait(task=None, **kwargs):
+    """Record how long a task waited in its queue after it was due"""
+    from utils.queue_metrics import PUBLISHED_AT_HEADER, record_wait
+    
+    request = task.request
+    queue = (request.delivery_info or {}).get('routing_key')
+    due = getattr(request, PUBLISHED_AT_HEADER, None)
+    if not queue or due is None:
+        return
+    
+    # Tasks with an eta or countdown are only due from then on
+    if request.eta:
+        due = max(due, datetime.fromisoformat(request.eta).timestamp())
+    record_wait(queue, max(time.time() - due, 0))
+
 
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
@@ -22,9 +127,43 @@ def debug_task(self):
 app.conf.beat_schedule = {
     'send-dose-reminders-every-minute': {
         'task': 'apps.reminders.tasks.send_dose_reminders',
-        'schedule': 60.0,  # Every 60 seconds
+        'schedule': float(settings.DOSE_TICK_INTERVAL_SECONDS),
+        # Drop ticks that waited in the queue past the next one
+        'options': {'expires': settings.DOSE_TICK_INTERVAL_SECONDS - 5},
+    },
+    # Claims are enqueued on commit; this picks up any whose publish was lost
+    'requeue-stranded-occurrences': {
+        'task': 'apps.reminders.tasks.requeue_stranded_occurrences',
+        'schedule': settings.DOSE_DISPATCH_SWEEP_MINUTES * 60.0,
+        'options': {'expires': settings.DOSE_DISPATCH_SWEEP_MINUTES * 60 - 5},
+    },
+    'materialize-dose-occurrences': {
+        'task': 'apps.reminders.tasks.materialize_dose_occurrences',
+        'schedule': settings.DOSE_ETA_MATERIALIZE_MINUTES * 60.0,
+    },
+    'cleanup-old-notifications': {
+        'task': 'apps.reminders.tasks.cleanup_old_notifications',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    # Senders are started on commit; these pick up anything left pending
+    'send-pending-dose-notifications': {
+        'task': 'apps.notifications.tasks.send_pending_notifications',
+        'schedule': 60.0,
+        'args': ['dose_reminder'],
+        'options': {'queue': settings.NOTIFICATION_OUTBOX_QUEUE, 'expires': 55},
+    },
+    'send-pending-refill-notifications': {
+        'task': 'apps.notifications.tasks.send_pending_notifications',
+        'schedule': 60.0,
+        'args': ['refill_reminder'],
+        'options': {'queue': settings.REFILL_QUEUE, 'expires': 55},
+    },
+    # Retries are started by countdown tasks; this picks up any that were lost
+    'retry-due-notifications': {
+        'task': 'apps.notifications.tasks.retry_due_notifications',
+        'schedule': 60.0,
+        'options': {'expires': 55},
     },
-
 }
 
 app.conf.timezone = 'UTC'
\ No newline at end of file
@@ -234,6 +234,11 @@ EMAIL_USE_TLS = config('EMAIL_USE_TLS', cast=bool)
 EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+# Seconds before an SMTP connection or send gives up
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=10, cast=int)
+# Close a worker's pooled SMTP connection after this many idle seconds,
+# before the server times it out
+EMAIL_CONNECTION_IDLE_SECONDS = config('EMAIL_CONNECTION_IDLE_SECONDS', default=60, cast=int)
 
 # Twilio Configuration (SMS)
 TWILIO_ACCOUNT_SID = config('TWILIO_ACCOUNT_SID')
@@ -243,6 +248,44 @@ TWILIO_PHONE_NUMBER = config('TWILIO_PHONE_NUMBER')
 # Firebase Configuration (Push Notifications)
 FIREBASE_CREDENTIALS_PATH = config('FIREBASE_CREDENTIALS_PATH')
 
+# Notification Dispatch
+# Notifications are sent concurrently on a bounded thread pool per worker
+NOTIFICATION_DISPATCH_MAX_WORKERS = config('NOTIFICATION_DISPATCH_MAX_WORKERS', default=8, cast=int)
+# Seconds to wait for each send of a channel before counting it as a transient failure
+NOTIFICATION_CHANNEL_TIMEOUTS = {
+    'email': EMAIL_TIMEOUT,
+    'sms': config('SMS_SEND_TIMEOUT', default=10, cast=int),
+    'push_notification': config('PUSH_SEND_TIMEOUT', default=10, cast=int),
+}
+# Provider behind each channel; rate limits are kept per provider and channel
+NOTIFICATION_PROVIDERS = {
+    'email': 'smtp',
+    'sms': 'twilio',
+    'push_notification': 'fcm',
+}
+# Sends per second and burst size shared by all workers; a rate of 0 disables the limit
+NOTIFICATION_RATE_LIMITS = {
+    'email': {
+        'rate': config('EMAIL_RATE_LIMIT', default=10, cast=float),
+        'burst': config('EMAIL_RATE_BURST', default=20, cast=int),
+    },
+    'sms': {
+        'rate': config('SMS_RATE_LIMIT', default=10, cast=float),
+        'burst': config('SMS_RATE_BURST', default=10, cast=int),
+    },
+    'push_notification': {
+        'rate': config('PUSH_RATE_LIMIT', default=500, cast=float),
+        'burst': config('PUSH_RATE_BURST', default=1000, cast=int),
+    },
+}
+# Longest a sender waits for rate limit tokens; the rest of its batch is held for later
+NOTIFICATION_RATE_LIMIT_MAX_WAIT = config('NOTIFICATION_RATE_LIMIT_MAX_WAIT', default=5, cast=float)
+# A provider's circuit opens after this many failures within the window (seconds),
+# and a probe is let through after the reset timeout (seconds)
+NOTIFICATION_CIRCUIT_FAILURE_THRESHOLD = config('NOTIFICATION_CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int)
+NOTIFICATION_CIRCUIT_FAILURE_WINDOW = config('NOTIFICATION_CIRCUIT_FAILURE_WINDOW', default=60, cast=int)
+NOTIFICATION_CIRCUIT_RESET_TIMEOUT = config('NOTIFICATION_CIRCUIT_RESET_TIMEOUT', default=30, cast=int)
+
 # Celery Configuration
 CELERY_BROKER_URL = config('CELERY_BROKER_URL')
 CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND')
@@ -254,13 +297,66 @@ CELERY_ENABLE_UTC = True
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 
-# Celery Beat Schedule (for periodic tasks)
-CELERY_BEAT_SCHEDULE = {
-    'send-dose-reminders': {
-        'task': 'apps.reminders.tasks.send_dose_reminders',
-        'schedule': 60.0,  # Run every 60 seconds (1 minute)
-    },
-}
+# Redis used for coordination between workers (leases); defaults to the broker
+REDIS_URL = config('REDIS_URL', default=CELERY_BROKER_URL)
+
+# Dose Scheduler Configuration
+DOSE_TICK_INTERVAL_SECONDS = config('DOSE_TICK_INTERVAL_SECONDS', default=60, cast=int)
+# Only one tick may plan at a time; the lease expires if its holder dies
+DOSE_TICK_LEASE_SECONDS = config('DOSE_TICK_LEASE_SECONDS', default=120, cast=int)
+# Missed ticks are caught up from the persisted watermark, but never further back than this
+DOSE_MAX_CATCH_UP_MINUTES = config('DOSE_MAX_CATCH_UP_MINUTES', default=30, cast=int)
+# Due schedules are processed this many at a time to bound worker memory
+DOSE_TICK_CHUNK_SIZE = config('DOSE_TICK_CHUNK_SIZE', default=1000, cast=int)
+# 'index' queries DoseSchedule.next_fire_at; 'snapshot' uses a worker-resident schedule snapshot;
+# 'eta' enqueues doses ahead of time instead of polling every minute; 'daemon' leaves
+# firing to `manage.py run_dose_scheduler`
+DOSE_SCHEDULER_MODE = config('DOSE_SCHEDULER_MODE', default='index')
+DOSE_SNAPSHOT_FULL_REFRESH_SECONDS = config('DOSE_SNAPSHOT_FULL_REFRESH_SECONDS', default=3600, cast=int)
+# ETA mode: how far ahead doses are enqueued and how often. The Redis broker redelivers
+# unacknowledged tasks after visibility_timeout, so it must stay above the horizon
+DOSE_ETA_HORIZON_HOURS = config('DOSE_ETA_HORIZON_HOURS', default=1, cast=int)
+DOSE_ETA_MATERIALIZE_MINUTES = config('DOSE_ETA_MATERIALIZE_MINUTES', default=15, cast=int)
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': (DOSE_ETA_HORIZON_HOURS + 1) * 3600}
+# Daemon mode: schedules due within the horizon are kept in memory and reloaded from the
+# database every reload interval, which must stay below the horizon
+DOSE_DAEMON_HORIZON_SECONDS = config('DOSE_DAEMON_HORIZON_SECONDS', default=600, cast=int)
+DOSE_DAEMON_RELOAD_SECONDS = config('DOSE_DAEMON_RELOAD_SECONDS', default=300, cast=int)
+# A standby daemon takes over within this long after the active one dies
+DOSE_DAEMON_LEASE_SECONDS = config('DOSE_DAEMON_LEASE_SECONDS', default=15, cast=int)
+# Celery queues; routing and worker pools are defined in medicine_reminder/celery.py.
+# Ticks and occurrence planning run on the scheduler queue, due doses are fanned out
+# to the dispatch queue.
+DOSE_SCHEDULER_QUEUE = config('DOSE_SCHEDULER_QUEUE', default='dose_scheduler')
+DOSE_DISPATCH_QUEUE = config('DOSE_DISPATCH_QUEUE', default='dose_dispatch')
+DOSE_DISPATCH_BATCH_SIZE = config('DOSE_DISPATCH_BATCH_SIZE', default=500, cast=int)
+# Claimed doses still undispatched this long after they were due and claimed are
+# enqueued again by a sweep every DOSE_DISPATCH_SWEEP_MINUTES
+DOSE_DISPATCH_SWEEP_GRACE_SECONDS = config('DOSE_DISPATCH_SWEEP_GRACE_SECONDS', default=120, cast=int)
+DOSE_DISPATCH_SWEEP_MINUTES = config('DOSE_DISPATCH_SWEEP_MINUTES', default=2, cast=int)
+# Notifications are written to an outbox (pending NotificationLogs) and sent by
+# workers on this queue; refill reminders are queued and sent on their own queue
+NOTIFICATION_OUTBOX_QUEUE = config('NOTIFICATION_OUTBOX_QUEUE', default='notifications')
+REFILL_QUEUE = config('REFILL_QUEUE', default='refill')
+NOTIFICATION_OUTBOX_BATCH_SIZE = config('NOTIFICATION_OUTBOX_BATCH_SIZE', default=200, cast=int)
+# Batches one sender task sends before handing over to a fresh task
+NOTIFICATION_OUTBOX_MAX_BATCHES = config('NOTIFICATION_OUTBOX_MAX_BATCHES', default=10, cast=int)
+# Seconds after which logs a sender claimed but never finished are sent again;
+# must be longer than sending one batch takes
+NOTIFICATION_OUTBOX_CLAIM_TIMEOUT = config('NOTIFICATION_OUTBOX_CLAIM_TIMEOUT', default=600, cast=int)
+# Transient send failures are retried on their own queue.
+# Attempts include the first send; backoff doubles from the base delay (seconds) up to the max.
+NOTIFICATION_RETRY_QUEUE = config('NOTIFICATION_RETRY_QUEUE', default='notification_retries')
+NOTIFICATION_RETRY_MAX_ATTEMPTS = config('NOTIFICATION_RETRY_MAX_ATTEMPTS', default=5, cast=int)
+# Deferrals by an open circuit send nothing, so they have their own budget: with the
+# default delays, a provider outage of two to three hours
+NOTIFICATION_RETRY_MAX_DEFERRALS = config('NOTIFICATION_RETRY_MAX_DEFERRALS', default=12, cast=int)
+NOTIFICATION_RETRY_BASE_DELAY = config('NOTIFICATION_RETRY_BASE_DELAY', default=30, cast=int)
+NOTIFICATION_RETRY_MAX_DELAY = config('NOTIFICATION_RETRY_MAX_DELAY', default=1800, cast=int)
+# Cleanup and other bulk jobs
+MAINTENANCE_QUEUE = config('MAINTENANCE_QUEUE', default='maintenance')
+
+# Periodic tasks are scheduled in medicine_reminder/celery.py (app.conf.beat_schedule)
 
 # Logging Configuration
 LOGGING = {
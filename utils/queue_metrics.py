@@ -0,0 +1,67 @@
+"""
+Per-queue Celery metrics: how many messages wait in each queue and how
+long tasks waited between being due and starting.
+
+Wait times are recorded by the signal handlers in
+medicine_reminder/celery.py and kept in Redis, the latest WAIT_SAMPLES
+per queue, so every worker contributes to the same figures.
+"""
+import logging
+import redis
+from kombu.exceptions import ChannelError
+from utils.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+WAIT_SAMPLES = 1000
+
+# Message header stamped when a task is published
+PUBLISHED_AT_HEADER = 'published_at'
+
+
+def _wait_key(queue):
+    return f'queue_metrics:{queue}:wait_ms'
+
+
+def record_wait(queue, seconds):
+    """Add one wait time sample for a queue"""
+    key = _wait_key(queue)
+    try:
+        pipe = get_redis_client().pipeline()
+        pipe.lpush(key, int(seconds * 1000))
+        pipe.ltrim(key, 0, WAIT_SAMPLES - 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.debug(f"Failed to record wait time of queue {queue}: {str(e)}")
+
+
+def wait_stats(queue):
+    """Median, 95th percentile and maximum of the queue's recent wait times, in ms"""
+    samples = sorted(int(sample) for sample in get_redis_client().lrange(_wait_key(queue), 0, -1))
+    if not samples:
+        return {'samples': 0, 'p50_ms': None, 'p95_ms': None, 'max_ms': None}
+    
+    return {
+        'samples': len(samples),
+        'p50_ms': samples[len(samples) // 2],
+        'p95_ms': samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+        'max_ms': samples[-1],
+    }
+
+
+def queue_depth(app, queue):
+    """Number of messages waiting in a queue on the broker"""
+    with app.connection_for_read() as connection:
+        try:
+            return connection.default_channel.queue_declare(queue=queue, passive=True).message_count
+        except ChannelError:
+            # Not declared yet, or an empty queue on the Redis transport
+            return 0
+
+
+def collect(app, queues):
+    """Return {queue: {'depth': ..., 'wait': wait_stats}} for the given queues"""
+    return {
+        queue: {'depth': queue_depth(app, queue), 'wait': wait_stats(queue)}
+        for queue in queues
+    }
@@ -0,0 +1,260 @@
+import logging
+import time
+import uuid
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_client = None
+
+
+def get_redis_client():
+    """Return a process-wide Redis client for coordination between workers"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+
+class LeaseLost(Exception):
+    """Raised when work is about to be committed under an expired lease"""
+
+
+class RedisLease:
+    """
+    Exclusive, time-limited lease stored in Redis.
+
+    Only one holder can own the lease at a time; it expires after `ttl`
+    seconds if the holder dies. Every successful acquire also draws a
+    fencing token from a counter that only ever increases, so work done
+    under a lease can be tagged and stale holders rejected.
+    """
+    
+    RELEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+    
+    RENEW_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('pexpire', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    
+    def __init__(self, name, ttl, client=None):
+        self.name = name
+        self.ttl = ttl
+        self.client = client or get_redis_client()
+        self.key = f'lease:{name}'
+        self.fence_key = f'lease:{name}:fence'
+        self.token = None
+        self.fencing_token = None
+    
+    def acquire(self):
+        """Try to take the lease without waiting; returns True on success"""
+        token = uuid.uuid4().hex
+        if not self.client.set(self.key, token, nx=True, px=int(self.ttl * 1000)):
+            return False
+        
+        self.token = token
+        self.fencing_token = self.client.incr(self.fence_key)
+        return True
+    
+    def renew(self):
+        """Extend the lease by another ttl; returns False if it was lost"""
+        if self.token is None:
+            return False
+        return bool(self.client.eval(self.RENEW_SCRIPT, 1, self.key, self.token, int(self.ttl * 1000)))
+    
+    def release(self):
+        """Give the lease up, but only if this holder still owns it"""
+        if self.token is None:
+            return
+        try:
+            self.client.eval(self.RELEASE_SCRIPT, 1, self.key, self.token)
+        except redis.RedisError as e:
+            logger.warning(f"Failed to release lease {self.name}: {str(e)}")
+        finally:
+            self.token = None
+
+
+class RedisTokenBucket:
+    """
+    Token bucket stored in Redis and shared by every worker.
+
+    Tokens refill at `rate` per second up to `burst`. Callers reserve
+    tokens ahead of use: a reservation returns how long to wait until the
+    tokens are available, so concurrent workers queue up behind each other
+    instead of all sending at once. A reservation takes only as many
+    tokens as are available within its maximum wait, so a request larger
+    than the bucket is served in parts rather than refused forever. The
+    bucket is kept as the time at which it will next be full (GCRA), a
+    single value updated atomically.
+    """
+    
+    RESERVE_SCRIPT = """
+        local interval = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local count = tonumber(ARGV[3])
+        local max_wait = tonumber(ARGV[4])
+        local now = tonumber(ARGV[5])
+        local full_at = math.max(tonumber(redis.call('get', KEYS[1]) or 0), now)
+        local available = math.floor((now + max_wait + burst * interval - full_at) / interval)
+        local reserved = math.min(count, math.max(available, 0))
+        if reserved == 0 then
+            return {0, math.ceil(full_at + interval - burst * interval - now)}
+        end
+        local new_full_at = full_at + reserved * interval
+        local wait = math.max(new_full_at - burst * interval - now, 0)
+        redis.call('set', KEYS[1], new_full_at, 'px', math.ceil(new_full_at - now) + 1000)
+        return {reserved, math.ceil(wait)}
+    """
+    
+    def __init__(self, name, rate, burst, client=None):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.client = client or get_redis_client()
+        self.key = f'ratelimit:{name}'
+        # Milliseconds per token
+        self.interval = 1000.0 / rate
+    
+    def reserve(self, count=1, max_wait=0):
+        """
+        Reserve up to `count` tokens, as many as become available within
+        `max_wait` seconds. Returns (tokens reserved, seconds to wait); if
+        none could be reserved, the wait is until the next token is free.
+        """
+        reserved, wait = self.client.eval(
+            self.RESERVE_SCRIPT, 1, self.key,
+            self.interval, self.burst, count, int(max_wait * 1000), self._now_ms()
+        )
+        return int(reserved), int(wait) / 1000
+    
+    def _now_ms(self):
+        return int(time.time() * 1000)
+
+
+class RedisCircuitBreaker:
+    """
+    Circuit breaker stored in Redis and shared by every worker.
+
+    Closed: calls go through and failures are counted; `failure_threshold`
+    failures within `failure_window` seconds open the circuit. Open: calls
+    are refused for `reset_timeout` seconds. Half-open: after that, a
+    single caller is let through as a probe; its success closes the
+    circuit and its failure opens it again.
+
+    Once a process has seen the circuit open it remembers until when, so
+    refusing a call costs no Redis round trip.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    ALLOW_SCRIPT = """
+        local open_until = tonumber(redis.call('get', KEYS[1]))
+        if not open_until then
+            return {'closed', 0}
+        end
+        if tonumber(ARGV[1]) < open_until then
+            return {'open', open_until}
+        end
+        if redis.call('set', KEYS[2], 1, 'nx', 'px', ARGV[2]) then
+            return {'half_open', 0}
+        end
+        return {'open', tonumber(ARGV[1]) + 1000}
+    """
+    
+    FAILURE_SCRIPT = """
+        local failures = redis.call('incr', KEYS[2])
+        if failures == 1 then
+            redis.call('pexpire', KEYS[2], ARGV[1])
+        end
+        local open_until = tonumber(redis.call('get', KEYS[1]))
+        if open_until then
+            return {0, open_until}
+        end
+        if failures >= tonumber(ARGV[2]) then
+            redis.call('set', KEYS[1], ARGV[3])
+            return {1, tonumber(ARGV[3])}
+        end
+        return {0, 0}
+    """
+    
+    def __init__(self, name, failure_threshold, failure_window, reset_timeout, client=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.failure_window = failure_window
+        self.reset_timeout = reset_timeout
+        self.client = client or get_redis_client()
+        self.open_key = f'circuit:{name}:open_until'
+        self.probe_key = f'circuit:{name}:probe'
+        self.failures_key = f'circuit:{name}:failures'
+        # Until when this process knows the circuit is open, in ms
+        self._open_until = 0
+        # Set in the process that holds the half-open probe
+        self._probing = False
+    
+    def allow(self):
+        """
+        Return the state for the next call: CLOSED or HALF_OPEN (this caller
+        is the probe) to go ahead, OPEN to fail fast.
+        """
+        if self.is_open():
+            return self.OPEN
+        
+        state, open_until = self.client.eval(
+            self.ALLOW_SCRIPT, 2, self.open_key, self.probe_key,
+            self._now_ms(), int(self.reset_timeout * 1000)
+        )
+        state = state.decode() if isinstance(state, bytes) else state
+        if state == self.OPEN:
+            self._open_until = int(open_until)
+        elif state == self.HALF_OPEN:
+            self._probing = True
+        return state
+    
+    def is_open(self):
+        """Whether this process has seen the circuit open, without asking Redis"""
+        return self._now_ms() < self._open_until
+    
+    def record_success(self):
+        """Close the circuit if this was the probe; otherwise nothing to do"""
+        if not self._probing:
+            return
+        self._probing = False
+        self._open_until = 0
+        self.client.delete(self.open_key, self.probe_key, self.failures_key)
+        logger.info(f"Circuit {self.name} closed")
+    
+    def record_failure(self):
+        """Count a failure; returns True if the circuit is now open"""
+        open_until = self._now_ms() + int(self.reset_timeout * 1000)
+        
+        if self._probing:
+            self._probing = False
+            self._open_until = open_until
+            pipe = self.client.pipeline()
+            pipe.set(self.open_key, open_until)
+            pipe.delete(self.probe_key)
+            pipe.execute()
+            logger.warning(f"Circuit {self.name} probe failed, open for another {self.reset_timeout}s")
+            return True
+        
+        opened, current_open_until = self.client.eval(
+            self.FAILURE_SCRIPT, 2, self.open_key, self.failures_key,
+            int(self.failure_window * 1000), self.failure_threshold, open_until
+        )
+        if opened:
+            logger.warning(f"Circuit {self.name} opened for {self.reset_timeout}s")
+        self._open_until = max(self._open_until, int(current_open_until))
+        return self.is_open()
+    
+    def _now_ms(self):
+        return int(time.time() * 1000)